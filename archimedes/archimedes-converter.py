@@ -27,54 +27,3003 @@
 
 import sys
 import os
+import io
 import argparse
 import shutil
-from tempfile import mkdtemp
+from tempfile import mkdtemp, NamedTemporaryFile, TemporaryFile, gettempdir
 import shlex
 import re
 import datetime
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from dataclasses import dataclass, field, asdict
 from DATA.deb_arch_equivalent_dependencies import debian_to_arch
 import hashlib
+import json
+import mmap
+import pickle
+import glob
+import struct
+import subprocess
+import asyncio
+import signal
+import socket
+import multiprocessing
+import random
+import threading
+import queue
+import gzip
+import tarfile
+import lzma
+import bz2
+import zlib
+import time
+import cProfile
+import fcntl
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from stat import S_ISSOCK
+try:
+    import zstandard #opcional: si no está instalado se usa el comando "zstd"
+except ImportError:
+    zstandard = None
+
+__version__ = "1.1.0" #forma parte de la clave de la caché: cambiarla invalida los paquetes guardados
+
+
+class ArchimedesError(Exception):
+    """Error de conversión con un mensaje que se puede mostrar al usuario"""
+
+
+CHECKSUM_ALGORITHMS = { #algoritmos disponibles para .CHECKSUMS: nombre de la opción -> (etiqueta, constructor)
+    "sha256": ("SHA256", hashlib.sha256),
+    "b2": ("B2SUM", hashlib.blake2b),
+    "md5": ("MD5", hashlib.md5),
+}
+HASH_CHUNK_SIZE = 8 * 1024 * 1024 #bloques grandes para hashear con pocas llamadas
+
+
+def new_hashers(algorithms) -> dict:
+    """Crea un objeto hash por cada algoritmo pedido"""
+    return {algorithm: CHECKSUM_ALGORITHMS[algorithm][1]() for algorithm in algorithms}
+
+
+AR_MAGIC = b"!<arch>\n" #cabecera global de todo archivo ar (un .deb es un archivo ar)
+AR_HEADER_SIZE = 60 #cada miembro va precedido de una cabecera de 60 bytes
+
+
+class ArMember(io.RawIOBase):
+    """Vista de solo lectura sobre un miembro de un archivo ar.
+
+    No copia nada: lee directamente del .deb original a partir
+    del desplazamiento del miembro y nunca pasa de su tamaño"""
+
+    def __init__(self, archive, name:str, offset:int, size:int, mtime:int=0):
+        super().__init__()
+        self.archive = archive
+        self.member_name = name #no se llama "name" para que tarfile no lo tome por una ruta del disco
+        self.offset = offset #posición de los datos del miembro dentro del .deb
+        self.size = size
+        self.mtime = mtime #fecha de la cabecera ar (dpkg-deb pone la de la construcción o SOURCE_DATE_EPOCH)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        restante = self.size - self._pos
+        if restante <= 0:
+            return 0
+        data = self.archive.pread(min(len(buffer), restante), self.offset + self._pos) #pread no mueve el puntero compartido del archivo
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, pos:int, whence:int=io.SEEK_SET):
+        match whence:
+            case io.SEEK_SET:
+                self._pos = pos
+            case io.SEEK_CUR:
+                self._pos += pos
+            case io.SEEK_END:
+                self._pos = self.size + pos
+        if self._pos < 0:
+            raise ValueError("Posición negativa en el miembro ar")
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def peek(self, size:int, offset:int) -> bytes:
+        """Lee "size" bytes desde "offset" (negativo: desde el final) sin mover la posición ni contarlos en los checksums"""
+        if offset < 0:
+            offset = max(0, self.size + offset)
+        return self.archive.peek(min(size, self.size - offset), self.offset + offset)
+
+
+class ArReader():
+    """Lector de archivos ar (formato GNU y BSD).
+
+    Solo lee las cabeceras de los miembros; los datos se sirven bajo demanda
+    con vistas acotadas sobre el archivo original.
+
+    Si se pasan algoritmos, calcula los checksums del archivo completo con
+    los mismos bytes que se leen para convertirlo: como los miembros se leen
+    en orden, cada byte del .deb se lee del disco una sola vez. "known"
+    son digests ya calculados, que no se vuelven a calcular, y "extra",
+    algoritmos que se calculan en la misma pasada sin ir al .CHECKSUMS
+    (el sha256 de la clave de la caché; ver digest())"""
+
+    def __init__(self, path, algorithms=(), known:dict=None, extra=()):
+        if isinstance(path, (str, os.PathLike)):
+            self.path = path
+            self._fd = os.open(path, os.O_RDONLY)
+        else: #archivo ya abierto: se duplica el descriptor para poder cerrarlo sin tocar el del llamador
+            self.path = getattr(path, "name", None)
+            self._fd = os.dup(path.fileno())
+        self._algorithms = tuple(algorithms)
+        computed = dict.fromkeys((*self._algorithms, *extra))
+        self._known = {algorithm: digest for algorithm, digest in (known or {}).items() if algorithm in computed}
+        self._hashers = new_hashers([algorithm for algorithm in computed if algorithm not in self._known])
+        self._hashed = 0 #hasta qué byte del archivo se han calculado los checksums
+        self._hash_lock = threading.Lock()
+        try:
+            self.members = self._read_index()
+        except:
+            os.close(self._fd)
+            raise
+
+    def pread(self, size:int, offset:int) -> bytes:
+        data = os.pread(self._fd, size, offset)
+        if self._hashers and offset + len(data) > self._hashed:
+            with self._hash_lock:
+                self._hash_through(offset, data)
+        return data
+
+    def peek(self, size:int, offset:int) -> bytes:
+        """Lectura fuera de orden (cabeceras, índices) que no pasa por los checksums"""
+        return os.pread(self._fd, max(0, size), offset)
+
+    def _hash_through(self, offset:int, data:bytes):
+        """Añade a los checksums la parte de "data" que aún no se había contado"""
+        if offset > self._hashed: #hueco sin leer (cabeceras ar, miembros pequeños): se lee para no perder el orden
+            self._hash_until(offset)
+        end = offset + len(data)
+        if end > self._hashed:
+            new_data = memoryview(data)[self._hashed - offset:]
+            for hasher in self._hashers.values():
+                hasher.update(new_data)
+            self._hashed = end
+
+    def _hash_until(self, end:int):
+        while self._hashed < end:
+            chunk = os.pread(self._fd, min(HASH_CHUNK_SIZE, end - self._hashed), self._hashed)
+            if not chunk:
+                break
+            for hasher in self._hashers.values():
+                hasher.update(chunk)
+            self._hashed += len(chunk)
+
+    def digests(self) -> dict:
+        """Termina de calcular los checksums (lo que quede tras el último miembro leído)"""
+        digests = self._finish()
+        return {algorithm: digests[algorithm] for algorithm in self._algorithms} #en el orden pedido, como en el .CHECKSUMS
+
+    def digest(self, algorithm:str) -> str:
+        """Checksum de uno de los algoritmos calculados, también de los de "extra" (None si no se calcula)"""
+        return self._finish().get(algorithm)
+
+    def _finish(self) -> dict:
+        if self._hashers: #sin nada que calcular no hace falta leer el resto del archivo
+            with self._hash_lock:
+                self._hash_until(os.fstat(self._fd).st_size)
+        return {**self._known, **{algorithm: hasher.hexdigest() for algorithm, hasher in self._hashers.items()}}
+
+    def _read_index(self) -> list:
+        """Recorre las cabeceras y devuelve (nombre, desplazamiento, tamaño, fecha) de cada miembro"""
+        if os.pread(self._fd, len(AR_MAGIC), 0) != AR_MAGIC: #el índice no pasa por los checksums: solo se leen cabeceras sueltas
+            raise ArchimedesError(f"{self.path} no es un archivo .deb válido")
+
+        members = []
+        offset = len(AR_MAGIC)
+        file_size = os.fstat(self._fd).st_size
+        while offset + AR_HEADER_SIZE <= file_size:
+            header = os.pread(self._fd, AR_HEADER_SIZE, offset)
+            if header[58:60] != b"`\n": #todas las cabeceras terminan con estos dos bytes
+                raise ArchimedesError(f"Cabecera ar dañada en {self.path} (byte {offset})")
+            name = header[0:16].decode("ascii", "replace").rstrip()
+            try:
+                size = int(header[48:58])
+            except ValueError:
+                raise ArchimedesError(f"Tamaño de miembro inválido en {self.path} (byte {offset})")
+            try:
+                mtime = int(header[16:28])
+            except ValueError: #la fecha solo se usa en el modo reproducible: una vacía no invalida el .deb
+                mtime = 0
+            offset += AR_HEADER_SIZE
+
+            if name.startswith("#1/"): #formato BSD: el nombre va justo después de la cabecera
+                name_len = int(name[3:])
+                name = os.pread(self._fd, name_len, offset).decode("utf-8", "replace").rstrip("\0")
+                offset += name_len
+                size -= name_len
+            else:
+                name = name.rstrip("/") #formato GNU: el nombre termina con "/"
+
+            members.append((name, offset, size, mtime))
+            offset += size + (size % 2) #los miembros se alinean a 2 bytes
+        return members
+
+    def find(self, prefix:str):
+        """Devuelve el primer miembro cuyo nombre empiece por "prefix" o None"""
+        for name, offset, size, mtime in self.members:
+            if name.startswith(prefix):
+                return ArMember(self, name, offset, size, mtime)
+        return None
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+PKG_EXTENSIONS = { #extensión del paquete de salida según la compresión
+    "zst": ".pkg.tar.zst",
+    "xz": ".pkg.tar.xz",
+    "gz": ".pkg.tar.gz",
+    "none": ".pkg.tar",
+}
+DEFAULT_LEVELS = {"zst": 3, "xz": 6, "gz": 6, "none": 0} #niveles por defecto de cada compresor
+LEVEL_RANGES = {"zst": (1, 22), "xz": (0, 9), "gz": (0, 9), "none": (0, 0)}
+PAYLOAD_MANIFEST = "payload.mtree" #manifiesto de bsdtar del motor "dedup" (no forma parte del paquete)
+
+
+class ExternalCompressor():
+    """Compresor que delega en un comando externo (por ejemplo "zstd").
+
+    Tiene la misma interfaz que los "compressobj" de zlib/lzma: compress()
+    devuelve lo que el comando haya producido hasta ahora y flush() el resto"""
+
+    def __init__(self, command:list):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._chunks = []
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_output, daemon=True) #lee la salida a la vez para que el comando nunca se bloquee
+        self._reader.start()
+
+    def _read_output(self):
+        while chunk := self.process.stdout.read(1024 * 1024):
+            with self._lock:
+                self._chunks.append(chunk)
+
+    def _take(self) -> bytes:
+        with self._lock:
+            data = b"".join(self._chunks)
+            self._chunks.clear()
+        return data
+
+    def compress(self, data) -> bytes:
+        self.process.stdin.write(data)
+        return self._take()
+
+    def flush(self) -> bytes:
+        self.process.stdin.close()
+        self._reader.join()
+        if self.process.wait() != 0:
+            raise ArchimedesError(f"El compresor \"{self.process.args[0]}\" ha fallado")
+        return self._take()
+
+
+class PassthroughCompressor():
+    """Compresor que no comprime (paquetes .pkg.tar)"""
+
+    def compress(self, data) -> bytes:
+        return bytes(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def make_compressor(compression:str, level:int, threads:int):
+    """Devuelve un compresor con interfaz compress()/flush() para el formato pedido"""
+    match compression:
+        case "gz":
+            return zlib.compressobj(level, zlib.DEFLATED, 31) #wbits=31: cabecera y cola gzip
+        case "xz":
+            return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=level)
+        case "zst":
+            if zstandard is not None:
+                return zstandard.ZstdCompressor(level=level, threads=threads).compressobj() #compresión multihilo dentro del propio proceso
+            ultra = ["--ultra"] if level > 19 else []
+            return ExternalCompressor(["zstd", "-q", "-c", *ultra, f"-{level}", f"-T{threads}"])
+        case "none":
+            return PassthroughCompressor()
+    raise ArchimedesError(f"Compresión desconocida: {compression}")
+
+
+class CompressedWriter():
+    """Archivo de solo escritura que comprime todo lo que recibe.
+
+    tarfile escribe el paquete aquí y los datos comprimidos
+    van directamente al archivo de salida"""
+
+    def __init__(self, raw, compression:str, level:int, threads:int):
+        self.raw = raw
+        self.compression = compression
+        self.level = level
+        self.threads = threads
+        self.compressor = make_compressor(compression, level, threads)
+        self._written = 0 #bytes sin comprimir recibidos (tarfile usa tell())
+
+    def write(self, data) -> int:
+        self.raw.write(self.compressor.compress(data))
+        self._written += len(data)
+        return len(data)
+
+    def set_level(self, level:int):
+        """Comprime lo que se escriba a partir de ahora con otro nivel.
+
+        Termina la trama (o el stream) actual y empieza otra: gzip, xz y
+        zstd leen varias seguidas como un único flujo"""
+        if level == self.level:
+            return
+        self.raw.write(self.compressor.flush())
+        self.compressor = make_compressor(self.compression, level, self.threads)
+        self.level = level
+
+    def tell(self) -> int:
+        return self._written
+
+    def close(self):
+        self.raw.write(self.compressor.flush())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None: #si algo falló, el paquete a medias se borra igualmente
+            self.close()
+
+
+PIPELINE_CHUNK = 1024 * 1024 #tamaño de los bloques que pasan entre los hilos de descompresión, reempaquetado y compresión
+PIPELINE_DEPTH = 8 #bloques en cada cola: si una etapa va por detrás, la anterior espera (memoria acotada)
+ZSTD_FEED_SIZE = 128 * 1024 #entrada de cada llamada al descompresor zstd, que no tiene límite de salida
+
+
+class ThreadedCompressedWriter(CompressedWriter):
+    """CompressedWriter que comprime en un hilo aparte.
+
+    write() junta lo escrito en bloques de PIPELINE_CHUNK y los pasa al
+    hilo por una cola acotada; si el compresor va por detrás, write()
+    espera. Los compresores de zlib, lzma y zstandard sueltan el GIL, así
+    que la compresión avanza a la vez que se leen los miembros de data.tar.
+    "counter" y "wait_counter" (StageCounter o None) acumulan el tiempo de
+    compresión y el que se pasa esperando a que haya sitio en la cola"""
+
+    _ABORT = object()
+
+    def __init__(self, raw, compression:str, level:int, threads:int, counter=None, wait_counter=None):
+        super().__init__(raw, compression, level, threads)
+        self.counter = counter
+        self.wait_counter = wait_counter
+        self._buffer = bytearray()
+        self._queue = queue.Queue(PIPELINE_DEPTH)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="compress", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        block = b""
+        try:
+            while (block := self._queue.get()) is not None:
+                if block is self._ABORT:
+                    return
+                start = time.perf_counter()
+                if isinstance(block, int): #cambio de nivel (set_level): otra trama a partir de aquí
+                    self.raw.write(self.compressor.flush())
+                    self.compressor = make_compressor(self.compression, block, self.threads)
+                    if self.counter is not None:
+                        self.counter.seconds += time.perf_counter() - start
+                    continue
+                self.raw.write(self.compressor.compress(block))
+                if self.counter is not None:
+                    self.counter.seconds += time.perf_counter() - start
+                    self.counter.bytes += len(block)
+            self.raw.write(self.compressor.flush())
+        except BaseException as error:
+            self._error = error
+            while block is not None and block is not self._ABORT: #vacía la cola hasta el final para que write() no se quede esperando
+                block = self._queue.get()
+
+    def _send(self, block):
+        start = time.perf_counter()
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(block, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        if self.wait_counter is not None:
+            self.wait_counter.seconds += time.perf_counter() - start
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._written += len(data)
+        if len(self._buffer) >= PIPELINE_CHUNK:
+            self._send(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def set_level(self, level:int):
+        """Como CompressedWriter.set_level, pero el cambio viaja por la cola detrás de lo ya escrito"""
+        if level == self.level:
+            return
+        if self._buffer:
+            self._send(bytes(self._buffer))
+            self._buffer.clear()
+        self._send(level)
+        self.level = level
+
+    def close(self):
+        """Comprime lo que quede, espera al hilo y relanza su error, si lo hubo"""
+        if self._buffer:
+            self._send(bytes(self._buffer))
+            self._buffer.clear()
+        self._send(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        """Detiene el hilo sin terminar el flujo comprimido (el paquete a medias se va a borrar)"""
+        self._queue.put(self._ABORT)
+        self._thread.join()
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+ADAPTIVE_SAMPLE = 64 * 1024 #bytes del principio de cada miembro con los que se estima si se deja comprimir
+ADAPTIVE_MIN_MEMBER = 256 * 1024 #los miembros más pequeños van al nivel del paquete, sin muestrearlos
+ADAPTIVE_LOW_LEVELS = {"zst": 1, "xz": 0, "gz": 1} #nivel de los miembros que no se dejan comprimir
+ADAPTIVE_STEP = 8 * 1024 * 1024 #bytes comprimidos entre dos revisiones del presupuesto de tiempo
+ADAPTIVE_MIN_RUN = 1024 * 1024 #bytes seguidos que tienen que pedir otro nivel para cambiarlo (cada cambio cierra la trama)
+
+
+class AdaptiveCompression():
+    """Política de compresión adaptativa del motor "stream".
+
+    Antes de copiar cada miembro grande se comprime una muestra de su
+    principio con zlib a nivel 1; si no baja de "ratio" (PNG, vídeo,
+    .pak ya comprimidos...), el miembro va al nivel bajo del formato en
+    vez de gastar CPU en él. Con "budget" (segundos de compresión por
+    paquete) se baja además el nivel del resto cuando, al ritmo que lleva
+    el hilo de compresión, no daría tiempo. report() resume las decisiones.
+
+    Cada cambio de nivel cierra la trama zstd/xz y la siguiente empieza sin
+    diccionario, así que el compresor (el nivel "current") solo cambia
+    cuando lo piden al menos ADAPTIVE_MIN_RUN bytes seguidos (switch): si
+    los miembros se alternan, todos van en la misma trama"""
+
+    def __init__(self, compression:str, level:int, ratio:float, budget:float=None, total:int=None):
+        self.level = level #nivel del contenido que sí se comprime (el presupuesto puede bajarlo)
+        self.low = min(level, ADAPTIVE_LOW_LEVELS[compression])
+        self.initial = level
+        self.ratio = ratio
+        self.budget = budget
+        self.total = total #bytes de data.tar sin comprimir (None si no se sabe)
+        self.sampled = 0
+        self.stored = [] #miembros que no se dejan comprimir (van al nivel bajo si forman una racha)
+        self.changes = [] #bajadas de nivel por el presupuesto de tiempo
+        self.current = level #nivel con el que comprime ahora el compresor
+        self.switches = 0 #cambios de nivel del compresor (tramas nuevas)
+        self._run = 0 #bytes seguidos que piden un nivel distinto de "current"
+        self._checked = (0, 0.0) #bytes y segundos del hilo de compresión en la última revisión
+
+    def member_level(self, name:str, size:int, sample:bytes) -> int:
+        """Nivel de un miembro regular según la muestra de su principio (vacía si es pequeño)"""
+        if size < ADAPTIVE_MIN_MEMBER or not sample:
+            return self.level
+        self.sampled += 1
+        ratio = len(zlib.compress(sample, 1)) / len(sample)
+        if ratio < self.ratio:
+            return self.level
+        self.stored.append({"name": name, "size": size, "ratio": round(ratio, 3)})
+        return self.low
+
+    def switch(self, level:int, size:int) -> int:
+        """Nivel con el que se comprime un miembro de "size" bytes al que member_level ha asignado "level".
+
+        Los miembros vacíos (directorios, enlaces...) no cuentan para la racha"""
+        if size == 0:
+            return self.current
+        if level == self.current:
+            self._run = 0
+            return self.current
+        self._run += size
+        if self._run >= ADAPTIVE_MIN_RUN:
+            self.current, self._run = level, 0
+            self.switches += 1
+        return self.current
+
+    def check_budget(self, counter) -> bool:
+        """Baja el nivel si, al ritmo reciente de "counter" (el hilo de compresión), el paquete no cabe en el presupuesto.
+
+        Devuelve True si lo ha bajado"""
+        checked_bytes, checked_seconds = self._checked
+        if self.budget is None or self.level <= self.low or counter.bytes - checked_bytes < ADAPTIVE_STEP:
+            return False
+        self._checked = (counter.bytes, counter.seconds)
+        remaining = max(self.total - counter.bytes, 0) if self.total else 0 #sin el tamaño, solo cuenta lo ya gastado
+        rate = (counter.seconds - checked_seconds) / (counter.bytes - checked_bytes) #el del nivel actual, no el de todo el paquete
+        projected = counter.seconds + remaining * rate
+        if projected <= self.budget:
+            return False
+        self.level = self.low + (self.level - self.low) // 2
+        if self.current > self.low: #lo que ya va al nivel bajo sigue igual
+            self.current = self.level
+            self.switches += 1
+        self.changes.append({"offset": counter.bytes, "projected": round(projected, 3), "level": self.level})
+        return True
+
+    def report(self) -> dict:
+        """Decisiones tomadas, para el resultado de la conversión"""
+        return {
+            "policy": "adaptive",
+            "level": self.initial,
+            "final_level": self.level,
+            "low_level": self.low,
+            "ratio": self.ratio,
+            "budget": self.budget,
+            "sampled": self.sampled,
+            "stored": self.stored,
+            "stored_bytes": sum(member["size"] for member in self.stored),
+            "level_changes": self.changes,
+            "switches": self.switches,
+        }
+
+
+class BudgetedReader():
+    """Contenido de un miembro que revisa el presupuesto de AdaptiveCompression en cada lectura.
+
+    Así un archivo de cientos de MiB no se comprime entero al nivel
+    que ya no cabe: el nivel baja a mitad del miembro"""
+
+    def __init__(self, fileobj, adaptive:AdaptiveCompression, writer:CompressedWriter, counter):
+        self.fileobj = fileobj
+        self.adaptive = adaptive
+        self.writer = writer
+        self.counter = counter
+
+    def read(self, size=-1) -> bytes:
+        if self.adaptive.check_budget(self.counter):
+            self.writer.set_level(self.adaptive.current)
+        return self.fileobj.read(size)
+
+
+def detect_compression(head:bytes) -> str:
+    """Formato de un miembro tar.* según sus primeros bytes (no según su nombre)"""
+    if head.startswith(b"\x1f\x8b"):
+        return "gz"
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return "xz"
+    if head.startswith(b"BZh"):
+        return "bz2"
+    if head.startswith(b"\x28\xb5\x2f\xfd"):
+        return "zst"
+    if head[257:262] == b"ustar":
+        return "none"
+    raise ArchimedesError("Formato de compresión no soportado")
+
+
+class PrefixedReader():
+    """Archivo de lectura que devuelve primero "prefix" (lo ya leído para detectar el formato) y luego el resto del archivo"""
+
+    def __init__(self, prefix:bytes, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def read(self, size=-1) -> bytes:
+        if self.prefix:
+            data = self.prefix if size is None or size < 0 else self.prefix[:size]
+            self.prefix = self.prefix[len(data):]
+            if size is None or size < 0:
+                return data + self.fileobj.read()
+            if len(data) < size: #tarfile no admite lecturas cortas: se completa con el resto del archivo
+                data += self.fileobj.read(size - len(data))
+            return data
+        return self.fileobj.read(size)
+
+
+class StreamDecompressor():
+    """Descompresor incremental (gz, xz, bz2, zst) que entrega bloques acotados.
+
+    Así la memoria no depende de la tasa de compresión. Admite varios
+    streams seguidos (como "gzip -c a >> b") y el relleno de ceros entre ellos"""
+
+    def __init__(self, compression:str):
+        self.compression = compression
+        self._decompressor = self._new()
+        self._fed = False #si el stream actual ha recibido datos
+
+    def _new(self):
+        match self.compression:
+            case "gz":
+                return zlib.decompressobj(31)
+            case "xz":
+                return lzma.LZMADecompressor()
+            case "bz2":
+                return bz2.BZ2Decompressor()
+            case "zst" if zstandard is not None:
+                return zstandard.ZstdDecompressor().decompressobj()
+            case "none":
+                return None
+        raise ArchimedesError(f"Compresión desconocida: {self.compression}")
+
+    def feed(self, data:bytes):
+        """Genera los datos descomprimidos de "data" en bloques acotados"""
+        if self._decompressor is None:
+            for pos in range(0, len(data), PIPELINE_CHUNK):
+                yield data[pos:pos + PIPELINE_CHUNK]
+            return
+        while True:
+            if self._decompressor.eof: #fin de un stream: lo que sobra puede ser el siguiente
+                data = (self._decompressor.unused_data + data).lstrip(b"\x00")
+                self._decompressor, self._fed = self._new(), False
+                if not data:
+                    return
+            self._fed = self._fed or bool(data)
+            if self.compression == "zst": #zstandard no limita la salida: se le da la entrada en trozos pequeños
+                data = memoryview(data)
+                output = self._decompressor.decompress(data[:ZSTD_FEED_SIZE])
+                data = data[ZSTD_FEED_SIZE:]
+            else:
+                output = self._decompressor.decompress(data, PIPELINE_CHUNK)
+                if self.compression == "gz" and not self._decompressor.eof: #al terminar, lo que sobra ya está en unused_data
+                    data = self._decompressor.unconsumed_tail #zlib devuelve lo que no ha llegado a usar
+                else:
+                    data = b""
+            if output:
+                yield output
+            if self._decompressor.eof:
+                continue
+            if self.compression in ("gz", "zst") and not data:
+                return
+            if self.compression in ("xz", "bz2") and self._decompressor.needs_input:
+                return
+
+    def finish(self):
+        """Comprueba que el último stream ha terminado"""
+        if self._decompressor is not None and self._fed and not self._decompressor.eof:
+            raise EOFError("Los datos comprimidos están incompletos")
+
+
+class ThreadedDecompressor():
+    """Descomprime un miembro tar.* en un hilo aparte; read() entrega los datos ya descomprimidos.
+
+    El formato (sin comprimir, gz, xz, bz2 o zst) se detecta por los
+    primeros bytes, no por el nombre del miembro. La cola acotada frena al
+    hilo cuando quien lee (tarfile) va por detrás. "counter" y
+    "wait_counter" acumulan el tiempo de descompresión y el que read() pasa
+    esperando datos"""
+
+    def __init__(self, fileobj, counter=None, wait_counter=None):
+        self.fileobj = fileobj
+        self.counter = counter
+        self.wait_counter = wait_counter
+        self._queue = queue.Queue(PIPELINE_DEPTH)
+        self._stop = threading.Event()
+        self._block = b""
+        self._pos = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, name="decompress", daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False #quien leía ya no quiere más datos
+
+    def _blocks(self):
+        """Genera los datos descomprimidos en bloques de como mucho PIPELINE_CHUNK bytes"""
+        data = self.fileobj.read(PIPELINE_CHUNK)
+        compression = detect_compression(data)
+        if compression == "zst" and zstandard is None: #sin el módulo, el comando "zstd" descomprime
+            yield from self._external_zstd(data)
+            return
+        decompressor = StreamDecompressor(compression)
+        while data:
+            yield from decompressor.feed(data)
+            data = self.fileobj.read(PIPELINE_CHUNK)
+        decompressor.finish()
+
+    def _external_zstd(self, data:bytes):
+        """Descomprime con el comando "zstd", empezando por lo ya leído para detectar el formato"""
+        process = subprocess.Popen(["zstd", "-q", "-d", "-c"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        def feed():
+            try:
+                shutil.copyfileobj(PrefixedReader(data, self.fileobj), process.stdin, PIPELINE_CHUNK)
+            except OSError: #"zstd" terminó antes (datos no válidos o lector cerrado)
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+
+        feeder = threading.Thread(target=feed, name="zstd-feed", daemon=True)
+        feeder.start()
+        finished = False
+        try:
+            while block := process.stdout.read(PIPELINE_CHUNK):
+                yield block
+            finished = True
+        finally: #si quien lee se detiene antes, "zstd" termina al cerrarle la salida
+            process.stdout.close()
+            status = process.wait()
+            feeder.join()
+        if finished and status != 0:
+            raise EOFError("Los datos zstd no son válidos o están incompletos")
+
+    def _run(self):
+        try:
+            blocks = self._blocks()
+            while True:
+                start = time.perf_counter()
+                block = next(blocks, None)
+                if self.counter is not None:
+                    self.counter.seconds += time.perf_counter() - start
+                if block is None:
+                    break
+                if self.counter is not None:
+                    self.counter.bytes += len(block)
+                if not self._put(block):
+                    blocks.close()
+                    return
+            self._put(None)
+        except BaseException as error:
+            self._put(error)
+
+    def read(self, size=-1) -> bytes:
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(PIPELINE_CHUNK), b""))
+        while self._pos >= len(self._block):
+            if self._eof:
+                return b""
+            start = time.perf_counter()
+            item = self._queue.get()
+            if self.wait_counter is not None:
+                self.wait_counter.seconds += time.perf_counter() - start
+            if item is None or isinstance(item, BaseException):
+                self._eof = True
+                if item is not None:
+                    raise item
+                return b""
+            self._block, self._pos = item, 0
+        if self._pos == 0 and size >= len(self._block): #el bloque entero, sin copiarlo
+            data = self._block
+        else:
+            data = self._block[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_varint(data:bytes, pos:int) -> tuple:
+    """Entero de longitud variable de xz (7 bits por byte); devuelve (valor, siguiente posición)"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        value |= (byte & 0x7f) << shift
+        pos += 1
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def unpacked_size(member:ArMember):
+    """Tamaño de un miembro tar.* sin comprimir, según las cabeceras del compresor.
+
+    No descomprime nada: gzip lo guarda al final (ISIZE, módulo 4 GiB), xz
+    en el índice de su último stream y zstd en la cabecera de la trama, si
+    el compresor lo escribió. Devuelve None si no se puede saber"""
+    head = member.peek(18, 0)
+    try:
+        if head.startswith(b"\x1f\x8b"):
+            if member.size >= 2 ** 32: #ISIZE ya habrá dado la vuelta
+                return None
+            return struct.unpack("<I", member.peek(4, -4))[0]
+        if head.startswith(b"\xfd7zXZ\x00"):
+            footer = member.peek(12, -12)
+            if footer[10:] != b"YZ":
+                return None
+            index_size = (struct.unpack_from("<I", footer, 4)[0] + 1) * 4
+            index = member.peek(index_size, -12 - index_size)
+            if index[:1] != b"\x00":
+                return None
+            records, pos = read_varint(index, 1)
+            total = 0
+            for _ in range(records):
+                _, pos = read_varint(index, pos) #tamaño comprimido del bloque
+                uncompressed, pos = read_varint(index, pos)
+                total += uncompressed
+            return total
+        if head.startswith(b"\x28\xb5\x2f\xfd"):
+            descriptor = head[4]
+            single_segment = descriptor >> 5 & 1
+            size_bytes = (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+            if not size_bytes:
+                return None
+            pos = 5 + (0 if single_segment else 1) + (0, 1, 2, 4)[descriptor & 3] #descriptor de ventana e id del diccionario
+            size = int.from_bytes(head[pos:pos + size_bytes], "little")
+            return size + 256 if size_bytes == 2 else size
+        if member.peek(6, 257) in (b"ustar\x00", b"ustar "): #"magic" de la cabecera tar
+            return member.size #data.tar sin comprimir
+    except (IndexError, struct.error):
+        pass
+    return None
+
+
+MTREE_THREAD_THRESHOLD = 1024 * 1024 #a partir de este tamaño el archivo se hashea en un hilo aparte
+MTREE_QUEUE_CHUNKS = 64 #bloques pendientes por archivo: limita la memoria si el hilo va por detrás
+
+
+class FileDigest():
+    """sha256 y md5 de un archivo, calculados en el hilo que lo copia"""
+
+    def __init__(self):
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+
+    def update(self, data):
+        self._sha256.update(data)
+        self._md5.update(data)
+
+    def finish(self):
+        pass
+
+    def result(self) -> tuple:
+        return self._md5.hexdigest(), self._sha256.hexdigest()
+
+
+class ThreadedFileDigest(FileDigest):
+    """sha256 y md5 de un archivo grande, calculados en un hilo del pool.
+
+    Los bloques se encolan en orden y un único hilo los consume, así que el
+    hilo principal sigue copiando mientras se hashea (hashlib suelta el GIL)"""
+
+    def __init__(self, pool:ThreadPoolExecutor):
+        super().__init__()
+        self._queue = queue.Queue(MTREE_QUEUE_CHUNKS)
+        self._future = pool.submit(self._consume)
+
+    def _consume(self):
+        while (chunk := self._queue.get()) is not None:
+            FileDigest.update(self, chunk)
+        return FileDigest.result(self)
+
+    def update(self, data):
+        self._queue.put(bytes(data))
+
+    def finish(self):
+        self._queue.put(None) #marca de fin: el hilo termina en cuanto vacía la cola
+
+    def result(self) -> tuple:
+        return self._future.result()
+
+
+class HashingWriter():
+    """Pasa lo escrito al archivo de salida y calcula su sha256 a la vez (para la base de datos del repositorio)"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        return self.raw.write(data)
+
+
+class DigestingReader():
+    """Envuelve el contenido de un miembro de data.tar y pasa cada bloque leído
+    al digest (y, si se indica, a la captura de cabeceras ELF)"""
+
+    def __init__(self, fileobj, *sinks):
+        self.fileobj = fileobj
+        self.sinks = [sink for sink in sinks if sink is not None]
+
+    def read(self, size=-1) -> bytes:
+        data = self.fileobj.read(size)
+        if data:
+            for sink in self.sinks:
+                sink.update(data)
+        return data
+
+
+ELF_MAGIC = b"\x7fELF"
+ELF_LAYOUT_LIMIT = 64 * 1024 #cabecera y tabla de programas deben caber aquí (en la práctica ocupan menos de 1 KiB)
+ELF_PREFIX_LIMIT = 16 * 1024 * 1024 #máximo que se guarda del principio de un ELF para leer su tabla de cadenas
+PT_LOAD, PT_DYNAMIC = 1, 2
+DT_NULL, DT_NEEDED, DT_STRTAB, DT_STRSZ, DT_SONAME = 0, 1, 5, 10, 14
+
+
+def elf_program_table(header:bytes):
+    """(posición, tamaño de entrada, número de entradas) de la tabla de programas, o None si no es un ELF"""
+    if len(header) < 52 or header[:4] != ELF_MAGIC or header[4] not in (1, 2):
+        return None
+    endian = "<" if header[5] == 1 else ">"
+    if header[4] == 2:
+        phoff, = struct.unpack_from(f"{endian}Q", header, 32)
+        phentsize, phnum = struct.unpack_from(f"{endian}HH", header, 54)
+    else:
+        phoff, = struct.unpack_from(f"{endian}I", header, 28)
+        phentsize, phnum = struct.unpack_from(f"{endian}HH", header, 42)
+    if phoff + phentsize * phnum > ELF_LAYOUT_LIMIT:
+        return None
+    return phoff, phentsize, phnum
+
+
+def elf_layout(read):
+    """Lee la cabecera y la tabla de programas de un ELF.
+
+    "read(desplazamiento, tamaño)" devuelve bytes del archivo. Retorna
+    (formato, segmento dinámico, segmentos PT_LOAD) o None si no es un ELF
+    dinámico"""
+    header = read(0, 64)
+    program_table = elf_program_table(header)
+    if program_table is None:
+        return None
+    phoff, phentsize, phnum = program_table
+    endian = "<" if header[5] == 1 else ">"
+    is_64 = header[4] == 2
+    phdr_format, word = (f"{endian}IIQQQQQQ", "Q") if is_64 else (f"{endian}IIIIIIII", "I")
+    if phentsize < struct.calcsize(phdr_format):
+        return None
+
+    table = read(phoff, phentsize * phnum)
+    dynamic, loads = None, []
+    for i in range(min(phnum, len(table) // phentsize)):
+        fields = struct.unpack_from(phdr_format, table, i * phentsize)
+        if is_64:
+            p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = fields
+        else:
+            p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = fields
+        if p_type == PT_DYNAMIC:
+            dynamic = (p_offset, p_filesz)
+        elif p_type == PT_LOAD:
+            loads.append((p_vaddr, p_offset, p_filesz))
+    if dynamic is None: #ejecutable estático: no depende de bibliotecas
+        return None
+    return (endian, word), dynamic, loads
+
+
+def elf_dynamic_info(read) -> tuple:
+    """Devuelve (sonames DT_NEEDED, DT_SONAME propio) de un ELF leyendo solo
+    la cabecera, la tabla de programas, la sección dinámica y su tabla de cadenas"""
+    layout = elf_layout(read)
+    if layout is None:
+        return [], None
+    (endian, word), (dyn_offset, dyn_size), loads = layout
+    entry_format = f"{endian}{"q" if word == "Q" else "i"}{word}"
+    entry_size = struct.calcsize(entry_format)
+    dynamic = read(dyn_offset, dyn_size)
+
+    needed, soname, strtab, strsz = [], None, None, 0
+    for position in range(0, len(dynamic) - entry_size + 1, entry_size):
+        tag, value = struct.unpack_from(entry_format, dynamic, position)
+        if tag == DT_NULL:
+            break
+        if tag == DT_NEEDED:
+            needed.append(value)
+        elif tag == DT_SONAME:
+            soname = value
+        elif tag == DT_STRTAB:
+            strtab = value
+        elif tag == DT_STRSZ:
+            strsz = value
+    if strtab is None:
+        return [], None
+
+    for vaddr, offset, size in loads: #DT_STRTAB es una dirección virtual: se traduce a posición en el archivo
+        if vaddr <= strtab < vaddr + size:
+            strtab = strtab - vaddr + offset
+            break
+    else:
+        return [], None
+    strings = read(strtab, strsz)
+
+    def string(index):
+        end = strings.find(b"\0", index)
+        return strings[index:end].decode("utf-8", "replace") if 0 <= index < end else None
+
+    names = [name for name in (string(index) for index in needed) if name]
+    return names, (string(soname) if soname is not None else None)
+
+
+class ElfCapture():
+    """Guarda, mientras el archivo se copia, solo lo necesario para leer sus DT_NEEDED:
+    el principio del archivo (cabeceras y tabla de cadenas) y el segmento dinámico"""
+
+    def __init__(self):
+        self.done = False #True cuando ya se sabe que no hace falta guardar nada más
+        self.layout = None
+        self._prefix = bytearray()
+        self._prefix_limit = ELF_LAYOUT_LIMIT
+        self._dynamic = bytearray()
+        self._position = 0
+
+    def update(self, data):
+        if self.done:
+            return
+        start = self._position
+        self._position += len(data)
+        if start < self._prefix_limit:
+            self._prefix += data[:self._prefix_limit - start]
+
+        if self.layout is None:
+            if len(self._prefix) >= 4 and self._prefix[:4] != ELF_MAGIC: #no es un ELF: no se guarda nada más
+                self._discard()
+                return
+            if len(self._prefix) < 64:
+                return
+            program_table = elf_program_table(bytes(self._prefix[:64]))
+            if program_table is None:
+                self._discard()
+                return
+            phoff, phentsize, phnum = program_table
+            if len(self._prefix) < phoff + phentsize * phnum: #la tabla de programas aún no ha llegado
+                return
+            try:
+                self.layout = elf_layout(self._read_prefix)
+            except struct.error:
+                self.layout = None
+            if self.layout is None:
+                self._discard()
+                return
+            _, (dyn_offset, dyn_size), loads = self.layout
+            #la tabla de cadenas dinámica vive en el primer segmento cargable (el que empieza en 0), junto a las cabeceras
+            first_load = min((offset + size for _, offset, size in loads if offset == 0), default=dyn_offset + dyn_size)
+            self._prefix_limit = max(len(self._prefix), min(first_load, ELF_PREFIX_LIMIT))
+            if len(self._prefix) < self._prefix_limit: #el resto de este bloque también entra ahora en el prefijo
+                self._prefix += data[len(self._prefix) - start:self._prefix_limit - start]
+
+        _, (dyn_offset, dyn_size), _ = self.layout
+        low, high = max(start, dyn_offset, self._prefix_limit), min(self._position, dyn_offset + dyn_size)
+        if low < high: #el segmento dinámico queda más allá del prefijo: se guarda aparte
+            self._dynamic += data[low - start:high - start]
+
+    def _discard(self):
+        self.done = True
+        self._prefix = self._dynamic = None
+
+    def _read_prefix(self, offset:int, size:int) -> bytes:
+        return bytes(self._prefix[offset:offset + size])
+
+    def _read(self, offset:int, size:int) -> bytes:
+        if offset + size <= len(self._prefix):
+            return self._read_prefix(offset, size)
+        _, (dyn_offset, _), _ = self.layout
+        start = max(dyn_offset, self._prefix_limit)
+        if offset >= start:
+            return bytes(self._dynamic[offset - start:offset - start + size])
+        return self._read_prefix(offset, size) #solo hay una parte (la tabla de cadenas quedó fuera del límite)
+
+    def parse(self) -> tuple:
+        try:
+            return elf_dynamic_info(self._read)
+        except struct.error: #ELF truncado o dañado
+            return [], None
+
+
+def read_file_range(path:str):
+    """Función "read(desplazamiento, tamaño)" sobre un archivo del disco"""
+    def read(offset:int, size:int) -> bytes:
+        with open(path, "rb") as file:
+            return os.pread(file.fileno(), size, offset)
+    return read
+
+
+class ElfScanner():
+    """Reúne los DT_NEEDED de todos los ELF del paquete.
+
+    El análisis de cada archivo se hace en un pool de hilos; el resultado
+    descarta las bibliotecas que el propio paquete ya incluye"""
+
+    def __init__(self, pool:ThreadPoolExecutor):
+        self.pool = pool
+        self._futures = []
+        self.files = set() #nombres de archivo del paquete (una biblioteca incluida no es una dependencia)
+
+    def capture(self, tarinfo:tarfile.TarInfo):
+        """Devuelve una captura para alimentar con el contenido del miembro, o None"""
+        self.files.add(os.path.basename(tarinfo.name))
+        if not tarinfo.isreg() or tarinfo.size < 64:
+            return None
+        return ElfCapture()
+
+    def submit(self, capture):
+        if capture is not None and capture.layout is not None and not capture.done:
+            self._futures.append(self.pool.submit(capture.parse))
+
+    def add_path(self, path:str):
+        """Analiza un archivo ya extraído (motor "extract"), leyendo solo sus cabeceras"""
+        self.files.add(os.path.basename(path))
+        if os.path.isfile(path) and not os.path.islink(path):
+            self._futures.append(self.pool.submit(self._parse_path, path))
+
+    def _parse_path(self, path:str) -> tuple:
+        try:
+            return elf_dynamic_info(read_file_range(path))
+        except (OSError, struct.error):
+            return [], None
+
+    def needed(self) -> list:
+        """Sonames que el paquete necesita y no incluye"""
+        needed, provided = set(), set(self.files)
+        for future in self._futures:
+            names, soname = future.result()
+            needed.update(names)
+            if soname:
+                provided.add(soname)
+        return sorted(needed - provided)
+
+
+def mtree_escape(path:str) -> str:
+    """Escapa una ruta para .MTREE (espacios, "#", "=", "\\" y no ASCII en octal)"""
+    escaped = []
+    for byte in path.encode("utf-8", "surrogateescape"):
+        if byte <= 0x20 or byte >= 0x7f or byte in b"#=\\":
+            escaped.append(f"\\{byte:03o}")
+        else:
+            escaped.append(chr(byte))
+    return "".join(escaped)
+
+
+class MtreeBuilder():
+    """Genera el .MTREE del paquete a partir de las cabeceras que se van copiando.
+
+    pacman lo usa para validar los archivos instalados ("pacman -Qkk")"""
+
+    def __init__(self, threads:int):
+        self.pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="mtree")
+        self._entries = [] #(tarinfo, digest)
+        self._digests = {} #ruta -> digest, para los enlaces duros
+
+    def add(self, tarinfo:tarfile.TarInfo, streaming:bool=True):
+        """Registra un miembro y devuelve el digest que hay que alimentar con su contenido (o None).
+
+        Con "streaming" los archivos grandes se hashean en el pool mientras se copian"""
+        digest = None
+        if tarinfo.isreg():
+            digest = ThreadedFileDigest(self.pool) if streaming and tarinfo.size >= MTREE_THREAD_THRESHOLD else FileDigest()
+            self._digests[tarinfo.name] = digest
+        elif tarinfo.islnk(): #un enlace duro tiene el mismo contenido que su destino
+            digest = self._digests.get(tarinfo.linkname)
+        self._entries.append((tarinfo, digest))
+        return digest if tarinfo.isreg() else None
+
+    def add_data(self, tarinfo:tarfile.TarInfo, data:bytes):
+        """Registra un archivo generado (.PKGINFO) cuyo contenido ya está en memoria"""
+        self.add(tarinfo).update(data)
+
+    def render(self) -> bytes:
+        """Devuelve el .MTREE comprimido con gzip, como lo genera makepkg"""
+        lines = ["#mtree", "/set type=file uid=0 gid=0 mode=644"]
+        sizes = {tarinfo.name: tarinfo.size for tarinfo, _ in self._entries if tarinfo.isreg()}
+        for tarinfo, digest in self._entries:
+            fields = [f"./{mtree_escape(tarinfo.name)}", f"time={int(tarinfo.mtime)}.0"]
+            if tarinfo.mode & 0o7777 != 0o644:
+                fields.append(f"mode={tarinfo.mode & 0o7777:o}")
+            if tarinfo.uid:
+                fields.append(f"uid={tarinfo.uid}")
+            if tarinfo.gid:
+                fields.append(f"gid={tarinfo.gid}")
+            if tarinfo.isdir():
+                fields.append("type=dir")
+            elif tarinfo.issym():
+                fields.extend(["type=link", f"link={mtree_escape(tarinfo.linkname)}"])
+            elif tarinfo.isreg() or (tarinfo.islnk() and digest is not None):
+                md5, sha256 = digest.result()
+                fields.extend([f"size={sizes.get(tarinfo.linkname if tarinfo.islnk() else tarinfo.name, 0)}",
+                               f"md5digest={md5}", f"sha256digest={sha256}"])
+            else: #dispositivos y fifos no se validan
+                continue
+            lines.append(" ".join(fields))
+        return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), mtime=0)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def default_cache_dir() -> str:
+    """Directorio de la caché: $XDG_CACHE_HOME/archimedes o ~/.cache/archimedes"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "archimedes")
+
+
+def dependency_map_version() -> str:
+    """Huella del diccionario "debian_to_arch": si cambia el mapeo, cambian los paquetes"""
+    return hashlib.sha256(repr(sorted(debian_to_arch.items())).encode("utf-8")).hexdigest()[:16]
+
+
+class StageCounter():
+    """Tiempo y bytes de una etapa de la conversión. Se usa como gestor de contexto
+    (una medición) o como acumulador (varias, por ejemplo cada lectura de data.tar)"""
+    __slots__ = ("name", "seconds", "bytes", "_start")
+
+    def __init__(self, name:str, size:int=0):
+        self.name = name
+        self.seconds = 0.0
+        self.bytes = size
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self._start
+
+
+class _NullStage():
+    """Etapa que no mide nada: es lo que se usa con las mediciones desactivadas"""
+    __slots__ = ("bytes",)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+class StageTimings():
+    """Tiempos de cada etapa de una conversión.
+
+    Desactivado, stage() devuelve siempre el mismo objeto vacío y no se
+    envuelve ningún flujo, así que no cuesta más que una llamada por etapa"""
+
+    def __init__(self, enabled:bool=False):
+        self.enabled = enabled
+        self.stages = []
+        self._accumulators = {} #etapas repartidas en muchas llamadas (una por miembro de data.tar)
+
+    def stage(self, name:str, size:int=0):
+        if not self.enabled:
+            return NULL_STAGE
+        counter = StageCounter(name, size)
+        self.stages.append(counter)
+        return counter
+
+    def counter(self, name:str):
+        """Acumulador de una etapa repartida en muchas llamadas o hecha en otro hilo (None si está desactivado)"""
+        if not self.enabled:
+            return None
+        if name not in self._accumulators:
+            self._accumulators[name] = self.stage(name)
+        return self._accumulators[name]
+
+    def wrap(self, fileobj, name:str):
+        """Mide el tiempo y los bytes de cada read()/write() sobre "fileobj" (solo si está activado)"""
+        if not self.enabled:
+            return fileobj
+        return TimedStream(fileobj, self.counter(name))
+
+    def report(self) -> list:
+        return [{"stage": counter.name, "seconds": counter.seconds, "bytes": counter.bytes,
+                 "throughput": counter.bytes / counter.seconds if counter.bytes and counter.seconds else None} #bytes por segundo
+                for counter in self.stages]
+
+
+class TimedStream():
+    """Envuelve un archivo y acumula en un StageCounter lo que tardan sus lecturas y escrituras"""
+
+    def __init__(self, fileobj, counter:StageCounter):
+        self.fileobj = fileobj
+        self.counter = counter
+
+    def read(self, size=-1) -> bytes:
+        start = time.perf_counter()
+        data = self.fileobj.read(size)
+        self.counter.seconds += time.perf_counter() - start
+        self.counter.bytes += len(data)
+        return data
+
+    def write(self, data) -> int:
+        start = time.perf_counter()
+        written = self.fileobj.write(data)
+        self.counter.seconds += time.perf_counter() - start
+        self.counter.bytes += len(data)
+        return written
+
+    def tell(self) -> int:
+        return self.fileobj.tell()
+
+
+def format_size(size:float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_timings(timings:list) -> str:
+    """Tabla legible de StageTimings.report()"""
+    lines = [f"{"Etapa":<14}{"Tiempo":>10}{"Datos":>12}{"Velocidad":>14}"]
+    for timing in timings:
+        size = format_size(timing["bytes"]) if timing["bytes"] else "-"
+        speed = f"{format_size(timing["throughput"])}/s" if timing["throughput"] else "-"
+        lines.append(f"{timing["stage"]:<14}{timing["seconds"]:>9.3f}s{size:>12}{speed:>14}")
+    return "\n".join(lines)
+
+
+class ConversionCache():
+    """Caché persistente de paquetes ya convertidos, direccionada por contenido.
+
+    La clave combina el sha256 del .deb con la versión del conversor, la del
+    mapa de dependencias y los ajustes que cambian el paquete generado. Un
+    acierto enlaza (hardlink) el paquete guardado en la ruta de salida. El
+    tamaño total se limita borrando primero los paquetes usados hace más tiempo.
+
+    Para no leer cada .deb dos veces (una para la clave y otra para
+    convertirlo), stats/ recuerda el (dispositivo, inodo, tamaño, fecha) de
+    los .deb ya convertidos: solo esos se hashean antes de convertir. Los
+    demás se convierten directamente y la clave sale del sha256 calculado
+    en la misma lectura (ArReader)"""
+
+    STAT_TTL = 30 * 24 * 3600 #segundos sin usarse tras los que se olvida un .deb
+
+    def __init__(self, directory:str, max_size:int):
+        self.directory = directory
+        self.objects = os.path.join(directory, "objects")
+        self.stats = os.path.join(directory, "stats")
+        self.max_size = max_size
+
+    def _stat_path(self, input_file:str):
+        """Entrada de stats/ del .deb tal como está ahora en el disco (None si no existe)"""
+        try:
+            stat = os.stat(input_file)
+        except OSError:
+            return None
+        name = hashlib.sha256(f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}".encode("ascii")).hexdigest()
+        return os.path.join(self.stats, name[:2], name)
+
+    def seen(self, input_file:str) -> bool:
+        """Indica si este mismo archivo (sin cambios desde entonces) ya se convirtió con la caché"""
+        path = self._stat_path(input_file)
+        if path is None:
+            return False
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def remember(self, input_file:str, digest:str):
+        """Anota el .deb recién convertido: la próxima vez se hashea antes de convertir para buscarlo"""
+        path = self._stat_path(input_file)
+        if path is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(digest)
+        os.replace(temporary, path)
+
+    def key(self, digest:str, settings:dict) -> str:
+        fields = {"sha256": digest, "version": __version__, "dependencies": dependency_map_version(), **settings}
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path(self, key:str, extension:str) -> str:
+        return os.path.join(self.objects, key[:2], f"{key}{extension}")
+
+    def fetch(self, key:str, extension:str, output_file:str):
+        """Pone en "output_file" el paquete guardado, si existe.
+
+        Devuelve los metadatos guardados con él (un diccionario, vacío si no
+        los hay) o None si no está en la caché"""
+        cached = self.path(key, extension)
+        try:
+            os.utime(cached) #la fecha de modificación marca el último uso (LRU)
+        except FileNotFoundError:
+            return None
+        self._place(cached, output_file)
+        try:
+            with open(f"{cached}.json", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def store(self, key:str, extension:str, output_file:str, metadata:dict=None):
+        """Guarda el paquete recién convertido (y sus metadatos) y recorta la caché si se pasa del límite"""
+        cached = self.path(key, extension)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        if metadata is not None: #antes que el paquete: un acierto nunca encuentra el paquete sin sus metadatos
+            temporary = f"{cached}.json.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(metadata, file)
+            os.replace(temporary, f"{cached}.json")
+        self._place(output_file, cached)
+        self.evict()
+
+    def _place(self, source:str, destination:str):
+        """Enlaza "source" en "destination" (o lo copia si están en sistemas de archivos distintos), de forma atómica"""
+        try:
+            if os.path.samefile(source, destination): #ya enlazado en un acierto anterior
+                return
+        except FileNotFoundError:
+            pass
+        temporary = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(source, temporary)
+        except OSError:
+            shutil.copyfile(source, temporary)
+        try:
+            os.replace(temporary, destination) #nunca se ve un paquete a medio copiar
+        finally:
+            #rename() no hace nada si los dos nombres son el mismo archivo (otro proceso los enlazó a la vez)
+            if os.path.lexists(temporary):
+                os.remove(temporary)
+
+    def evict(self):
+        """Borra los paquetes menos usados hasta quedar por debajo del límite"""
+        entries = []
+        for root, _, files in os.walk(self.objects):
+            for name in files:
+                if name.endswith((".json", ".tmp")): #los metadatos se borran con su paquete
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError: #otro proceso lo ha borrado a la vez
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            for stale in (path, f"{path}.json"):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+            total -= size
+        limit = time.time() - self.STAT_TTL
+        for root, _, files in os.walk(self.stats): #los .deb que ya no se convierten (o que han cambiado)
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime < limit:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+class PayloadStore():
+    """Almacén de los archivos de data.tar direccionado por su sha256 (motor "dedup").
+
+    Cada contenido se guarda una sola vez en blobs/ab/<sha256>, aunque
+    aparezca en muchas versiones del mismo paquete o en paquetes distintos;
+    bsdtar lo lee directamente del almacén al crear cada paquete. El
+    sha256 es el mismo que va al .MTREE, así que no hay que hashear nada
+    más. El tamaño se limita borrando primero los blobs usados hace más
+    tiempo"""
+
+    MEMORY_LIMIT = 8 * 1024 * 1024 #los archivos más pequeños se leen a memoria antes de saber si ya están
+    GRACE = 3600 #segundos: un blob usado hace menos no se borra (otra conversión puede estar empaquetándolo)
+
+    def __init__(self, directory:str, max_size:int):
+        self.directory = directory
+        self.blobs = os.path.join(directory, "blobs")
+        self.spool = os.path.join(directory, "tmp")
+        self.max_size = max_size
+        self.added = 0 #bytes escritos en el almacén por esta instancia
+        self.reused = 0 #bytes que ya estaban
+
+    def path(self, sha256:str) -> str:
+        return os.path.join(self.blobs, sha256[:2], sha256)
+
+    def _touch(self, path:str) -> bool:
+        """Marca el blob como usado (LRU); devuelve False si no existe"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def add(self, content, size:int, digest) -> str:
+        """Guarda el contenido que se lee de "content" y devuelve la ruta de su blob.
+
+        "content" tiene que alimentar a "digest" (un FileDigest) al leerse:
+        su sha256 decide si el blob ya estaba"""
+        if size <= self.MEMORY_LIMIT:
+            data = content.read()
+            digest.finish()
+            path = self.path(digest.result()[1])
+            if self._touch(path):
+                self.reused += size
+                return path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(data)
+        else: #los grandes van a un archivo temporal mientras se hashean
+            os.makedirs(self.spool, exist_ok=True)
+            with NamedTemporaryFile(dir=self.spool, suffix=".tmp", delete=False) as file:
+                temporary = file.name
+                try:
+                    shutil.copyfileobj(content, file, 1024 * 1024)
+                except BaseException:
+                    file.close()
+                    os.remove(temporary)
+                    raise
+            digest.finish()
+            path = self.path(digest.result()[1])
+            if self._touch(path):
+                os.remove(temporary)
+                self.reused += size
+                return path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temporary, path) #nunca se ve un blob a medio escribir
+        self.added += size
+        return path
+
+    def evict(self):
+        """Borra los blobs menos usados hasta quedar por debajo del límite, y los temporales abandonados"""
+        now = time.time()
+        entries = []
+        for directory in (self.blobs, self.spool):
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                        if name.endswith(".tmp"):
+                            if now - stat.st_mtime > self.GRACE: #de una conversión que se interrumpió
+                                os.remove(path)
+                            continue
+                    except FileNotFoundError: #otro proceso lo ha borrado a la vez
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size or now - mtime < self.GRACE:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class DirectoryReaper():
+    """Borra directorios en un hilo aparte para que la conversión siguiente no espere.
+
+    El hilo solo vive mientras hay algo que borrar y no es daemon: al salir,
+    el intérprete (también el de cada paquete de un lote) espera a que termine"""
+
+    def __init__(self):
+        self._pid = None
+
+    def remove(self, path:str):
+        if self._pid != os.getpid(): #primer uso, o proceso hijo creado con fork: el hilo del padre no existe aquí
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._lock = threading.Lock()
+            self._thread = None
+        self._queue.put(path)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="reaper")
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                path = self._queue.get_nowait()
+            except queue.Empty:
+                with self._lock: #remove() pone en la cola antes de mirar si el hilo sigue vivo
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            shutil.rmtree(path, True)
+
+
+REAPER = DirectoryReaper()
+
+
+def free_space(path:str) -> int:
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def available_memory() -> int:
+    """Memoria disponible (MemAvailable) en bytes"""
+    try:
+        with open("/proc/meminfo", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def default_tmpfs_dir():
+    return "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+
+class WorkspaceManager():
+    """Directorios de trabajo temporales de los motores "extract" y "dedup".
+
+    Si el paquete descomprimido cabe en el presupuesto de memoria se crean
+    en un tmpfs (/dev/shm); si no, en el directorio temporal normal. Antes
+    de extraer nada se comprueba que hay espacio libre suficiente, y al
+    terminar se borran en segundo plano con REAPER. Los nombres llevan el
+    pid del proceso: lo que dejó un proceso que murió se borra al arrancar"""
+
+    PREFIX = "archimedes-"
+    MARGIN = 1.1 #el contenido extraído ocupa algo más que el tar (bloques del sistema de archivos)
+    _swept = set() #directorios ya revisados por este proceso
+    _swept_lock = threading.Lock() #convert_stream se puede llamar desde varios hilos a la vez
+
+    def __init__(self, tmpfs_dir, memory_budget:int, disk_dir:str=None):
+        self.tmpfs_dir = tmpfs_dir
+        self.memory_budget = memory_budget
+        self.disk_dir = disk_dir or gettempdir()
+
+    def choose(self, size:int) -> str:
+        """Directorio base para un paquete que ocupa "size" bytes descomprimido"""
+        needed = int(size * self.MARGIN) + 1024 * 1024
+        if self.tmpfs_dir and needed <= self.memory_budget and needed <= free_space(self.tmpfs_dir):
+            return self.tmpfs_dir
+        free = free_space(self.disk_dir)
+        if needed > free: #mejor ahora que a mitad de la extracción
+            raise ArchimedesError(f"No hay espacio suficiente en {self.disk_dir}: hacen falta {format_size(needed)} y quedan {format_size(free)}")
+        return self.disk_dir
+
+    @contextmanager
+    def workspace(self, size:int=0):
+        self.sweep()
+        base = self.choose(size)
+        path = mkdtemp(prefix=f"{self.PREFIX}{os.getpid()}-", dir=base)
+        try:
+            yield path
+        finally:
+            REAPER.remove(path)
+
+    def sweep(self):
+        """Borra los directorios de trabajo de procesos que ya no existen (una vez por proceso y directorio)"""
+        for base in filter(None, (self.tmpfs_dir, self.disk_dir)):
+            key = (os.getpid(), base)
+            with self._swept_lock: #solo un hilo lo revisa; los demás siguen (sus directorios llevan el pid de un proceso vivo)
+                if key in self._swept:
+                    continue
+                self._swept.add(key)
+            self._sweep_dir(base)
+
+    def _sweep_dir(self, base:str):
+        try:
+            names = os.listdir(base)
+        except OSError:
+            return
+        for name in names:
+            if not name.startswith(self.PREFIX):
+                continue
+            pid = name[len(self.PREFIX):].split("-", 1)[0]
+            if not pid.isdigit() or int(pid) == os.getpid() or not os.path.isdir(os.path.join(base, name)):
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError: #el proceso ya no existe
+                REAPER.remove(os.path.join(base, name))
+            except PermissionError: #existe, pero es de otro usuario
+                pass
+
+
+VERSION_DIGITS = frozenset("0123456789")
+VERSION_LETTERS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ") #isalpha de C, no el de Unicode
+
+
+def rpmvercmp(a:str, b:str) -> int:
+    """Compara dos trozos de versión como rpmvercmp de libalpm: -1, 0 o 1"""
+    if a == b:
+        return 0
+    alnum = VERSION_DIGITS | VERSION_LETTERS
+    one, two = 0, 0
+    while one < len(a) and two < len(b):
+        start_one, start_two = one, two
+        while one < len(a) and a[one] not in alnum: #separadores
+            one += 1
+        while two < len(b) and b[two] not in alnum:
+            two += 1
+        if one == len(a) or two == len(b):
+            break
+        if one - start_one != two - start_two: #separadores de distinta longitud
+            return -1 if one - start_one < two - start_two else 1
+        end_one, end_two = one, two
+        numeric = a[one] in VERSION_DIGITS
+        kind = VERSION_DIGITS if numeric else VERSION_LETTERS
+        while end_one < len(a) and a[end_one] in kind:
+            end_one += 1
+        while end_two < len(b) and b[end_two] in kind:
+            end_two += 1
+        segment_one, segment_two = a[one:end_one], b[two:end_two]
+        if not segment_two: #un número siempre es más nuevo que letras
+            return 1 if numeric else -1
+        if numeric:
+            segment_one, segment_two = segment_one.lstrip("0"), segment_two.lstrip("0")
+            if len(segment_one) != len(segment_two): #más cifras significativas: número mayor
+                return 1 if len(segment_one) > len(segment_two) else -1
+        if segment_one != segment_two:
+            return 1 if segment_one > segment_two else -1
+        one, two = end_one, end_two
+    if one >= len(a) and two >= len(b):
+        return 0
+    #lo que sobra decide: unas letras sueltas ("1.0a" frente a "1.0") nunca ganan a nada
+    if (one >= len(a) and b[two] not in VERSION_LETTERS) or (one < len(a) and a[one] in VERSION_LETTERS):
+        return -1
+    return 1
+
+
+def vercmp(a:str, b:str) -> int:
+    """Compara versiones de pacman ("epoch:pkgver-pkgrel") como vercmp: -1, 0 o 1"""
+    if a == b:
+        return 0
+
+    def split(version:str) -> tuple:
+        epoch, separator, rest = version.partition(":")
+        if not separator or not (epoch.isdigit() or not epoch):
+            epoch, rest = "", version
+        epoch = epoch or "0"
+        pkgver, separator, pkgrel = rest.rpartition("-")
+        return (epoch, pkgver, pkgrel) if separator else (epoch, rest, None)
+
+    epoch_a, pkgver_a, pkgrel_a = split(a)
+    epoch_b, pkgver_b, pkgrel_b = split(b)
+    result = rpmvercmp(epoch_a, epoch_b) or rpmvercmp(pkgver_a, pkgver_b)
+    if result == 0 and pkgrel_a is not None and pkgrel_b is not None: #sin pkgrel en alguna, no cuenta
+        result = rpmvercmp(pkgrel_a, pkgrel_b)
+    return result
+
+
+class PackageRepository():
+    """Base de datos de un repositorio local de pacman (NAME.db.tar.zst y NAME.files.tar.zst).
+
+    Se actualiza de forma incremental: cada paquete convertido añade o
+    sustituye solo sus entradas "desc" y "files", con los metadatos y el
+    sha256 que ya calculó la conversión, y las versiones anteriores del
+    mismo paquete se eliminan; nunca se sustituye una versión más nueva
+    (según vercmp) por otra más vieja. Las demás entradas se copian tal cual, sin
+    volver a leer ningún paquete. Mientras se escribe existe NAME.db.lck,
+    creado y borrado como lo hacen repo-add y repo-remove, así que no se
+    pisan con ellos; entre procesos de Archimedes, un flock sobre
+    .NAME.archimedes.lck hace que esperen su turno en vez de fallar"""
+
+    LOCK_TIMEOUT = 60 #segundos que se espera a que repo-add suelte NAME.db.lck
+
+    PACKAGER = "Arch Linux, Archimedes <https://github.com/Jhanfer/archimedes-converter>"
+    #campos de "desc" que son listas: (clave en el diccionario del control, sección)
+    LIST_FIELDS = (("depends", "DEPENDS"), ("optdepends", "OPTDEPENDS"), ("conflicts", "CONFLICTS"),
+                   ("provides", "PROVIDES"), ("replaces", "REPLACES"))
+
+    def __init__(self, directory:str, name:str, threads:int=0, source_date_epoch:int=None):
+        self.directory = directory
+        self.name = name
+        self.threads = threads
+        self.source_date_epoch = source_date_epoch #fecha de las entradas; None: la BUILDDATE de cada paquete
+        self.db_path = os.path.join(directory, f"{name}.db.tar.zst")
+        self.files_path = os.path.join(directory, f"{name}.files.tar.zst")
+
+    @contextmanager
+    def locked(self):
+        with open(os.path.join(self.directory, f".{self.name}.archimedes.lck"), "w") as private:
+            fcntl.flock(private, fcntl.LOCK_EX) #otro Archimedes con el mismo repositorio: se espera
+            try:
+                lock_path = os.path.join(self.directory, f"{self.name}.db.lck")
+                deadline = time.monotonic() + self.LOCK_TIMEOUT
+                while True:
+                    try:
+                        os.close(os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)) #como el noclobber de repo-add
+                        break
+                    except FileExistsError:
+                        if time.monotonic() > deadline:
+                            raise ArchimedesError(f"{lock_path} existe: repo-add o repo-remove están usando el repositorio "
+                                                  "(si no es así, bórralo a mano)")
+                        time.sleep(0.5)
+                try:
+                    yield
+                finally:
+                    os.remove(lock_path)
+            finally:
+                fcntl.flock(private, fcntl.LOCK_UN)
+
+    def update(self, results:list) -> list:
+        """Añade o sustituye las entradas de los paquetes convertidos (ConversionResult o su asdict).
+
+        De cada nombre queda solo la versión más nueva, tanto dentro del lote
+        como frente a la base de datos. Devuelve (paquete, versión descartada,
+        versión que se queda) de lo que no se ha añadido por ser más viejo"""
+        added, skipped = {}, []
+        for result in results:
+            result = result if isinstance(result, dict) else asdict(result)
+            if not (result.get("package_sha256") and result.get("pkginfo")):
+                continue
+            package = result["pkginfo"]["package"]
+            version = f"{result["pkginfo"]["version"]}-{pkgrel}"
+            if package in added and vercmp(version, added[package][0]) < 0: #no depende del orden en que terminan los paquetes
+                skipped.append((package, version, added[package][0]))
+                continue
+            if package in added and added[package][0] != version:
+                skipped.append((package, added[package][0], version))
+            added[package] = (version, result) #con la misma versión, gana la última conversión
+        if not added:
+            return skipped
+        with self.locked():
+            entries = self.read_entries()
+            for package, (version, result) in added.items():
+                current = [entry for entry, (name, _, _) in entries.items() if name == package]
+                newer = [self.desc_field(entries[entry][1], "VERSION") for entry in current]
+                newer = [existing for existing in newer if existing and vercmp(existing, version) > 0]
+                if newer: #la base de datos ya tiene una versión más nueva: no se degrada
+                    skipped.append((package, version, max(newer, key=functools.cmp_to_key(vercmp))))
+                    continue
+                for stale in current: #versiones anteriores (o la misma, convertida otra vez)
+                    del entries[stale]
+                entries[f"{package}-{version}"] = (package, self.format_desc(result, version).encode("utf-8"),
+                                                   self.format_files(result["files"]).encode("utf-8"))
+            self.write_database(self.db_path, entries, with_files=False)
+            self.write_database(self.files_path, entries, with_files=True)
+        for link, target in ((f"{self.name}.db", self.db_path), (f"{self.name}.files", self.files_path)): #como repo-add
+            link = os.path.join(self.directory, link)
+            if not os.path.lexists(link):
+                os.symlink(os.path.basename(target), link)
+        return skipped
+
+    def read_entries(self) -> dict:
+        """{directorio: (nombre, desc, files)} de la base de datos actual (se lee NAME.files, que tiene ambas)"""
+        entries = {}
+        if not os.path.exists(self.files_path):
+            return entries
+        with open(self.files_path, "rb") as raw, open_zstd_reader(raw) as plain, tarfile.open(fileobj=plain, mode="r|") as database:
+            for member in database:
+                if not member.isfile():
+                    continue
+                directory, _, kind = member.name.partition("/")
+                name, desc, files = entries.get(directory, (None, b"", b""))
+                content = database.extractfile(member).read()
+                if kind == "desc":
+                    desc = content
+                    name = self.desc_field(content, "NAME") or directory
+                elif kind == "files":
+                    files = content
+                entries[directory] = (name, desc, files)
+        return entries
+
+    @staticmethod
+    def desc_field(desc:bytes, section:str):
+        """Primer valor de una sección ("%NAME%", "%VERSION%"...) de una entrada "desc", o None"""
+        fields = desc.decode("utf-8", "replace").split("\n")
+        marker = f"%{section}%"
+        return fields[fields.index(marker) + 1] if marker in fields and fields.index(marker) + 1 < len(fields) else None
+
+    def write_database(self, path:str, entries:dict, with_files:bool):
+        """Escribe la base de datos en un temporal y la cambia por la anterior de forma atómica"""
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "wb") as raw, CompressedWriter(raw, "zst", DEFAULT_LEVELS["zst"], self.threads) as compressed, \
+                 tarfile.open(fileobj=compressed, mode="w", format=tarfile.USTAR_FORMAT) as database:
+                for directory in sorted(entries):
+                    _, desc, files = entries[directory]
+                    mtime = self.entry_mtime(desc)
+                    database.addfile(self.member(f"{directory}/", tarfile.DIRTYPE, 0o755, mtime=mtime))
+                    database.addfile(self.member(f"{directory}/desc", size=len(desc), mtime=mtime), io.BytesIO(desc))
+                    if with_files and files:
+                        database.addfile(self.member(f"{directory}/files", size=len(files), mtime=mtime), io.BytesIO(files))
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def member(self, name:str, kind=tarfile.REGTYPE, mode:int=0o644, size:int=0, mtime:int=0) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.type, info.mode, info.size, info.mtime = kind, mode, size, mtime
+        return info
+
+    def entry_mtime(self, desc:bytes) -> int:
+        """Fecha de las entradas de un paquete: SOURCE_DATE_EPOCH o su BUILDDATE, nunca la hora actual.
+
+        Así, con los mismos paquetes, la base de datos sale igual byte a byte"""
+        if self.source_date_epoch is not None:
+            return int(self.source_date_epoch)
+        builddate = self.desc_field(desc, "BUILDDATE")
+        return int(builddate) if builddate and builddate.isdigit() else 0
+
+    def format_desc(self, result:dict, version:str) -> str:
+        pkginfo = result["pkginfo"]
+        try:
+            installed_size = int(pkginfo["installed-size"]) * 1024 #Installed-Size de Debian va en KiB
+        except (TypeError, ValueError):
+            installed_size = 0
+        sections = [
+            ("FILENAME", [os.path.basename(result["output"])]),
+            ("NAME", [pkginfo["package"]]),
+            ("BASE", [pkginfo["package"]]),
+            ("VERSION", [version]),
+            ("DESC", [pkginfo["description"]]),
+            ("CSIZE", [str(result["size"])]),
+            ("ISIZE", [str(installed_size)]),
+            ("SHA256SUM", [result["package_sha256"]]),
+            ("URL", [pkginfo["url"]] if pkginfo["url"] else []),
+            ("LICENSE", ["unknown"]),
+            ("ARCH", [pkginfo["architecture"] or "any"]),
+            ("BUILDDATE", [str(pkginfo["builddate"])]),
+            ("PACKAGER", [self.PACKAGER]),
+        ] + [(section, pkginfo.get(key, [])) for key, section in self.LIST_FIELDS]
+        return "".join(f"%{section}%\n{"".join(f"{value}\n" for value in values)}\n" for section, values in sections if values)
+
+    def format_files(self, files:list) -> str:
+        return "%FILES%\n" + "".join(f"{path}\n" for path in files)
+
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class ExternalDecompressor():
+    """Archivo de lectura con la salida de un descompresor externo ("zstd -d -c").
+
+    Al llegar al final comprueba el código de salida del comando, así que
+    un archivo truncado o dañado es un error y no un tar más corto; close()
+    espera siempre al proceso para no dejar zombis"""
+
+    def __init__(self, command:list, fileobj):
+        self.process = subprocess.Popen(command, stdin=fileobj, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._finished = False
+
+    def read(self, size=-1) -> bytes:
+        data = self.process.stdout.read(size)
+        if not data and size != 0 and not self._finished:
+            self._finished = True
+            if self.process.wait() != 0:
+                raise ArchimedesError(f"\"{self.process.args[0]}\" no ha podido descomprimir el archivo (¿truncado o dañado?)")
+        return data
+
+    def close(self):
+        self.process.stdout.close()
+        if not self._finished and self.process.poll() is None: #no se ha leído todo: el resultado ya no importa
+            self.process.kill()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_zstd_reader(fileobj):
+    """Devuelve un archivo de lectura (y gestor de contexto) con el contenido descomprimido de un flujo zstd"""
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=1024 * 1024, closefd=False)
+    return ExternalDecompressor(["zstd", "-q", "-d", "-c"], fileobj) #sin el módulo, el comando "zstd" descomprime
+
+
+SYNC_DB_PRIORITY = ["core", "extra", "community", "multilib"] #si varios repositorios tienen el mismo nombre, gana el primero
+
+
+class DependencyIndex():
+    """Índice de paquetes de Arch construido con las bases de datos de pacman.
+
+    Lee sin red las bases de sincronización locales (/var/lib/pacman/sync/*.db
+    y, si existen, *.files) y relaciona nombres, "provides" y sonames de
+    bibliotecas con paquetes de Arch. Se guarda en disco en un pickle compacto
+    que se invalida cuando cambia la fecha de alguna base de datos, y solo se
+    carga la primera vez que hace falta resolver una dependencia"""
+
+    def __init__(self, sync_dir:str, cache_file:str):
+        self.sync_dir = sync_dir
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._data = None
+        self._available = None
+
+    def databases(self) -> list:
+        """Bases de datos de sincronización, en orden de prioridad"""
+        paths = glob.glob(os.path.join(self.sync_dir, "*.db")) + glob.glob(os.path.join(self.sync_dir, "*.files"))
+
+        def priority(path):
+            repo = os.path.basename(path).rsplit(".", 1)[0]
+            return (SYNC_DB_PRIORITY.index(repo) if repo in SYNC_DB_PRIORITY else len(SYNC_DB_PRIORITY), repo, path)
+        return sorted(paths, key=priority)
+
+    def fingerprint(self) -> dict:
+        """Ruta -> (mtime, tamaño) de cada base de datos: si cambia, el índice se reconstruye"""
+        fingerprint = {}
+        for path in self.databases():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            fingerprint[path] = (stat.st_mtime_ns, stat.st_size)
+        return fingerprint
+
+    @property
+    def available(self) -> bool:
+        """Indica si hay bases de datos de pacman en este sistema (no carga el índice).
+
+        Como el índice, se mira una sola vez: resolve_alternatives lo
+        consulta por cada grupo de alternativas y no debe recorrer el
+        directorio cada vez (el servidor renueva sus procesos si cambian)"""
+        if self._available is None:
+            self._available = bool(self.databases())
+        return self._available
+
+    def preload(self):
+        """Carga el índice ya, en lugar de al resolver la primera dependencia (lo usa el servidor)"""
+        if self.available:
+            self._load()
+
+    def _load(self) -> dict:
+        with self._lock:
+            if self._data is None:
+                fingerprint = self.fingerprint()
+                try:
+                    with open(self.cache_file, "rb") as file:
+                        data = pickle.load(file)
+                    if data.get("fingerprint") != fingerprint:
+                        data = None
+                except (OSError, pickle.PickleError, EOFError, AttributeError, ValueError):
+                    data = None
+                if data is None:
+                    data = self._build(fingerprint)
+                    self._save(data)
+                self._data = data
+        return self._data
+
+    def _build(self, fingerprint:dict) -> dict:
+        """Lee todas las bases de datos y construye el índice"""
+        names, provides, sonames = set(), {}, {}
+        for path in fingerprint:
+            with open(path, "rb") as raw:
+                magic = raw.read(4)
+                raw.seek(0)
+                try:
+                    with open_zstd_reader(raw) if magic == ZSTD_MAGIC else nullcontext(raw) as fileobj, \
+                         tarfile.open(fileobj=fileobj, mode="r|*") as database:
+                        for member in database:
+                            if not member.isfile() or os.path.basename(member.name) not in ("desc", "files"):
+                                continue
+                            fields = self._parse_desc(database.extractfile(member).read().decode("utf-8", "replace"))
+                            #"files" no lleva %NAME%: el nombre sale del directorio "nombre-versión-release"
+                            name = (fields.get("NAME") or [os.path.dirname(member.name).rsplit("-", 2)[0]])[0]
+                            self._index_entry(name, fields, names, provides, sonames)
+                except (tarfile.TarError, EOFError, OSError, ArchimedesError):
+                    continue #una base de datos dañada no impide usar las demás
+        return {"fingerprint": fingerprint, "names": frozenset(names), "provides": provides, "sonames": sonames}
+
+    def _parse_desc(self, text:str) -> dict:
+        """Interpreta un archivo "desc"/"files" (%CAMPO% seguido de una línea por valor)"""
+        fields, current = {}, None
+        for line in text.splitlines():
+            if line.startswith("%") and line.endswith("%"):
+                current = fields.setdefault(line.strip("%"), [])
+            elif line and current is not None:
+                current.append(line)
+        return fields
+
+    def _index_entry(self, name:str, fields:dict, names:set, provides:dict, sonames:dict):
+        names.add(name)
+        for provided in fields.get("PROVIDES", []):
+            provided_name, _, provided_version = provided.partition("=")
+            provides.setdefault(provided_name, name)
+            if ".so" in provided_name and provided_version: #"libfoo.so=1-64" es el soname libfoo.so.1
+                sonames.setdefault(f"{provided_name}.{provided_version.split("-")[0]}", name)
+        for path in fields.get("FILES", []):
+            library = os.path.basename(path)
+            if path.startswith(("usr/lib/", "usr/lib32/")) and library.startswith("lib") and ".so" in library:
+                sonames.setdefault(library, name)
+
+    def _save(self, data:dict):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            temporary = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as file:
+                pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.cache_file)
+        except OSError: #sin caché en disco el índice funciona igual, solo que se reconstruye la próxima vez
+            pass
+
+    def soname_candidates(self, debian_name:str) -> list:
+        """Sonames probables de un paquete de biblioteca de Debian ("libssl3" -> "libssl.so.3")"""
+        candidates = []
+        match = re.match(r"^(lib[\w.+-]*?)-(\d[\w.]*)$", debian_name) #"libgtk-3-0" -> "libgtk-3.so.0"
+        if match:
+            candidates.append(f"{match.group(1)}.so.{match.group(2)}")
+        match = re.match(r"^(lib[\w+-]*?[a-z+])(\d[\w.]*)$", debian_name) #"libssl3" -> "libssl.so.3"
+        if match:
+            candidates.append(f"{match.group(1)}.so.{match.group(2)}")
+        return candidates
+
+    def resolve(self, debian_name:str, arch_name:str):
+        """Paquete de Arch que satisface una dependencia, o None si ninguno lo hace"""
+        data = self._load()
+        if arch_name in data["names"] or arch_name in data["provides"]:
+            return arch_name
+        for soname in self.soname_candidates(debian_name):
+            if soname in data["sonames"]:
+                return data["sonames"][soname]
+        return None
+
+    def soname_provider(self, soname:str):
+        """Paquete de Arch que contiene la biblioteca "soname", o None"""
+        return self._load()["sonames"].get(soname)
+
+
+def parse_deb822(lines):
+    """Lee párrafos deb822 (el formato del archivo control) en una sola pasada.
+
+    Recibe un iterable de líneas y devuelve un generador de diccionarios
+    {campo en minúsculas: valor}. Las líneas de continuación (que empiezan
+    por espacio o tabulador) se unen con "\\n" y " ." es una línea vacía"""
+    paragraph, field, parts = {}, None, []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and field is not None: #continuación del campo anterior
+            line = line.strip()
+            parts.append("" if line == "." else line)
+            continue
+        if field is not None: #termina el campo anterior
+            paragraph[field] = "\n".join(parts).strip()
+            field = None
+        if not line.strip(): #línea en blanco: termina el párrafo
+            if paragraph:
+                yield paragraph
+                paragraph = {}
+            continue
+        if line.startswith("#"): #comentario
+            continue
+        name, separator, value = line.partition(":")
+        if not separator: #línea sin ":": se ignora en vez de romper el resto del archivo
+            continue
+        field, parts = name.strip().lower(), [value.strip()]
+    if field is not None:
+        paragraph[field] = "\n".join(parts).strip()
+    if paragraph:
+        yield paragraph
+
+
+#nombre[:arquitectura] (operador versión) [arquitecturas] <perfiles>; sin cuantificadores anidados: tiempo lineal
+RELATION_PATTERN = re.compile(r"\s*([A-Za-z0-9][A-Za-z0-9+.~_-]*)(?::[A-Za-z0-9-]+)?\s*"
+                              r"(?:\(\s*(<<|<=|>=|>>|=|<|>)\s*([^)\s]+)\s*\))?\s*"
+                              r"(?:\[([^\]]*)\])?")
+#operadores de Debian -> pacman ("<" y ">" a secas son los antiguos "<=" y ">=")
+VERSION_OPERATORS = {"<<": "<", "<=": "<=", "=": "=", ">=": ">=", ">>": ">", "<": "<=", ">": ">="}
+
+
+def parse_relations(value:str, architecture:str="") -> list:
+    """Interpreta un campo de relaciones de Debian.
+
+    "a (>= 1.0) | b [amd64], c" -> [[("a", ">=", "1.0"), ("b", None, None)], [("c", None, None)]].
+    Las alternativas restringidas a otras arquitecturas se descartan"""
+    groups = []
+    for group in value.replace("\n", " ").split(","):
+        relations = []
+        for alternative in group.split("|"):
+            match = RELATION_PATTERN.match(alternative)
+            if match is None or not match.group(1):
+                continue
+            name, operator, version, restriction = match.groups()
+            if restriction and architecture:
+                arches = restriction.split()
+                negated = [arch[1:] for arch in arches if arch.startswith("!")]
+                if architecture in negated or (len(negated) < len(arches) and architecture not in arches):
+                    continue
+            relations.append((name.lower(), VERSION_OPERATORS.get(operator), version))
+        if relations or group.strip():
+            groups.append(relations)
+    return groups
+
+
+def arch_version(version:str) -> str:
+    """Versión de Debian -> pkgver de Arch: "1:2.3-4" -> "1:2.3_4".
+
+    El pkgver no admite "-" (pacman separa el pkgrel por el último), así
+    que la revisión de Debian y los "-" de la versión original se unen con
+    "_"; el pkgrel lo pone Archimedes"""
+    return version.replace("-", "_")
+
+
+def arch_constraint(operator:str, version:str) -> str:
+    """">=", "1:2.3-4" -> ">=1:2.3_4": con la misma traducción que el pkgver de los paquetes convertidos"""
+    if not operator or not version:
+        return ""
+    return f"{operator}{arch_version(version)}"
+
+
+def relation_name(entry:str) -> str:
+    """Nombre de una dependencia sin la versión ("glibc>=2.34" -> "glibc")"""
+    return re.split(r"[<>=]", entry, maxsplit=1)[0]
+
+
+_dependency_indexes = {} #un índice por proceso y directorio: se reutiliza entre conversiones
+_dependency_indexes_lock = threading.Lock()
+
+
+def get_dependency_index(sync_dir:str, cache_dir:str) -> DependencyIndex:
+    key = (sync_dir, cache_dir)
+    with _dependency_indexes_lock: #varias conversiones en hilos comparten el mismo índice
+        if key not in _dependency_indexes:
+            _dependency_indexes[key] = DependencyIndex(sync_dir, os.path.join(cache_dir, "sync-index.pickle"))
+        return _dependency_indexes[key]
 
 
 parser = argparse.ArgumentParser(description="Script para convertir .deb en paquetes instalables de Arch Linux. Desarrollado por Jhanfer ❤",
                                 usage="Por favor, ponga una ruta de archivo a convertir. Use -h para ayuda",
                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
+def default_jobs() -> int:
+    """Número de procesos por defecto: los núcleos que puede usar este proceso"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+SCRIPT_PATH = os.path.abspath(__file__) #los procesos hijos del lote vuelven a ejecutar este mismo script con --job
+TOOL_ERROR_LIMIT = 2000 #caracteres de stderr que se incluyen en un mensaje de error
+
+
+def clear_screen():
+    """Limpia la terminal (lo que hacía "clear"), solo si la salida es una terminal"""
+    if sys.stdout.isatty():
+        sys.stdout.write("\033[H\033[2J\033[3J")
+        sys.stdout.flush()
+
+
+def output_tail(data:bytes) -> str:
+    """Final de la salida de un comando, para los mensajes de error"""
+    return (data or b"").decode("utf-8", "replace").strip()[-TOOL_ERROR_LIMIT:]
+
+
+def tool_error(message:str, command:list, returncode:int, stderr:bytes) -> ArchimedesError:
+    detail = output_tail(stderr)
+    return ArchimedesError(f"{message} ({os.path.basename(command[0])} terminó con código {returncode}){f": {detail}" if detail else ""}")
+
+
+def run_tool(command:list, message:str, *, cwd:str=None, capture_stdout:bool=False, capture_stderr:bool=True) -> bytes:
+    """Ejecuta un comando externo sin shell y devuelve su salida estándar (si se captura).
+
+    Si termina con un código distinto de 0 lanza ArchimedesError con el
+    código y el final de su stderr"""
+    try:
+        process = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE if capture_stdout else None,
+                                 stderr=subprocess.PIPE if capture_stderr else None)
+    except OSError as error: #el comando no existe o no se puede ejecutar
+        raise ArchimedesError(f"{message}: {error}")
+    if process.returncode != 0:
+        raise tool_error(message, command, process.returncode, process.stderr)
+    return process.stdout
+
+
+async def run_command(command:list, *, input:bytes=None, timeout:float=None) -> tuple:
+    """Ejecuta un comando sin shell en su propia sesión y devuelve (código, stdout, stderr).
+
+    Si se agota "timeout" (TimeoutError) o se cancela la tarea, se mata el
+    grupo de procesos entero: el comando y lo que haya lanzado (bsdtar...)"""
+    process = await asyncio.create_subprocess_exec(*command, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout)
+    except BaseException:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        raise
+    return process.returncode, stdout, stderr
+
+
+class BatchOrchestrator():
+    """Reparte un lote de conversiones entre procesos hijos con asyncio.
+
+    Cada paquete se convierte en un proceso propio (este mismo script con
+    --job) lanzado con create_subprocess_exec, sin shell. Un semáforo
+    limita cuántos van a la vez y los resultados se informan según
+    terminan. Un paquete que tarda más de "timeout" segundos se mata con
+    todo su grupo de procesos y cuenta como error, sin parar el resto; al
+    cancelar el lote (Ctrl+C) se matan todos los que estaban en marcha"""
+
+    def __init__(self, options:dict, workers:int, timeout:float=None):
+        self.options = options
+        self.workers = workers
+        self.timeout = timeout
+
+    async def convert(self, input_file:str, output_file:str) -> dict:
+        start = time.monotonic()
+        job = json.dumps({"input": input_file, "output": output_file, "options": self.options}).encode("utf-8")
+        try:
+            returncode, stdout, stderr = await run_command([sys.executable, SCRIPT_PATH, "--job"], input=job, timeout=self.timeout)
+        except TimeoutError:
+            remove_partials(output_file) #lo que dejó a medias el proceso que se ha matado
+            return failed_job(input_file, output_file, f"Tiempo agotado: la conversión tardó más de {self.timeout:g} s", start)
+        except asyncio.CancelledError:
+            remove_partials(output_file)
+            raise
+        try:
+            return json.loads(stdout.decode("utf-8").splitlines()[-1])
+        except (ValueError, IndexError): #el proceso murió sin informar (sin memoria, una señal...)
+            remove_partials(output_file)
+            detail = output_tail(stderr)
+            return failed_job(input_file, output_file, f"El proceso de conversión terminó inesperadamente (código {returncode}){f": {detail}" if detail else ""}", start)
+
+    async def run(self, jobs:list, report):
+        """Convierte los (entrada, salida) de "jobs" y llama a "report" con cada resultado según termina"""
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def limited(input_file:str, output_file:str) -> dict:
+            async with semaphore:
+                return await self.convert(input_file, output_file)
+
+        tasks = [asyncio.create_task(limited(input_file, output_file)) for input_file, output_file in jobs]
+        try:
+            for finished in asyncio.as_completed(tasks): #según terminan, no en el orden de la lista
+                report(await finished)
+        finally: #cancelado (Ctrl+C) o "report" ha fallado: no se deja ningún proceso vivo
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def failed_job(input_file:str, output_file:str, error:str, start:float) -> dict:
+    """Resultado de un paquete cuya conversión no llegó a informar (como los de convert_job)"""
+    return {"input": input_file, "output": output_file, "status": "error", "error": error,
+            "cached": False, "size": None, "duration": time.monotonic() - start}
+
+
+METADATA_MODE = 0o644 #.PKGINFO, .FILELIST, .CHECKSUMS y .MTREE, como los deja makepkg
+
+
+def write_metadata_file(path:str, content:bytes):
+    """Escribe un archivo de metadatos del paquete con modo 644, sea cual sea la umask"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, METADATA_MODE)
+    try:
+        os.fchmod(fd, METADATA_MODE) #os.open solo aplica el modo al crearlo, y recortado por la umask
+        with open(fd, "wb", closefd=False) as file:
+            file.write(content)
+    finally:
+        os.close(fd)
+
+
+def partial_name(output_file:str) -> str:
+    """Nombre temporal (oculto, junto al definitivo) en el que se escribe un paquete antes de renombrarlo"""
+    directory, name = os.path.split(output_file)
+    #con el nombre del equipo: en una cola compartida (NFS) dos nodos pueden tener el mismo pid
+    return os.path.join(directory, f".{name}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.part")
+
+
+def remove_partials(output_file:str):
+    """Borra los temporales de "output_file" que dejó un proceso hijo al que se ha matado"""
+    directory, name = os.path.split(output_file)
+    for partial in glob.glob(os.path.join(glob.escape(directory), f".{glob.escape(name)}.*.part")):
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+
+
+class BatchJournal():
+    """Registro de un lote en disco, en JSON lines, al que solo se añaden líneas.
+
+    Al empezar se anota cada paquete como "pending" y, según terminan, como
+    "ok" o "error" con el sha256 y el tamaño y la fecha del .deb, el paquete
+    de salida y los ajustes de la conversión. Con --resume se saltan los
+    paquetes cuya última anotación es "ok" con el mismo .deb, los mismos
+    ajustes y la salida en su sitio; los fallidos y los que estaban en
+    marcha cuando se cortó el lote se vuelven a convertir"""
+
+    def __init__(self, path:str, settings:str):
+        self.path = path
+        self.settings = settings #resumen de los ajustes que cambian el paquete generado
+        self._file = None
+
+    def load(self) -> dict:
+        """Última anotación de cada .deb; se ignora una línea cortada (el lote murió al escribirla)"""
+        entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        entries[entry["input"]] = entry
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def completed(self, entry:dict, input_file:str, output_file:str, sha256) -> bool:
+        """Indica si "entry" es una conversión terminada de este mismo .deb.
+
+        El tamaño y la fecha del .deb bastan casi siempre; si han cambiado
+        (el directorio se ha copiado, por ejemplo) se compara el sha256,
+        que se calcula con "sha256" solo en ese caso"""
+        if entry is None or entry["state"] != "ok" or entry.get("output") != output_file or entry.get("settings") != self.settings:
+            return False
+        try:
+            stat = os.stat(input_file)
+        except OSError:
+            return False
+        if not os.path.isfile(output_file):
+            return False
+        if entry.get("stat") == [stat.st_size, stat.st_mtime_ns]:
+            return True
+        return entry.get("sha256") is not None and sha256(input_file) == entry["sha256"]
+
+    def open(self, append:bool):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "a" if append else "w", encoding="utf-8")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write(self, entries:list):
+        """Añade las anotaciones y espera a que estén en el disco: sobreviven a un corte de luz"""
+        self._file.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def pending(self, jobs:list):
+        self.write([{"input": input_file, "output": output_file, "state": "pending"} for input_file, output_file in jobs])
+
+    def record(self, result:dict):
+        entry = {"input": result["input"], "output": result["output"], "state": result["status"], "settings": self.settings,
+                 "sha256": result.get("sha256"), "error": result["error"]}
+        try:
+            stat = os.stat(result["input"])
+            entry["stat"] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            pass
+        if result.get("conversion"): #lo que hace falta para añadirlo al repositorio si el lote se reanuda
+            entry["conversion"] = result["conversion"]
+        self.write([entry])
+
+    def result(self, entry:dict) -> dict:
+        """Resultado (como los de convert_job) de un paquete que ya estaba convertido"""
+        result = {"input": entry["input"], "output": entry["output"], "status": "ok", "error": None, "cached": False,
+                  "size": os.path.getsize(entry["output"]), "duration": 0.0, "sha256": entry.get("sha256"), "skipped": True}
+        if entry.get("conversion"):
+            result["conversion"] = entry["conversion"]
+        return result
+
+
+def run_job() -> int:
+    """Punto de entrada de un proceso hijo de BatchOrchestrator.
+
+    Lee el trabajo (JSON) de la entrada estándar y escribe el resultado en
+    una sola línea JSON en la salida estándar"""
+    job = json.load(sys.stdin)
+    with redirect_stdout(sys.stderr): #nada más que el resultado puede ir a la salida estándar
+        result = convert_job(job["input"], job["output"], job["options"])
+    sys.stdout.write(json.dumps(result) + "\n")
+    return EXIT_OK
+
+
+def warm_worker(sync_dir:str, cache_dir:str):
+    """Inicializa un proceso del pool del servidor: carga el índice de dependencias
+    antes de la primera conversión y deja Ctrl+C en manos del servidor"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    get_dependency_index(sync_dir, cache_dir).preload()
+
+
+class ConversionServer():
+    """Servidor de conversiones en un socket Unix (--serve).
+
+    Conserva entre peticiones lo que cada ejecución del script tendría que
+    repetir: el intérprete con todo importado, los comandos comprobados, el
+    índice de dependencias y un pool de procesos que no se cierra. Cada
+    conexión manda una línea JSON {"jobs": [[entrada, salida], ...],
+    "options": {...}} y recibe un registro JSON por paquete según terminan y
+    una última línea {"done": true, "total", "failed", "error"}"""
+
+    def __init__(self, options:dict):
+        self.options = options
+        self.socket_path = options["serve"]
+        self.workers = max(1, options["jobs"])
+        self._pool = None
+        self._fingerprint = None
+        self._repository_lock = asyncio.Lock() #dos peticiones con el mismo --repo no escriben la base de datos a la vez
+
+    async def pool(self) -> ProcessPoolExecutor:
+        """El pool de procesos; se renueva si han cambiado las bases de datos de pacman"""
+        index = DependencyIndex(self.options["sync_dir"], os.path.join(self.options["cache_dir"], "sync-index.pickle"))
+        fingerprint = index.fingerprint()
+        if self._pool is not None and fingerprint != self._fingerprint:
+            self._pool.shutdown(wait=False) #los procesos viejos terminan lo que tienen en marcha y salen
+            self._pool = None
+        if self._pool is None:
+            #el índice se reconstruye aquí una vez, no en cada proceso nuevo a la vez
+            await asyncio.get_running_loop().run_in_executor(None, index.preload)
+            #"spawn": hacer fork de un proceso con hilos (asyncio, el propio pool) no es seguro
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=warm_worker, initargs=(self.options["sync_dir"], self.options["cache_dir"]))
+            self._fingerprint = fingerprint
+        return self._pool
+
+    def discard(self, pool:ProcessPoolExecutor):
+        """Olvida un pool roto (un proceso murió) para que la próxima petición cree otro"""
+        if self._pool is pool:
+            self._pool = None
+
+    async def convert(self, jobs:list, options:dict, writer:asyncio.StreamWriter):
+        archimedes = Archimedes({**options, "batch": True, "quiet": True})
+        worker_options = archimedes.worker_options(self.workers)
+        pool = await self.pool()
+        loop = asyncio.get_running_loop()
+
+        async def convert_one(input_file:str, output_file:str) -> dict:
+            start = time.monotonic()
+            try:
+                return await loop.run_in_executor(pool, convert_job, input_file, output_file, worker_options)
+            except BrokenProcessPool: #un proceso murió (sin memoria, una señal...) y el pool ya no sirve
+                self.discard(pool)
+                remove_partials(output_file)
+                return failed_job(input_file, output_file, "El proceso de conversión terminó inesperadamente", start)
+
+        tasks = [asyncio.create_task(convert_one(input_file, output_file)) for input_file, output_file in jobs]
+        results, error = [], None
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                results.append(result)
+                archimedes.report_timings(result)
+                writer.write(json.dumps(batch_record(result), ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+            conversions = [result["conversion"] for result in results if result.get("conversion")]
+            if conversions:
+                async with self._repository_lock:
+                    try:
+                        await loop.run_in_executor(None, archimedes.update_repository, conversions)
+                    except ArchimedesError as exception:
+                        error = str(exception)
+        finally: #si el cliente se ha ido, los paquetes que no han empezado ya no se convierten
+            for task in tasks:
+                task.cancel()
+        failed = sum(result["status"] != "ok" for result in results)
+        print(f"{len(results) - failed} de {len(results)} paquetes convertidos", file=sys.stderr, flush=True)
+        writer.write(json.dumps({"done": True, "total": len(results), "failed": failed, "error": error}, ensure_ascii=False).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        """Atiende una conexión: una petición y sus resultados"""
+        try:
+            try:
+                request = json.loads(await reader.readline())
+                jobs = [(str(input_file), str(output_file)) for input_file, output_file in request["jobs"]]
+                options = dict(request.get("options") or {})
+            except (ValueError, KeyError, TypeError) as error:
+                writer.write(json.dumps({"done": True, "total": 0, "failed": 0, "error": f"Petición no válida: {error}"}, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+                return
+            await self.convert(jobs, options, writer)
+        except ConnectionError: #el cliente cerró la conexión antes de terminar
+            pass
+        finally:
+            writer.close()
+
+    def check_socket(self):
+        """Borra un socket que dejó otro servidor que ya no existe; falla si sigue en marcha"""
+        try:
+            mode = os.stat(self.socket_path).st_mode
+        except FileNotFoundError:
+            return
+        if not S_ISSOCK(mode):
+            raise ArchimedesError(f"{self.socket_path} ya existe y no es un socket")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.socket_path)
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)
+                return
+        raise ArchimedesError(f"Ya hay un servidor escuchando en {self.socket_path}")
+
+    async def serve(self):
+        """Atiende peticiones hasta recibir SIGTERM (o Ctrl+C)"""
+        self.check_socket()
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        await self.pool()
+        umask = os.umask(0o177) #el socket nace con permisos 600: solo este usuario puede mandar trabajos
+        try:
+            server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+        finally:
+            os.umask(umask)
+        print(f"Escuchando en {self.socket_path} con {self.workers} procesos", file=sys.stderr, flush=True)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+QUEUE_OPTIONS = ("engine", "compression", "level", "adaptive", "adaptive_ratio", "adaptive_budget", "checksums", "elf_deps", "reproducible", "source_date_epoch") #ajustes de la cola: todos los nodos generan los mismos paquetes
+QUEUE_MAX_ATTEMPTS = 3 #veces que se reparte un paquete cuyo nodo deja de responder antes de darlo por fallido
+
+
+class WorkQueue():
+    """Cola de conversiones en un directorio compartido (NFS), sin ningún servidor.
+
+    pending/ tiene un archivo JSON por paquete. Un nodo lo reclama
+    renombrándolo a claimed/ID@NODO (rename es atómico: solo gana uno) y, al
+    terminar, publica el resultado en results/ID.json (escrito aparte y
+    renombrado) y borra su reclamación. Cada nodo renueva su arriendo
+    tocando nodes/NODO; si ese archivo lleva más de "lease" segundos sin
+    tocarse, el nodo se da por muerto y otro se queda con sus paquetes. Las
+    fechas son las del servidor de archivos, así que da igual que los
+    relojes de los nodos no coincidan"""
+
+    def __init__(self, directory:str, node:str=None, lease:float=300.0):
+        self.directory = directory
+        self.node = node
+        self.lease = lease
+        for name in ("pending", "claimed", "results", "nodes", "tmp"):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def path(self, *parts) -> str:
+        return os.path.join(self.directory, *parts)
+
+    def write(self, path:str, data:dict):
+        """Escribe un JSON en un temporal de la cola y lo renombra: nadie lee un archivo a medias"""
+        temporary = self.path("tmp", f"{os.path.basename(path)}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(temporary, path)
+
+    def read(self, path:str):
+        """El trabajo de un archivo de la cola, o None si no es válido"""
+        try:
+            with open(path, encoding="utf-8") as file:
+                job = json.load(file)
+            return job if isinstance(job.get("input"), str) and isinstance(job.get("output"), str) else None
+        except (ValueError, AttributeError):
+            return None
+
+    def options(self) -> dict:
+        """Ajustes de conversión con los que se creó la cola (QUEUE_OPTIONS)"""
+        try:
+            with open(self.path("options.json"), encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def enqueue(self, jobs:list, options:dict) -> int:
+        """Añade los (entrada, salida) que no estén ya en la cola y devuelve cuántos se han añadido"""
+        options = json.loads(json.dumps(options)) #tal como queda en el archivo (las tuplas pasan a listas)
+        current = self.options()
+        if current and current != options:
+            raise ArchimedesError(f"La cola {self.directory} ya tiene otros ajustes de conversión: {json.dumps(current)}")
+        if not current:
+            self.write(self.path("options.json"), options)
+        claimed = {name.partition("@")[0] for name in os.listdir(self.path("claimed"))}
+        added = 0
+        for input_file, output_file in jobs:
+            job_id = hashlib.sha256(f"{input_file}\0{output_file}".encode("utf-8")).hexdigest()[:20]
+            if job_id in claimed or os.path.exists(self.path("pending", f"{job_id}.json")):
+                continue
+            self.write(self.path("pending", f"{job_id}.json"), {"input": input_file, "output": output_file, "attempts": 0})
+            added += 1
+        return added
+
+    def heartbeat(self) -> float:
+        """Renueva el arriendo de este nodo y devuelve la hora del servidor de archivos"""
+        path = self.path("nodes", self.node)
+        with open(path, "a"):
+            pass
+        os.utime(path) #en NFS, sin fecha explícita se usa la del servidor
+        return os.stat(path).st_mtime
+
+    def leave(self):
+        """Retira el arriendo: lo que este nodo deje reclamado pasa enseguida a los demás"""
+        try:
+            os.remove(self.path("nodes", self.node))
+        except FileNotFoundError:
+            pass
+
+    def expired(self, node:str, now:float) -> bool:
+        try:
+            return now - os.stat(self.path("nodes", node)).st_mtime > self.lease
+        except FileNotFoundError: #el nodo terminó (o nunca llegó a renovar)
+            return True
+
+    def take(self, source:str, job_id:str):
+        """Renombra "source" a una reclamación de este nodo; devuelve su ruta o None si otro nodo ganó"""
+        claimed = self.path("claimed", f"{job_id}@{self.node}")
+        try:
+            os.rename(source, claimed)
+        except FileNotFoundError:
+            if not os.path.exists(claimed): #en NFS un rename repetido falla aunque el primero funcionara
+                return None
+        return claimed
+
+    def claim(self):
+        """Reclama un paquete pendiente o, si no hay, uno de un nodo muerto.
+
+        Devuelve (reclamación, trabajo) o None si no hay nada que hacer ahora"""
+        names = [name for name in os.listdir(self.path("pending")) if name.endswith(".json")]
+        random.shuffle(names) #cada nodo empieza por un sitio distinto: menos choques al reclamar
+        for name in names:
+            claimed = self.take(self.path("pending", name), name.removesuffix(".json"))
+            if claimed is not None:
+                return claimed, self.read(claimed)
+        now = self.heartbeat()
+        for name in os.listdir(self.path("claimed")):
+            job_id, _, node = name.partition("@")
+            if node == self.node or not self.expired(node, now):
+                continue
+            claimed = self.take(self.path("claimed", name), job_id)
+            if claimed is None:
+                continue
+            job = self.read(claimed)
+            if job is not None: #el intento se anota antes de empezar: si este nodo también muere, el siguiente lo sabe
+                job["attempts"] = job.get("attempts", 0) + 1
+                self.write(claimed, job)
+            return claimed, job
+        return None
+
+    def idle(self) -> bool:
+        """No queda nada pendiente ni reclamado por otros nodos (que podrían morir y dejarlo a medias)"""
+        return (not any(name.endswith(".json") for name in os.listdir(self.path("pending")))
+                and all(name.partition("@")[2] == self.node for name in os.listdir(self.path("claimed"))))
+
+    def finish(self, claimed:str, record:dict):
+        """Publica el resultado y suelta la reclamación"""
+        self.write(self.path("results", f"{os.path.basename(claimed).partition("@")[0]}.json"), record)
+        try:
+            os.remove(claimed)
+        except FileNotFoundError: #otro nodo lo dio por muerto y se lo quedó: el paquete es el mismo
+            pass
+
+    async def work(self, orchestrator:BatchOrchestrator, workers:int, report):
+        """Convierte paquetes de la cola, "workers" a la vez, hasta que no queda ninguno"""
+        poll = min(5.0, self.lease / 4)
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.lease / 4)
+                await asyncio.to_thread(self.heartbeat)
+
+        async def slot():
+            while True:
+                claim = await asyncio.to_thread(self.claim)
+                if claim is None:
+                    if await asyncio.to_thread(self.idle):
+                        return
+                    await asyncio.sleep(poll) #otros nodos siguen trabajando: por si alguno muere
+                    continue
+                claimed, job = claim
+                start = time.monotonic()
+                if job is None:
+                    result = failed_job(claimed, None, "Trabajo de la cola no válido", start)
+                elif job.get("attempts", 0) >= QUEUE_MAX_ATTEMPTS:
+                    result = failed_job(job["input"], job["output"], f"Abandonado: {job["attempts"]} nodos dejaron de responder al convertirlo", start)
+                else:
+                    os.makedirs(os.path.dirname(job["output"]), exist_ok=True)
+                    result = await orchestrator.convert(job["input"], job["output"])
+                record = {**batch_record(result), "node": self.node, "attempts": (job or {}).get("attempts", 0) + 1}
+                await asyncio.to_thread(self.finish, claimed, record)
+                report(record)
+
+        self.heartbeat()
+        beat = asyncio.create_task(heartbeat())
+        try:
+            await asyncio.gather(*(slot() for _ in range(workers)))
+        finally:
+            beat.cancel()
+            self.leave()
+
+
 pkgrel=1
+DEFAULT_OPTIONS = {
+    "engine": "stream", #"stream" reempaqueta data.tar en memoria, "extract" usa la extracción a disco con bsdtar, "dedup" el almacén de contenidos
+    "jobs": default_jobs(), #procesos para convertir directorios en paralelo
+    "quiet": False, #no muestra mensajes durante la conversión (los procesos de un lote informan al principal)
+    "compression": "zst", #formato del paquete: zst, xz, gz o none
+    "level": None, #nivel de compresión; None usa el de DEFAULT_LEVELS
+    "adaptive": False, #motor "stream": los miembros que no se dejan comprimir van al nivel bajo (AdaptiveCompression)
+    "adaptive_ratio": 0.9, #tasa de la muestra (comprimido/original) a partir de la que un miembro no se deja comprimir
+    "adaptive_budget": None, #segundos de compresión por paquete; si no caben, baja el nivel del resto. None sin límite
+    "threads": 0, #hilos del compresor; 0 los reparte automáticamente entre los núcleos
+    "checksums": ("sha256",), #algoritmos del .CHECKSUMS del .deb original
+    "cache": True, #reutiliza paquetes ya convertidos a partir de los mismos bytes
+    "cache_dir": default_cache_dir(),
+    "cache_size": 10 * 1024 ** 3, #límite de la caché en bytes
+    "sync_dir": "/var/lib/pacman/sync", #bases de datos de pacman para resolver dependencias sin red
+    "elf_deps": True, #añade las dependencias de las bibliotecas que usan los ELF del paquete (DT_NEEDED)
+    "batch": False, #modo no interactivo: sin limpiar la pantalla ni preguntar, un registro JSON por paquete
+    "output_dir": None, #directorio de salida; por defecto junto a cada .deb
+    "timings": False, #mide el tiempo, los bytes y la velocidad de cada etapa
+    "timings_file": None, #archivo JSON lines donde se añaden las mediciones de cada paquete
+    "profile": None, #archivo pstats donde se guarda el perfil de cProfile
+    "repo": None, #nombre del repositorio de pacman que se mantiene en output_dir (NAME.db.tar.zst)
+    "timeout": None, #segundos que puede tardar cada paquete de un lote antes de matar su proceso; None sin límite
+    "serve": None, #socket Unix en el que escucha el modo servidor
+    "journal": None, #diario de los lotes; None: uno por lote en cache_dir/journals
+    "worker": None, #directorio de la cola compartida de la que convierte este nodo
+    "enqueue": None, #directorio de la cola compartida a la que se añaden los .deb
+    "lease": 300.0, #segundos sin renovar el arriendo tras los que un nodo de la cola se da por muerto
+    "reproducible": False, #el mismo .deb con los mismos ajustes da siempre el mismo paquete, byte a byte
+    "source_date_epoch": None, #fecha del modo reproducible (SOURCE_DATE_EPOCH); None: la de data.tar en el .deb
+    "resume": False, #salta los paquetes que el diario da por terminados
+    "socket": None, #socket Unix de un servidor al que se mandan las conversiones (cliente)
+    "dedup_dir": None, #almacén de contenidos del motor "dedup"; por defecto cache_dir/payload
+    "dedup_size": 20 * 1024 ** 3, #límite del almacén en bytes
+    "workspace_dir": default_tmpfs_dir(), #tmpfs para los directorios de trabajo que caben en memoria; None lo desactiva
+    "workspace_memory": None, #presupuesto de memoria por conversión en bytes; None: una cuarta parte de la disponible, repartida entre los procesos
+}
+
+
+
+@dataclass
+class ConversionResult():
+    """Resultado de una conversión hecha con Archimedes.convert_stream"""
+    input: str
+    output: str
+    package: str = None
+    version: str = None
+    depends: list = field(default_factory=list)
+    checksums: dict = field(default_factory=dict) #checksums del .deb original
+    size: int = None #tamaño del paquete generado
+    duration: float = 0.0
+    cached: bool = False
+    timings: list = field(default_factory=list) #etapas medidas (solo con la opción "timings")
+    pkginfo: dict = None #campos del control ya traducidos (lo que va en .PKGINFO)
+    package_sha256: str = None #sha256 del paquete generado, calculado al escribirlo
+    files: list = field(default_factory=list) #rutas del paquete (los directorios acaban en "/"), para NAME.files
+    compression_policy: dict = None #decisiones de la compresión adaptativa (AdaptiveCompression.report)
+    sha256: str = None #sha256 del .deb original (la clave de la caché), aunque no esté en "checksums"
+
+    def metadata(self) -> dict:
+        """Lo que se guarda en la caché junto al paquete (lo que no depende de las rutas)"""
+        return {key: value for key, value in asdict(self).items()
+                if key in ("package", "version", "depends", "checksums", "pkginfo", "package_sha256", "files", "compression_policy")}
+
+#códigos de salida del modo no interactivo
+EXIT_OK = 0
+EXIT_FAILED = 1 #algún paquete no se pudo convertir
+EXIT_USAGE = 2 #argumentos incorrectos o ningún .deb encontrado (el mismo que usa argparse)
+
 class Archimedes():
 
-    def calculate_checksums(self,file_path):
-        """Calcula el checksum SHA-256 de un archivo"""
-        checksums = {} #creamos un diccionario donde se guardarán los checksums
-        algorithm = hashlib.sha256() #se inicializa el algoritmo
-        
+    timings = StageTimings() #desactivado hasta que convert_file crea el de la conversión
+
+    def __init__(self, options:dict=None):
+        self.options = {**DEFAULT_OPTIONS, **(options or {})} #opciones de conversión, con los valores por defecto
+
+    def compression_settings(self) -> tuple:
+        """Devuelve (formato, nivel, hilos) de la compresión de salida"""
+        compression = self.options["compression"]
+        level = self.options["level"]
+        if level is None:
+            level = DEFAULT_LEVELS[compression]
+        threads = self.options["threads"] or default_jobs() #0 = todos los núcleos disponibles
+        return compression, level, threads
+
+    def output_name(self, input_file:str) -> str:
+        """Ruta de salida para un .deb según la compresión elegida"""
+        file_path, _ = os.path.splitext(input_file)
+        return f"{file_path}{PKG_EXTENSIONS[self.options["compression"]]}"
+
+    def conversion_cache(self):
+        """Devuelve la caché de conversiones o None si está desactivada"""
+        if not self.options["cache"]:
+            return None
+        return ConversionCache(self.options["cache_dir"], self.options["cache_size"])
+
+    def payload_store(self) -> PayloadStore:
+        """Almacén de contenidos que usa el motor dedup"""
+        directory = self.options["dedup_dir"] or os.path.join(self.options["cache_dir"], "payload")
+        return PayloadStore(directory, self.options["dedup_size"])
+
+    def cache_settings(self, input_file:str) -> dict:
+        """Ajustes que cambian el paquete generado y, por tanto, forman parte de la clave de la caché"""
+        compression, level, _ = self.compression_settings()
+        return {
+            "file_name": os.path.basename(input_file), #aparece en .CHECKSUMS
+            "engine": self.options["engine"],
+            "compression": compression,
+            "level": level,
+            "adaptive": [self.options["adaptive_ratio"], self.options["adaptive_budget"]] if self.options["adaptive"] else None,
+            "checksums": list(self.options["checksums"]),
+            "pkgrel": pkgrel,
+            "elf_deps": self.options["elf_deps"],
+            "reproducible": self.options["reproducible"],
+            "source_date_epoch": self.options["source_date_epoch"],
+            "sync_databases": sorted(self.dependency_index().fingerprint().values()), #otras bases de pacman, otras dependencias
+        }
+
+    def log(self, *message):
+        """Muestra mensajes de progreso salvo en modo silencioso"""
+        if not self.options["quiet"]:
+            print(*message)
+
+    def calculate_checksums(self,file_path, algorithms=("sha256",)) -> dict:
+        """Calcula los checksums de un archivo en una pasada aparte.
+
+        Solo hace falta cuando no se pueden obtener mientras se lee
+        el .deb (ver ArReader); usa hashlib.file_digest para un único
+        algoritmo y mmap para varios a la vez"""
         try:
-            file = os.open(file_path, os.O_RDONLY) #abre el archivo original
-            os.lseek(file, 0,0) #pone el puntero al inicio
-            while True:
-                chunk = os.read(file,8192) #lee el archivo en bloques de 8192 Bytes, osea, 8,129 Kilobytes
-                algorithm.update(chunk) #actualiza el hash concatenando cada bloque leido anteriormente
-                if not chunk:
-                    break
-            checksums[chunk] = algorithm.hexdigest() #guarda el hash en formato hexadecimal en el diccionario de checksum 
+            with open(file_path, "rb") as file: #abre el archivo original
+                if len(algorithms) == 1:
+                    return {algorithms[0]: hashlib.file_digest(file, CHECKSUM_ALGORITHMS[algorithms[0]][1]).hexdigest()}
 
-            return checksums
-        except:
-            print("Algo ha fallado al calcular el checksum")
+                hashers = new_hashers(algorithms)
+                if os.fstat(file.fileno()).st_size: #mmap no admite archivos vacíos
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                        for start in range(0, len(view), HASH_CHUNK_SIZE): #bloques grandes: hashlib suelta el GIL y hay pocas llamadas
+                            chunk = view[start:start + HASH_CHUNK_SIZE]
+                            for hasher in hashers.values():
+                                hasher.update(chunk)
+                            chunk.release()
+                return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+        except OSError:
+            raise ArchimedesError("Algo ha fallado al calcular el checksum")
 
     def write_checksum(self, path:str,file_name:str,check_sum:dict):
         """Crea y escribe en el archivo .CHECKSUMS"""
         try:
-            fd = os.open(path, os.O_RDWR|os.O_CREAT) #crea el archivo de 
+            write_metadata_file(path, str.encode(self.format_checksum(file_name, check_sum))) #crea el archivo con modo 644
         except IOError:
-            print(f"No se puede escribir los checksums en \"{path}\" ")
-            sys.exit(1)
-        
-        _ = os.write(fd, str.encode(f"#Checksums calculados y escritos por Archimedes\n"))
-        _ = os.write(fd, str.encode(f"SHA256 {file_name} {check_sum[b""]}"))
-        os.close(fd)
+            raise ArchimedesError(f"No se puede escribir los checksums en \"{path}\" ")
+
+    def format_checksum(self, file_name:str, check_sum:dict) -> str:
+        """Devuelve el contenido del archivo .CHECKSUMS como texto"""
+        lines = [f"{CHECKSUM_ALGORITHMS[algorithm][0]} {file_name} {digest}" for algorithm, digest in check_sum.items()]
+        return "#Checksums calculados y escritos por Archimedes\n" + "\n".join(lines)
 
 
     def commands(self, *command_tuple:tuple):
@@ -109,35 +3058,58 @@ class Archimedes():
         "PKGINFO" Es un archivo que contiene información que retorna
         write_archcontrol()"""
         try:
-            fd = os.open(path, os.O_RDWR|os.O_CREAT) #abre el archivo con todos los nombres de los archivos del directorio
+            write_metadata_file(path, str.encode(self.format_archcontrol(pkginfo))) #crea el archivo con modo 644
         except IOError:
-            print(f"No se puede escribir en \"{path}\" ")
-            sys.exit(1)
+            raise ArchimedesError(f"No se puede escribir en \"{path}\" ")
+
+    def format_archcontrol(self, pkginfo) -> str:
+        """Devuelve el contenido del archivo "PKGINFO" como texto"""
         if pkginfo["url"]:
             url = pkginfo["url"]
         else:
             if "<" in pkginfo["maintainer"]:
-                _, splited = pkginfo["maintainer"].split("<")
+                _, splited = pkginfo["maintainer"].split("<", 1)
             else:
                 splited = pkginfo["maintainer"]
             url = f"<{splited}"
 
-        #escribe el archivo PKGINFO con los siguientes datos:
-        _ = os.write(fd, str.encode("# Generado por Archimedes\n"))
-        _ = os.write(fd, str.encode(f"pkgname = {pkginfo["package"]}\n"))
-        _ = os.write(fd, str.encode(f"pkgver = {pkginfo["version"]}-{pkgrel}\n"))
-        _ = os.write(fd, str.encode(f"pkgdesc = {pkginfo["description"]}\n"))
-        _ = os.write(fd, str.encode(f"packager = \"Arch Linux, Archimedes <https://github.com/Jhanfer/archimedes-converter>\"\n"))
-        _ = os.write(fd, str.encode(f"size = {pkginfo["installed-size"]}\n"))
-        _ = os.write(fd, str.encode(f"arch = {pkginfo["architecture"]}\n"))
-        _ = os.write(fd, str.encode(f"category = {pkginfo["section"]}\n"))
-        _ = os.write(fd, str.encode(f"license = unknown\n"))
-        _ = os.write(fd, str.encode(f"url = \"{url}\"\n"))
-        _ = os.write(fd, str.encode(f"builddate = {pkginfo["builddate"]}\n"))
-        _ = os.write(fd, str.encode(f"{"\n".join(f"depend = {i}" for i in pkginfo["depends"])}"))
+        #el archivo PKGINFO lleva los siguientes datos:
+        lines = [
+            "# Generado por Archimedes\n",
+            f"pkgname = {pkginfo["package"]}\n",
+            f"pkgver = {pkginfo["version"]}-{pkgrel}\n",
+            f"pkgdesc = {pkginfo["description"]}\n",
+            f"packager = \"Arch Linux, Archimedes <https://github.com/Jhanfer/archimedes-converter>\"\n",
+            f"size = {pkginfo["installed-size"]}\n",
+            f"arch = {pkginfo["architecture"]}\n",
+            f"category = {pkginfo["section"]}\n",
+            f"license = unknown\n",
+            f"url = \"{url}\"\n",
+            f"builddate = {pkginfo["builddate"]}\n",
+        ]
+        for key, field in (("depend", "depends"), ("optdepend", "optdepends"), ("conflict", "conflicts"), ("provides", "provides"), ("replaces", "replaces")):
+            lines.extend(f"{key} = {i}\n" for i in pkginfo.get(field, ()))
+        return "".join(lines)
 
-        os.close(fd)
 
+    def dependency_index(self) -> DependencyIndex:
+        """Índice de las bases de datos de pacman (se carga de forma perezosa)"""
+        return get_dependency_index(self.options["sync_dir"], self.options["cache_dir"])
+
+    def resolve_alternatives(self, alternatives:list):
+        """Elige la primera alternativa ("a | b") que se puede instalar en Arch.
+
+        Devuelve (posición de la alternativa, nombre en Arch). Sin bases de
+        datos de pacman se usa el mapeo de "debian_to_arch" sobre la primera
+        alternativa; con ellas, devuelve None si ninguna es instalable"""
+        index = self.dependency_index()
+        if not index.available:
+            return 0, self.change_dependencies(alternatives[0])
+        for position, name in enumerate(alternatives):
+            resolved = index.resolve(name, self.change_dependencies(name))
+            if resolved is not None:
+                return position, resolved
+        return None
 
     def change_dependencies(self, dep):
         """Cambia algunas dependecias de Debian a dependecias
@@ -154,20 +3126,14 @@ class Archimedes():
         y devuelve un diccionario con la información
         relevante para armar el PKGINFO"""
         try:
-            file = os.open(path,os.O_RDONLY) #lectura del archivo en solo lectura
-            os.lseek(file, 0, 0) #mueve el puntero al inicio del archivo
-            read_file = os.read(file, 100000).decode("utf-8") #lee el archivo de 0 al caracter "100000" y utiliza la función "decode()" para convertir los bytes a texto
-            
-        except IOError:
-            print(f"No se puede leer información de la dirección {path}")
-            sys.exit(1)
+            with open(path, encoding="utf-8", errors="replace") as file: #se lee línea a línea, sin límite de tamaño
+                return self.parse_control(file)
+        except OSError:
+            raise ArchimedesError(f"No se puede leer información de la dirección {path}")
 
-        # formateo de las lineas del archivo
-        files = read_file.strip("\n")
-        # Patrón para encontrar campos y sus valores usando expresiones regulares: Valor = clave
-        patron = r'([\w-]+):\s*(.*?)(?=\n[\w-]+:|$)'
-        # Encontrar todas las coincidencias
-        coincidencias = re.finditer(patron, files, re.DOTALL)
+    def parse_control(self, control):
+        """Interpreta un archivo control (texto o iterable de líneas)
+        y devuelve el diccionario para armar el PKGINFO"""
         #mapeo de campos arquitecturas
         architectures = {
             "amd64": "x86_64",
@@ -191,175 +3157,742 @@ class Archimedes():
             "version": "",
             "builddate":f"{unix_timestamp}",
             "depends":[],
+            "optdepends":[],
+            "conflicts":[],
+            "provides":[],
+            "replaces":[],
             "license":"",
             "url":"",
             "section":""
         }        
 
-        # Procesar cada coincidencia
-        for match in coincidencias:
-            field = match.group(1).lower()  # campo 
-            value = match.group(2).strip()  # valor del campo
+        if isinstance(control, str):
+            control = control.splitlines()
+        #un .deb tiene un solo párrafo; si hubiera varios, se usa el primero que describe un paquete
+        paragraph = next((paragraph for paragraph in parse_deb822(control) if "package" in paragraph), {})
+        deb_architecture = paragraph.get("architecture", "")
 
+        # Procesar cada campo
+        for field, value in paragraph.items():
+            #se cambian los if-elif-else por match-case
+            match field:
+                case "architecture": 
+                    mapped_fields[field] = architectures.get(value, "any") #retorna la arquitectura correcta
 
-            if field in mapped_fields: #verifica si está presente en el mapeo de campos
-                #se cambian los if-elif-else por match-case
-                match field:
-                    case "architecture": 
-                        mapped_fields[field] = architectures.get(value, "any") #retorna la arquitectura correcta
+                case "homepage" | "url":
+                    mapped_fields["url"] = value
 
-                    case "homepage" | "url":
-                        _, splited = value.split("<")
-                        mapped_fields[field] = f"<{splited}"
+                case "depends" | "pre-depends":
+                    self.map_relations(value, deb_architecture, mapped_fields["depends"], required=True)
 
-                    case "depends":
-                        depends = value.split(", ")
-                        for i in depends:
+                case "recommends":
+                    self.map_relations(value, deb_architecture, mapped_fields["optdepends"])
 
-                            nombre,*version = i.split(">=")
+                case "conflicts" | "provides" | "replaces":
+                    for group in parse_relations(value, deb_architecture):
+                        for relation in group: #aquí no hay alternativas que elegir: cuentan todas
+                            name = self.change_dependencies(relation[0])
+                            entry = f"{name}{arch_constraint(relation[1], relation[2])}"
+                            if name != paragraph.get("package") and entry not in mapped_fields[field]:
+                                mapped_fields[field].append(entry)
 
-                            version = "".join(version)
-                            f_name = re.sub(r'[^\w.>=-]', '', nombre)
-                            f_version = re.sub(r'[^\w.>=-]', '', version)
-                            arch_dep = self.change_dependencies(f_name)
-                            if arch_dep.count('lib') > 1:
-
-                                libs = re.findall(r'lib[a-zA-Z0-9-]+(?=[lib]|$)', arch_dep)
-                                """no está en uso"""
-                                continue
-                            else:
-                                mapped_fields["depends"].append(f"{arch_dep}")
-                    
-                    case "description":
-                        mapped_fields[field] = value.replace('\n', '').replace('\r', '')
+                case "description":
+                    mapped_fields[field] = value.split("\n", 1)[0].strip() #pkgdesc es una línea: el resumen de Debian
 
-                    case "version":
-                        try:
-                            version, _ = value.split("-")
-                            mapped_fields[field] = f"{version}_{_}"
-                        except:
-                            mapped_fields[field] = value
+                case "version":
+                    mapped_fields[field] = arch_version(value)
 
-                    case _:
-                        mapped_fields[field] = value
-            else:
-                continue
+                case _ if field in mapped_fields: #verifica si está presente en el mapeo de campos
+                    mapped_fields[field] = value
         
         if not mapped_fields["description"] and not mapped_fields["installed-size"]: #verifica si está description y size
-            print("Falta información necesaria")
-            sys.exit(1)
+            raise ArchimedesError("Falta información necesaria")
 
-        os.close(file) #cierra el archivo
-        
         return mapped_fields
-    
 
-    def change_dir(self,directory):
-        """Cambia el directorio"""
+    def map_relations(self, value:str, architecture:str, target:list, required:bool=False):
+        """Traduce un campo de relaciones de Debian ("a (>= 1) | b, c") a dependencias de Arch con versión"""
+        seen = {relation_name(entry) for entry in target}
+        for group in parse_relations(value, architecture):
+            if not group: #todas las alternativas eran de otras arquitecturas
+                continue
+            chosen = self.resolve_alternatives([relation[0] for relation in group])
+            if chosen is None:
+                if required:
+                    self.log(f"Aviso: ninguna alternativa de \"{" | ".join(relation[0] for relation in group)}\" existe en los repositorios de Arch; se omite")
+                continue
+            position, arch_dep = chosen
+            if arch_dep in seen: #varias de Debian pueden ser el mismo paquete de Arch
+                continue
+            seen.add(arch_dep)
+            _, operator, version = group[position]
+            target.append(f"{arch_dep}{arch_constraint(operator, version)}")
+
+    def merge_elf_dependencies(self, deb_info:dict, sonames:list):
+        """Añade a "depends" los paquetes de Arch que contienen las bibliotecas que usan los ELF"""
+        index = self.dependency_index()
+        if not sonames or not index.available: #sin bases de datos de pacman no hay a qué traducir los sonames
+            return
+        for soname in sonames:
+            package = index.soname_provider(soname)
+            if package is None:
+                self.log(f"Aviso: ningún paquete de Arch contiene {soname}")
+            elif package != deb_info["package"] and all(package != relation_name(entry) for entry in deb_info["depends"]):
+                deb_info["depends"].append(package)
+
+    def open_deb(self, input_file, known:dict=None, extra=()) -> ArReader:
+        """Abre el .deb como archivo ar; al leerlo calcula los checksums que no vengan ya calculados en "known" """
         try:
-            os.chdir(directory)
+            return ArReader(input_file, self.options["checksums"], known, extra)
         except OSError:
-            print(f"No es posible acceder al directorio {directory}")
+            raise ArchimedesError(f"No se puede leer el archivo {input_file}")
 
-    @contextmanager #creamos el manejador de contextos para los archivos temporales
-    def temp_directories(self): #elimina los archivos temporales independientemente de cómo acabe el código
-        #crea directorios temporales de entrada y salida
-        input_tempdir = mkdtemp()
-        output_tempdir = mkdtemp()
+    def workspace_manager(self) -> WorkspaceManager:
+        """Gestor de los directorios de trabajo con el presupuesto de memoria de las opciones"""
+        budget = self.options["workspace_memory"]
+        if budget is None:
+            budget = available_memory() // 4 // max(1, self.options["jobs"])
+        return WorkspaceManager(self.options["workspace_dir"], budget)
+
+    def workspace_size(self, data_member, deb_info:dict) -> int:
+        """Lo que ocupará data.tar extraído: el mayor entre las cabeceras del compresor e Installed-Size"""
+        size = unpacked_size(data_member.raw) or 0
         try:
-            yield input_tempdir, output_tempdir #se utiliza el controlador de llamada yield
-        finally:
-            shutil.rmtree(input_tempdir, True) 
-            shutil.rmtree(output_tempdir, True)
+            size = max(size, int(deb_info["installed-size"]) * 1024)
+        except (KeyError, ValueError):
+            pass
+        return size
+
+    @contextmanager #creamos el manejador de contextos para los archivos temporales
+    def temp_directories(self, size:int=0): #elimina los archivos temporales independientemente de cómo acabe el código
+        #crea el directorio temporal de salida (la entrada se lee directamente del .deb) en memoria si "size" cabe, o en disco
+        with self.workspace_manager().workspace(size) as output_tempdir: #se borra en segundo plano al salir
+            yield output_tempdir #se utiliza el controlador de llamada yield
 
-    def command_executer(self, *, input_file:str=None,input_dir:str=None, output_dir:str=None,output_file:str=None, **kwarg):
+    def command_executer(self, *, input_file:str=None,input_dir:str=None, output_dir:str=None,output_file:str=None, input_stream=None, manifest:str=None, **kwarg):
         """Ejecutador de comandos del sistema y manejo de errores"""
         try:
-            if kwarg["options"] == "ar_command_extract":
-                #extraer el archivo deb. Importante usar shlex para escapar correctamente la cadena de texto
-                os.system(f"ar x {shlex.quote(input_file)}")#esto es una linea de codigo utilizable en bash que extrae el archivo
+            if kwarg["options"] == "tar_command_extract" and input_stream is not None:
+                #extrae el "data.tar" leyéndolo directamente del .deb. "input_stream" ya llega descomprimido (ThreadedDecompressor)
+                command = ["bsdtar", "-xf", "-", "-C", output_dir]
+                if self.options["reproducible"]: #los permisos de data.tar, no los que deje la umask de quien convierte
+                    command.insert(1, "-p")
+                with TemporaryFile() as stderr: #en un archivo: una tubería llena bloquearía a bsdtar mientras se le escribe
+                    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=stderr)
+                    try:
+                        shutil.copyfileobj(input_stream, process.stdin, 1024 * 1024)
+                    except (EOFError, zlib.error, lzma.LZMAError) as error:
+                        process.kill()
+                        raise ArchimedesError(f"No se ha podido descomprimir el contenido del paquete: {error}")
+                    except BrokenPipeError: #bsdtar terminó antes de tiempo: su código y su stderr dicen por qué
+                        pass
+                    finally:
+                        try:
+                            process.stdin.close()
+                        except BrokenPipeError:
+                            pass
+                    if process.wait() != 0:
+                        stderr.seek(0)
+                        raise tool_error("No se ha podido extraer el contenido del paquete", command, process.returncode, stderr.read())
 
             elif kwarg["options"] == "tar_command_extract":
                 #extraer el "data.tar" de la carpeta temporal en la carpeta de salida temporal  
-                os.system(f"tar -xf {input_dir} -C {shlex.quote(output_dir)}") #esto es una linea de codigo utilizable en bash
+                run_tool(["bsdtar", "-xf", input_dir, "-C", output_dir], "No se ha podido extraer el contenido del paquete")
             elif kwarg["options"] == "make_pkg":
-                context = os.system(f"ionice -c2 -n7 nice -n 19 bsdtar -zvcf {shlex.quote(output_file)} * .PKGINFO .FILELIST .CHECKSUMS") #crea el instalador "pkg.tar.gz" usando el "PKGINFO" y "FILELIST" y lo deja en la ruta de salida "output_file"
-                os.system("clear")
-                return context
+                verbose = "" if self.options["quiet"] else "v" #en silencio no se lista cada archivo ni se limpia la pantalla
+                compression, level, threads = self.compression_settings()
+                reproducible = self.options["reproducible"]
+                compress_flags = { #opciones de bsdtar para cada formato
+                    "zst": f"--zstd --options zstd:compression-level={level},zstd:threads={threads}",
+                    #xz con un hilo usa otro codificador: con dos o más la salida no depende del número de hilos
+                    "xz": f"-J --options xz:compression-level={level},xz:threads={max(2, threads) if reproducible else threads}",
+                    #sin !timestamp la cabecera gzip lleva la hora de creación
+                    "gz": f"-z --options gzip:compression-level={level}{",gzip:!timestamp" if reproducible else ""}",
+                    "none": "",
+                }[compression]
+                #modo reproducible: los propietarios no son los de quien convierte
+                owner_flags = ["--uid", "0", "--gid", "0", "--uname", "root", "--gname", "root"] if reproducible else []
+                priority = ["ionice", "-c2", "-n7", "nice", "-n", "19"] if shutil.which("ionice") and shutil.which("nice") else []
+                if manifest: #motor "dedup": el contenido se toma del almacén según el manifiesto mtree
+                    members = [f"@{os.path.abspath(manifest)}"]
+                elif reproducible:
+                    members = None #la lista completa y ordenada va en un archivo: el orden del disco no entra en el paquete
+                else:
+                    members = sorted(name for name in os.listdir(input_dir) if not name.startswith(".")) #lo mismo que "*" en la shell
+                metadata = [".PKGINFO", ".FILELIST", ".CHECKSUMS", ".MTREE"]
+                #crea el instalador "pkg.tar.*" usando el "PKGINFO" y "FILELIST" y lo deja en la ruta de salida "output_file"; "-C" evita cambiar de directorio
+                #con "v" la lista de archivos va a la pantalla (stderr); si no, stderr se guarda para el mensaje de error
+                command = [*priority, "bsdtar", *shlex.split(compress_flags), *owner_flags, f"-{verbose}cf", output_file, "-C", input_dir]
+                if members is not None:
+                    run_tool([*command, "--", *members, *metadata], "No se ha podido crear el paquete", capture_stderr=not verbose)
+                else:
+                    with NamedTemporaryFile() as listing: #-n: sin recorrer directorios, solo lo que dice la lista
+                        listing.write(b"".join(os.fsencode(path.rstrip("/")) + b"\0" for path in [*self.package_paths(input_dir), *metadata]))
+                        listing.flush()
+                        run_tool([*command, "-n", "--null", "-T", listing.name], "No se ha podido crear el paquete", capture_stderr=not verbose)
+                if verbose:
+                    clear_screen()
+                return 0
             elif kwarg["options"] == "make_pkginfo":
-                os.system("find . -type f | sed -e \'s/^\\.\\///\' > .FILELIST") #crea un archivo con una lista de los nombres de los archivos dentro del directorio y sus subcarpetas
-        except:
-            print("Algo ha fallado")
-            sys.exit(1)
+                #crea un archivo con una lista de los nombres de los archivos dentro del directorio y sus subcarpetas (lo que hacía "find | sed", sin shell)
+                listing = run_tool(["find", ".", "-type", "f"], "No se ha podido crear la lista de archivos", cwd=input_dir, capture_stdout=True)
+                names = [line.removeprefix(b"./") for line in listing.splitlines()]
+                if self.options["reproducible"]: #el orden de find es el del sistema de archivos
+                    names.sort()
+                write_metadata_file(os.path.join(input_dir, ".FILELIST"), b"".join(name + b"\n" for name in names))
+        except ArchimedesError:
+            raise
+        except Exception:
+            raise ArchimedesError("Algo ha fallado")
 
-    def check_tar_gz(self, input_file:str):
-        """Comprobador de data.tar.gz o data.tar.xz"""
-        if os.path.exists("data.tar.gz"): #comprueba si existe el archivo "data.tar.gz"
-            data_path = "data.tar.gz"
-        else:
-            for item in os.listdir("."): #crea una lista de los archivos en el directorio, después busca si existe "data.tar"
-                if item.find("data.tar") == 0: #esto va a encontrar el data.tar.xz si existiese y lo asigna a data_path
-                    data_path = item
-                    break
+    def check_tar_gz(self, archive:ArReader, input_file:str, prefix:str="data.tar"):
+        """Comprobador de data.tar.* (o control.tar.*) dentro del .deb.
 
-            if data_path == "":
-                print(f"No se encontraron datos en {input_file}")
-                sys.exit(1)
+        Devuelve una vista sobre el miembro, sin extraerlo a disco"""
+        member = archive.find(prefix) #busca "data.tar.gz", "data.tar.xz", etc.
+        if member is None:
+            raise ArchimedesError(f"No se encontraron datos en {input_file}")
+
+        return io.BufferedReader(member, 1024 * 1024) #lecturas grandes sobre el .deb aunque tar pida bloques de 512 bytes
+
+    def read_control_member(self, control_member) -> str:
+        """Lee el archivo "control" de control.tar.* sin extraerlo"""
+        try:
+            with self.open_tar_member(control_member, timed=False) as control_tar: #detecta la compresión por los primeros bytes
+                for member in control_tar:
+                    if member.isfile() and os.path.normpath(member.name) == "control":
+                        return control_tar.extractfile(member).read().decode("utf-8")
+        except (tarfile.TarError, EOFError, OSError):
+            pass
+        raise ArchimedesError("El archivo control no ha sido encontrado...")
+
+    def package_path(self, name:str) -> str:
+        """Convierte una ruta de data.tar ("./usr/bin/x") en una ruta del paquete ("usr/bin/x")"""
+        path = os.path.normpath(name).lstrip("/")
+        return "" if path == "." else path
+
+    def metadata_member(self, name:str, content, mtime:int) -> tuple:
+        """Crea la cabecera y el contenido de un archivo de metadatos (.PKGINFO, .FILELIST...)"""
+        data = content.encode("utf-8") if isinstance(content, str) else content
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        info.mtime = mtime
+        info.uname = info.gname = "root"
+        return info, io.BytesIO(data)
+
+    def open_decompressed(self, member, timed:bool=True) -> ThreadedDecompressor:
+        """Contenido sin comprimir de control.tar.* o data.tar.*, sea cual sea su compresión"""
+        if not timed: #el control no se mide con la descompresión de data.tar
+            return ThreadedDecompressor(member)
+        return ThreadedDecompressor(member, self.timings.counter("decompress"), self.timings.counter("wait_decompress"))
+
+    @contextmanager
+    def open_tar_member(self, member, timed:bool=True):
+        """Un miembro tar.* en modo flujo, descomprimido en otro hilo mientras se procesan sus miembros"""
+        with self.open_decompressed(member, timed) as plain, \
+             tarfile.open(fileobj=plain, mode="r|", bufsize=PIPELINE_CHUNK) as member_tar:
+            yield member_tar
+
+    def repack_stream(self, data_member, output_file, deb_info:dict, *, file_name:str, archive:ArReader):
+        """Reempaqueta data.tar directamente en el paquete de salida.
+
+        Lee data.tar miembro a miembro y escribe cada uno en el .pkg.tar
+        conservando permisos, propietarios y enlaces; después añade .PKGINFO,
+        .FILELIST, .CHECKSUMS y .MTREE como miembros generados.
+
+        Los digests del .MTREE se calculan en esta misma pasada. La
+        descompresión de data.tar y la compresión del paquete van cada una en
+        su propio hilo, unidas a este por colas acotadas, así que un paquete
+        grande usa varios núcleos. "output_file" es una ruta o un archivo
+        binario abierto, que no se cierra. Con la opción "adaptive", el
+        nivel de cada miembro lo decide AdaptiveCompression.
+
+        Devuelve el sha256 del paquete generado, la lista de sus rutas y las
+        decisiones de la compresión adaptativa (None si no está activada)"""
+        filelist = [] #archivos regulares del paquete, como los listaba "find . -type f"
+        paths = [] #todas las rutas, para la base de datos NAME.files del repositorio
+        compression, level, threads = self.compression_settings()
+        adaptive = self.adaptive_compression(data_member)
+        counter = self.timings.counter("compress")
+        if adaptive is not None and counter is None: #el presupuesto de tiempo se mide aunque no se pidan las mediciones
+            counter = StageCounter("compress")
+        try:
+            with (open(output_file, "wb") if isinstance(output_file, (str, os.PathLike)) else nullcontext(output_file)) as raw_output, \
+                 ThreadedCompressedWriter(hashing := HashingWriter(raw_output), compression, level, threads,
+                                          counter, self.timings.counter("wait_compress")) as compressed, \
+                 MtreeBuilder(threads) as mtree, \
+                 tarfile.open(fileobj=compressed, mode="w", format=tarfile.PAX_FORMAT, copybufsize=PIPELINE_CHUNK) as package:
+                elf = ElfScanner(mtree.pool) if self.options["elf_deps"] else None
+                with self.open_tar_member(data_member) as data_tar: #modo flujo: nunca retrocede sobre el .deb
+                    for member in data_tar:
+                        name = self.package_path(member.name)
+                        if not name: #el directorio raíz "./" no forma parte del paquete
+                            continue
+                        member.name = name
+                        member.pax_headers.pop("path", None) #tarfile vuelve a generar las rutas largas con el nombre nuevo
+                        if member.islnk(): #los enlaces duros apuntan a otra ruta del propio paquete
+                            member.linkname = self.package_path(member.linkname)
+                            member.pax_headers.pop("linkpath", None)
+                        if self.options["reproducible"]:
+                            self.normalize_member(member, int(deb_info["builddate"]))
+
+                        digest = mtree.add(member)
+                        capture = elf.capture(member) if elf else None
+                        if adaptive is not None and adaptive.check_budget(counter):
+                            compressed.set_level(adaptive.current)
+                        if member.isreg():
+                            content = data_tar.extractfile(member)
+                            if adaptive is not None: #el nivel se decide antes de escribir la cabecera, que va en la misma trama que el contenido
+                                sample = content.read(ADAPTIVE_SAMPLE) if member.size >= ADAPTIVE_MIN_MEMBER else b""
+                                member_level = adaptive.switch(adaptive.member_level(name, member.size, sample), member.size)
+                                compressed.set_level(member_level)
+                                content = PrefixedReader(sample, content)
+                                if adaptive.budget is not None and member_level > adaptive.low:
+                                    content = BudgetedReader(content, adaptive, compressed, counter)
+                            package.addfile(member, DigestingReader(content, digest, capture)) #copia el contenido sin tocar el disco y lo hashea a la vez
+                            digest.finish()
+                            if elf:
+                                elf.submit(capture) #las cabeceras ELF se analizan en el pool
+                        else:
+                            package.addfile(member) #directorios, enlaces simbólicos, enlaces duros, dispositivos...
+                        if member.isreg() or member.islnk():
+                            filelist.append(name)
+                        paths.append(f"{name}/" if member.isdir() else name)
+
+                if elf:
+                    with self.timings.stage("elf_scan"): #espera a que el pool termine de analizar las cabeceras
+                        self.merge_elf_dependencies(deb_info, elf.needed())
+                mtime = int(deb_info["builddate"])
+                pkginfo = self.metadata_member(".PKGINFO", self.format_archcontrol(deb_info), mtime)
+                mtree.add_data(pkginfo[0], pkginfo[1].getvalue())
+                package.addfile(*pkginfo)
+                package.addfile(*self.metadata_member(".FILELIST", "".join(f"{i}\n" for i in filelist), mtime))
+                checksums = archive.digests() #ya se ha leído todo data.tar: los checksums del .deb están casi terminados
+                package.addfile(*self.metadata_member(".CHECKSUMS", self.format_checksum(file_name, checksums), mtime))
+                with self.timings.stage("mtree"): #espera a los últimos digests
+                    package.addfile(*self.metadata_member(".MTREE", mtree.render(), mtime))
+        except ArchimedesError:
+            self.remove_partial(output_file)
+            raise
+        except (tarfile.TarError, EOFError, zlib.error, lzma.LZMAError, OSError) as error:
+            self.remove_partial(output_file)
+            raise ArchimedesError(f"No se ha podido reempaquetar el contenido: {error}")
+        return hashing.sha256.hexdigest(), sorted(paths), adaptive.report() if adaptive is not None else None
+
+    def adaptive_compression(self, data_member):
+        """Política adaptativa de la conversión (None si la opción "adaptive" no está activada)"""
+        compression, level, _ = self.compression_settings()
+        if not self.options["adaptive"] or compression not in ADAPTIVE_LOW_LEVELS:
+            return None
+        budget = None if self.options["reproducible"] else self.options["adaptive_budget"] #el ritmo de la CPU no puede cambiar el paquete
+        return AdaptiveCompression(compression, level, self.options["adaptive_ratio"], budget, unpacked_size(data_member.raw))
+
+    def store_payload(self, data_member, directory:str, deb_info:dict, store:PayloadStore, *, file_name:str, archive:ArReader) -> list:
+        """Guarda el contenido de data.tar en el almacén y prepara el paquete en "directory" (motor "dedup").
+
+        Los archivos regulares se hashean al leerlos y solo se escriben si
+        su contenido no estaba ya en el almacén. En "directory" quedan
+        .PKGINFO, .FILELIST, .CHECKSUMS, .MTREE y PAYLOAD_MANIFEST, el
+        manifiesto mtree con el que bsdtar crea el paquete leyendo los
+        blobs. Devuelve la lista de rutas del paquete"""
+        filelist = []
+        paths = []
+        entries = [] #(tarinfo, blob, tamaño) en el orden de data.tar
+        blobs = {} #ruta -> (blob, tamaño), para los enlaces duros
+        linked = set() #rutas que son destino de un enlace duro
+        _, _, threads = self.compression_settings()
+        try:
+            with MtreeBuilder(threads) as mtree:
+                elf = ElfScanner(mtree.pool) if self.options["elf_deps"] else None
+                with self.open_tar_member(data_member) as data_tar:
+                    for member in data_tar:
+                        name = self.package_path(member.name)
+                        if not name:
+                            continue
+                        member.name = name
+                        blob, size = None, member.size
+                        if member.islnk():
+                            member.linkname = self.package_path(member.linkname)
+                            blob, size = blobs.get(member.linkname, (None, 0))
+                            if blob is None: #enlace a algo que no es un archivo regular del paquete
+                                raise ArchimedesError(f"Enlace duro no válido en data.tar: {name}")
+                            linked.add(member.linkname)
+                        if self.options["reproducible"]:
+                            self.normalize_member(member, int(deb_info["builddate"]))
+
+                        digest = mtree.add(member)
+                        capture = elf.capture(member) if elf else None
+                        if member.isreg():
+                            content = data_tar.extractfile(member)
+                            blob = store.add(DigestingReader(content, digest, capture), size, digest)
+                            blobs[name] = (blob, size)
+                            if elf:
+                                elf.submit(capture)
+                        if member.isreg() or member.islnk():
+                            filelist.append(name)
+                        entries.append((member, blob, size))
+                        paths.append(f"{name}/" if member.isdir() else name)
+
+                if elf:
+                    with self.timings.stage("elf_scan"):
+                        self.merge_elf_dependencies(deb_info, elf.needed())
+                mtime = int(deb_info["builddate"])
+                pkginfo = self.metadata_member(".PKGINFO", self.format_archcontrol(deb_info), mtime)
+                mtree.add_data(pkginfo[0], pkginfo[1].getvalue())
+                metadata = {
+                    ".PKGINFO": pkginfo[1].getvalue(),
+                    ".FILELIST": "".join(f"{i}\n" for i in filelist).encode("utf-8"),
+                    ".CHECKSUMS": self.format_checksum(file_name, archive.digests()).encode("utf-8"),
+                }
+                with self.timings.stage("mtree"):
+                    metadata[".MTREE"] = mtree.render()
+        except ArchimedesError:
+            raise
+        except (tarfile.TarError, EOFError, zlib.error, lzma.LZMAError, OSError) as error:
+            raise ArchimedesError(f"No se ha podido guardar el contenido en el almacén: {error}")
+
+        for name, content in metadata.items():
+            path = os.path.join(directory, name)
+            write_metadata_file(path, content)
+            os.utime(path, (mtime, mtime)) #la misma fecha que en el .MTREE, como en el motor "stream"
+        with open(os.path.join(directory, PAYLOAD_MANIFEST), "w", encoding="utf-8") as file:
+            file.write("#mtree\n")
+            for member, blob, size in entries:
+                file.write(self.manifest_line(member, blob, size, member.name in linked or member.islnk()) + "\n")
+        return sorted(paths)
+
+    def source_date(self, data_member) -> int:
+        """Fecha del modo reproducible: SOURCE_DATE_EPOCH o, si no se indica, la de data.tar en la cabecera ar del .deb"""
+        if self.options["source_date_epoch"] is not None:
+            return int(self.options["source_date_epoch"])
+        return data_member.raw.mtime
+
+    def normalize_member(self, member:tarfile.TarInfo, epoch:int):
+        """Modo reproducible: propietario root y fecha no posterior a "epoch", sin cabeceras pax que las contradigan"""
+        member.uid = member.gid = 0
+        member.uname = member.gname = "root"
+        member.mtime = min(int(member.mtime), epoch)
+        for key in ("uid", "gid", "uname", "gname", "mtime", "atime", "ctime"):
+            member.pax_headers.pop(key, None)
+
+    def normalize_tree(self, directory:str, epoch:int, names:list=None):
+        """Modo reproducible (motor "extract"): las fechas del directorio (o solo de "names"), en segundos
+        enteros y nunca posteriores a "epoch", como en normalize_member"""
+        if names is None:
+            names = [os.path.relpath(os.path.join(root, name), directory)
+                     for root, dirs, files in os.walk(directory, topdown=False) for name in files + dirs] #los directorios después de su contenido
+        for name in names:
+            path = os.path.join(directory, name)
+            mtime = min(int(os.lstat(path).st_mtime), epoch)
+            os.utime(path, (mtime, mtime), follow_symlinks=False)
+
+    def manifest_line(self, member:tarfile.TarInfo, blob:str, size:int, hardlinked:bool) -> str:
+        """Línea del manifiesto mtree de bsdtar para un miembro de data.tar.
+
+        Los enlaces duros se declaran como archivos con nlink=2 y el mismo
+        blob: bsdtar los vuelve a unir al ver el mismo inodo"""
+        fields = [mtree_escape(member.name), f"mode={member.mode & 0o7777:o}", f"uid={member.uid}", f"gid={member.gid}",
+                  f"time={int(member.mtime)}.0"]
+        if member.uname:
+            fields.append(f"uname={mtree_escape(member.uname)}")
+        if member.gname:
+            fields.append(f"gname={mtree_escape(member.gname)}")
+        if member.isdir():
+            fields.append("type=dir")
+        elif member.issym():
+            fields.extend(["type=link", f"link={mtree_escape(member.linkname)}"])
+        elif member.isreg() or member.islnk():
+            fields.extend(["type=file", f"size={size}", f"contents={mtree_escape(blob)}"])
+            if hardlinked:
+                fields.append("nlink=2")
+        elif member.isfifo():
+            fields.append("type=fifo")
+        elif member.ischr() or member.isblk():
+            fields.extend([f"type={"char" if member.ischr() else "block"}", f"device=native,{member.devmajor},{member.devminor}"])
+        return " ".join(fields)
+
+    def package_paths(self, directory:str) -> list:
+        """Rutas de un directorio extraído como aparecerían en el paquete (sin los archivos .* de la raíz)"""
+        paths = []
+        for root, dirs, files in os.walk(directory):
+            relative = os.path.relpath(root, directory)
+            for name in dirs + files:
+                if relative == "." and name.startswith("."):
+                    continue
+                path = name if relative == "." else f"{relative}/{name}"
+                paths.append(f"{path}/" if name in dirs and not os.path.islink(os.path.join(root, name)) else path)
+        return sorted(paths)
+
+    def remove_partial(self, output_file:str):
+        """Borra un paquete a medias para no dejarlo pasar por uno válido"""
+        if isinstance(output_file, (str, os.PathLike)) and os.path.exists(output_file):
+            os.remove(output_file)
+
+    def scan_elf_dir(self, directory:str) -> list:
+        """DT_NEEDED de los ELF de un directorio extraído, leyendo solo sus cabeceras en un pool de hilos"""
+        _, _, threads = self.compression_settings()
+        with ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="elf") as pool:
+            elf = ElfScanner(pool)
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    elf.add_path(os.path.join(root, name))
+            return elf.needed()
+
+    def write_mtree(self, directory:str):
+        """Escribe el .MTREE de un directorio extraído (motor "extract").
 
-        return data_path
+        Aquí no hay una copia en flujo que aprovechar, así que los archivos
+        se hashean con el pool de hilos de MtreeBuilder"""
+        _, _, threads = self.compression_settings()
+        with MtreeBuilder(threads) as mtree:
+            pending = [] #(digest, ruta) de los archivos que hay que leer
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                for name in dirs + sorted(files):
+                    path = os.path.join(root, name)
+                    relative = os.path.relpath(path, directory)
+                    if relative in (".MTREE", ".FILELIST", ".CHECKSUMS"):
+                        continue
+                    stat = os.lstat(path)
+                    info = tarfile.TarInfo(relative)
+                    info.mode, info.uid, info.gid, info.mtime = stat.st_mode, stat.st_uid, stat.st_gid, stat.st_mtime
+                    if self.options["reproducible"]: #como --uid/--gid de bsdtar al crear el paquete
+                        info.uid = info.gid = 0
+                    if os.path.islink(path):
+                        info.type, info.linkname = tarfile.SYMTYPE, os.readlink(path)
+                    elif os.path.isdir(path):
+                        info.type = tarfile.DIRTYPE
+                    elif os.path.isfile(path):
+                        info.size = stat.st_size
+                    else:
+                        continue
+                    digest = mtree.add(info, streaming=False)
+                    if digest is not None:
+                        pending.append((digest, path))
+
+            def hash_file(digest, path):
+                with open(path, "rb") as file:
+                    while chunk := file.read(HASH_CHUNK_SIZE):
+                        digest.update(chunk)
+
+            for future in [mtree.pool.submit(hash_file, digest, path) for digest, path in pending]:
+                future.result() #cada archivo en un hilo: hashlib suelta el GIL con bloques grandes
+            write_metadata_file(os.path.join(directory, ".MTREE"), mtree.render())
 
     def convert(self, input_file:str, output_file:str, context) -> tuple:
         """Crea archivos PKGINFO y FILELIST.
         
         Convierte el .deb en un paquete de arch
         """
-        print("\nIniciando conversión. Por favor, sea paciente y no teclee en la terminal.\n")    
-        with self.temp_directories() as (input_tempdir, output_tempdir): #llama al gestor de contexto de archivos temporales
-            print(f"Convirtiendo archivo {os.path.basename(input_file)}")
-            print(f"Creando archivos temporales\nInput: {input_tempdir}\nOutput: {output_tempdir}\n")
-            self.change_dir(input_tempdir) #accede al directorio temporal para posteriormente ser eliminado
-            
-            self.command_executer(input_file=input_file,options="ar_command_extract") #llama al extractor de archivos
+        result = self.convert_file(input_file, output_file)
+        self.report_timings(asdict(result))
+        self.update_repository([result])
+        output,_ = os.path.split(output_file)
+        return output, context
 
-            data_path = self.check_tar_gz(input_file)
-            
-            self.command_executer(input_dir=shlex.quote(os.path.join(input_tempdir, data_path)),output_dir=output_tempdir, options="tar_command_extract") #llama al extractor de archivos
+    def update_repository(self, results:list):
+        """Añade los paquetes convertidos a la base de datos del repositorio (opción "repo")"""
+        if not self.options["repo"] or not results:
+            return
+        _, _, threads = self.compression_settings()
+        repository = PackageRepository(self.options["output_dir"], self.options["repo"], threads, self.options["source_date_epoch"])
+        try:
+            skipped = repository.update(results)
+        except (OSError, tarfile.TarError, EOFError) as error:
+            raise ArchimedesError(f"No se ha podido actualizar el repositorio {self.options["repo"]}: {error}")
+        for package, version, kept in skipped:
+            message = f"{package} {version} no se añade al repositorio: ya tiene la versión {kept}, más nueva"
+            self.log(message)
+            if self.options["batch"]:
+                print(message, file=sys.stderr)
+        self.log(f"Repositorio actualizado: {repository.db_path}")
+        if self.options["batch"]:
+            print(f"Repositorio actualizado: {repository.db_path}", file=sys.stderr)
+
+    def report_timings(self, result:dict):
+        """Muestra (en stderr) y guarda las mediciones de un paquete, si las hay"""
+        if not result.get("timings"):
+            return
+        if not self.options["batch"]: #en modo no interactivo ya van en el registro JSON
+            print(f"\nTiempos de {os.path.basename(result["input"])}:\n{format_timings(result["timings"])}", file=sys.stderr)
+        if self.options["timings_file"]:
+            with open(self.options["timings_file"], "a", encoding="utf-8") as file:
+                file.write(json.dumps({key: result[key] for key in ("input", "output", "duration", "cached", "timings")}, ensure_ascii=False) + "\n")
+
+    @classmethod
+    def convert_stream(cls, src, dst, options:dict=None) -> ConversionResult:
+        """API para convertir desde otro programa de Python.
+
+        "src" es la ruta del .deb o un archivo binario abierto sobre él y
+        "dst" la ruta del paquete o un archivo binario abierto para escribir.
+        Cada llamada usa su propia instancia y no cambia el directorio de
+        trabajo, así que se puede usar desde varios hilos a la vez. No
+        escribe en pantalla: los errores se lanzan como ArchimedesError"""
+        return cls({"quiet": True, **(options or {})}).convert_file(src, dst)
+
+    def convert_file(self, src, dst) -> ConversionResult:
+        """Convierte "src" (ruta o archivo abierto) en el paquete "dst" (ruta o archivo abierto)"""
+        start = time.monotonic()
+        src_is_path = isinstance(src, (str, os.PathLike))
+        dst_is_path = isinstance(dst, (str, os.PathLike))
+        input_file = os.path.abspath(src) if src_is_path else getattr(src, "name", None)
+        output_file = os.path.abspath(dst) if dst_is_path else getattr(dst, "name", None)
+        if not isinstance(input_file, str): #archivos abiertos sin nombre (por ejemplo, con os.fdopen)
+            input_file = "paquete.deb"
+        file_name = os.path.basename(input_file)
+        timings = self.timings = StageTimings(self.options["timings"])
+
+        self.cache_hit = False
+        known = None
+        cache = self.conversion_cache() if src_is_path and dst_is_path else None #la caché enlaza rutas, no archivos abiertos
+        if cache is not None:
+            extension = PKG_EXTENSIONS[self.options["compression"]]
+            settings = self.cache_settings(input_file)
+            if cache.seen(input_file): #solo se hashea antes lo que ya se convirtió: un .deb nuevo se lee una sola vez
+                with timings.stage("cache_lookup") as stage: #el sha256 de la clave se reutiliza si al final hay que convertir
+                    known = self.calculate_checksums(input_file)
+                    metadata = cache.fetch(cache.key(known["sha256"], settings), extension, output_file)
+                    stage.bytes = os.path.getsize(input_file)
+                if metadata is not None and self.options["repo"] and not metadata.get("package_sha256"):
+                    metadata = None #entrada de una versión anterior sin los datos del repositorio: se vuelve a convertir
+                if metadata is not None: #mismos bytes y mismos ajustes: no hace falta convertir
+                    self.cache_hit = True
+                    self.log(f"{file_name} ya estaba convertido: se reutiliza el paquete de la caché")
+                    return ConversionResult(input=input_file, output=output_file, **metadata, size=os.path.getsize(output_file),
+                                            duration=time.monotonic() - start, cached=True, timings=timings.report(), sha256=known["sha256"])
+
+        self.log("\nIniciando conversión. Por favor, sea paciente y no teclee en la terminal.\n")
+        output_start = self.output_position(dst)
+        #el paquete se escribe con un nombre temporal y se renombra al terminar: nunca hay un paquete a medias con el nombre definitivo
+        work_file = partial_name(output_file) if dst_is_path else None
+        try:
+            result = self.convert_archive(src, dst if not dst_is_path else work_file, input_file, output_file, file_name, known,
+                                          extra=("sha256",) if cache is not None else ())
+            if dst_is_path:
+                os.replace(work_file, output_file)
+        except BaseException:
+            if dst_is_path:
+                self.remove_partial(work_file)
+            raise
+
+        if dst_is_path:
+            result.size = os.path.getsize(output_file)
+        elif output_start is not None:
+            result.size = self.output_position(dst) - output_start
+        if cache is not None:
+            try:
+                with timings.stage("cache_store", result.size or 0):
+                    cache.store(cache.key(result.sha256, settings), extension, output_file, result.metadata())
+                    cache.remember(input_file, result.sha256)
+            except OSError as error: #una caché que no se puede escribir no impide la conversión
+                self.log(f"No se ha podido guardar el paquete en la caché: {error}")
+        result.duration = time.monotonic() - start
+        result.timings = timings.report()
+        return result
+
+    def convert_archive(self, src, dst, input_file:str, output_file:str, file_name:str, known:dict=None, extra=()) -> ConversionResult:
+        """Hace la conversión de convert_file; "dst" es la ruta temporal o el archivo abierto donde se escribe el paquete,
+        "known", los checksums del .deb ya calculados y "extra", los que hay que calcular además de los del .CHECKSUMS"""
+        timings = self.timings
+        dst_is_path = isinstance(dst, (str, os.PathLike))
+        with timings.stage("open"): #el índice del ar (lo que antes hacía "ar x")
+            archive = self.open_deb(src, known, extra)
+        with archive:
+            self.log(f"Convirtiendo archivo {file_name}")
+
+            #el control.tar.* y el data.tar.* se leen directamente del .deb, sin "ar x"
+            control_member = self.check_tar_gz(archive, input_file, prefix="control.tar")
+            with timings.stage("control", control_member.raw.size):
+                deb_info = self.parse_control(self.read_control_member(control_member)) #lee el archivo control y retorna la información necesaria para crear el "PKGINFO"
 
-            #extraer archivo control en la carpeta temporal
-            control_file = os.path.join(input_tempdir, "control.tar.gz") #dirección del archivo control
-            if os.path.isfile(control_file): #comprobar si es un archivo o si existe
-                self.command_executer(input_dir=control_file,output_dir=input_tempdir,options="tar_command_extract") #llama al extractor de archivos
+            data_member = self.check_tar_gz(archive, input_file)
+            if self.options["reproducible"]: #la fecha sale del .deb, no del reloj: es también el límite de las fechas de los archivos
+                deb_info["builddate"] = str(self.source_date(data_member))
+
+            compression_policy = None
+            if self.options["engine"] == "stream":
+                #data.tar se copia miembro a miembro al paquete, sin pasar por el disco
+                with timings.stage("repack", data_member.raw.size):
+                    package_sha256, files, compression_policy = self.repack_stream(data_member, dst, deb_info, file_name=file_name, archive=archive)
+                if compression_policy is not None and compression_policy["stored"]:
+                    self.log(f"Compresión adaptativa: {len(compression_policy["stored"])} archivos ({format_size(compression_policy["stored_bytes"])}) "
+                             f"ya comprimidos van al nivel {compression_policy["low_level"]}")
             else:
-                control_file = os.path.join(input_tempdir, "control.tar.xz") #por si está en otro formato
-                if os.path.isfile(control_file): #comprobar si es un archivo o si existe
-                    os.system(f"tar -xf {shlex.quote(control_file)}") #extración del archivo control
-                else:
-                    print("El archivo control no ha sido encontrado...")
-                    sys.exit(1)
-            deb_info = self.read_control(os.path.join(input_tempdir, "control")) #lee el archivo control y retorna la información necesaria para crear el "PKGINFO"
-            os.chdir(output_tempdir) #cambiamos de directorio
-            
-            self.command_executer(options="make_pkginfo") #llama al ejecutador de comandos para crear el PKGINFO
-            self.write_archcontrol(f"{output_tempdir}/.PKGINFO", deb_info) #crea el archivo PKGINFO en el directorio temporal de salida con los datos extraidos de "deb_info"
-            
-            
-            checksums = self.calculate_checksums(file_path=input_file) #calculamos el checksum del archivo original
-            self.write_checksum(path=f"{output_tempdir}/.CHECKSUMS", file_name=input_file.split("/")[-1],check_sum=checksums) #se crea el archivo .CHECKSUMS pasandole el nombre del archivo original, la ruta donde se escribirá y los checksums calculados
-            self.command_executer(output_file=output_file,options="make_pkg") #se crea el PKG
-            
-            output,_ = os.path.split(output_file)
+                workspace_size = 0 if self.options["engine"] == "dedup" else self.workspace_size(data_member, deb_info) #"dedup" solo escribe los metadatos
+                with self.temp_directories(workspace_size) as output_tempdir: #llama al gestor de contexto de archivos temporales
+                    self.log(f"Creando archivos temporales\nOutput: {output_tempdir}\n")
+                    manifest = None
+                    if self.options["engine"] == "dedup":
+                        #el contenido va al almacén y bsdtar lo lee de allí: solo se escriben los archivos nuevos
+                        store = self.payload_store()
+                        with timings.stage("store", data_member.raw.size):
+                            files = self.store_payload(data_member, output_tempdir, deb_info, store, file_name=file_name, archive=archive)
+                        manifest = os.path.join(output_tempdir, PAYLOAD_MANIFEST)
+                        self.log(f"Almacén: {format_size(store.added)} nuevos, {format_size(store.reused)} reutilizados")
+                    else:
+                        with timings.stage("extract", data_member.raw.size): #lo que antes era "tar -xf"
+                            with self.open_decompressed(data_member) as plain: #bsdtar recibe el tar ya descomprimido, sea cual sea el formato
+                                self.command_executer(input_stream=plain,output_dir=output_tempdir, options="tar_command_extract") #llama al extractor de archivos
 
-        return output, context
+                        with timings.stage("filelist"): #"find | sed"
+                            self.command_executer(input_dir=output_tempdir, options="make_pkginfo") #llama al ejecutador de comandos para crear el PKGINFO
+                        if self.options["elf_deps"]:
+                            with timings.stage("elf_scan"):
+                                self.merge_elf_dependencies(deb_info, self.scan_elf_dir(output_tempdir))
+                        self.write_archcontrol(f"{output_tempdir}/.PKGINFO", deb_info) #crea el archivo PKGINFO en el directorio temporal de salida con los datos extraidos de "deb_info"
+
+                        with timings.stage("checksums"): #solo lo que quede del .deb por leer
+                            checksums = archive.digests() #el checksum del archivo original ya se calculó al leerlo
+
+                        self.write_checksum(path=f"{output_tempdir}/.CHECKSUMS", file_name=file_name,check_sum=checksums) #se crea el archivo .CHECKSUMS pasandole el nombre del archivo original, la ruta donde se escribirá y los checksums calculados
+                        if self.options["reproducible"]: #las fechas de la extracción y de los metadatos recién escritos no entran en el paquete
+                            self.normalize_tree(output_tempdir, int(deb_info["builddate"]))
+                        with timings.stage("mtree"):
+                            self.write_mtree(output_tempdir) #.MTREE para que pacman pueda validar los archivos instalados
+                        if self.options["reproducible"]:
+                            self.normalize_tree(output_tempdir, int(deb_info["builddate"]), [".MTREE"])
+                        files = self.package_paths(output_tempdir)
+                    with timings.stage("package") as stage: #bsdtar + compresión
+                        if dst_is_path:
+                            self.command_executer(input_dir=output_tempdir, output_file=dst, manifest=manifest, options="make_pkg") #se crea el PKG
+                            stage.bytes = os.path.getsize(dst)
+                            package_sha256 = self.calculate_checksums(dst)["sha256"] #bsdtar no lo calcula: se lee una vez más
+                        else: #bsdtar escribe en un archivo temporal que luego se copia al archivo abierto
+                            with NamedTemporaryFile(suffix=PKG_EXTENSIONS[self.options["compression"]]) as package_file:
+                                self.command_executer(input_dir=output_tempdir, output_file=package_file.name, manifest=manifest, options="make_pkg")
+                                package_sha256 = self.calculate_checksums(package_file.name)["sha256"]
+                                shutil.copyfileobj(package_file, dst, 1024 * 1024)
+                    if manifest:
+                        with timings.stage("store_evict"): #los blobs recién usados quedan protegidos por PayloadStore.GRACE
+                            store.evict()
+
+            return ConversionResult(input=input_file, output=output_file, package=deb_info["package"], version=deb_info["version"],
+                                    depends=list(deb_info["depends"]), checksums=archive.digests(),
+                                    pkginfo=deb_info, package_sha256=package_sha256, files=files, compression_policy=compression_policy,
+                                    sha256=archive.digest("sha256"))
+
+    def output_position(self, dst):
+        """Posición de un archivo de salida abierto (None si es una ruta o no admite tell)"""
+        if isinstance(dst, (str, os.PathLike)):
+            return None
+        try:
+            dst.flush()
+            return dst.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
 
     def convert_iterator(self, DATA:dict):
         """Iterador para la función convert"""
         if DATA: #comprueba si existe el diccionario
             if type(DATA["input_file"]) == list: #comprueba si el diccionario tiene listas
-                for input in DATA["input_file"]: #itera sobre la lista de rutas, convirtiendo los archivos respectivamente
-                    file_path, _ = input.split(".deb") #se extrae el .deb de la ruta de entrada
-                    output_file = f"{file_path}.pkg.tar.gz" #se genera la ruta de salida
-                    output, context = self.convert(input, output_file, context="list_end")
-                return output, context
+                jobs = []
+                for input in DATA["input_file"]: #itera sobre la lista de rutas, generando la ruta de salida de cada archivo
+                    jobs.append((input, self.output_name(input))) #la extensión depende de la compresión
+                #se convierten en paralelo; el diario es el del directorio, para poder reanudarlo con --resume
+                results = self.convert_batch(jobs, journal=self.journal_path(sorted({os.path.dirname(input) for input in DATA["input_file"]})))
+                output, _ = os.path.split(results[-1]["output"])
+                return output, "list_end"
 
             elif type(DATA["input_file"]) == str and type(DATA["output_file"]) == str: #comprueba si el diccionario tiene cadenas
                 output, context = self.convert(DATA["input_file"],DATA["output_file"], context="string_end")
@@ -368,9 +3901,218 @@ class Archimedes():
                 output, context = self.convert(DATA["input_file"],DATA["output_file"], context="string_end")
                 return output, context
 
+    def worker_options(self, workers:int) -> dict:
+        """Opciones para las conversiones que se hacen en otros procesos, "workers" a la vez"""
+        options = {**self.options, "quiet": True} #los procesos no escriben en pantalla, el principal informa por ellos
+        if not options["threads"]: #se reparten los núcleos entre los procesos para no saturar la máquina
+            options["threads"] = max(1, default_jobs() // workers)
+        return options
+
+    def journal_path(self, paths:list) -> str:
+        """Diario de un lote: el de --journal o uno por cada combinación de rutas y directorio de salida"""
+        if self.options["journal"]:
+            return self.options["journal"]
+        key = json.dumps([sorted(os.path.abspath(path) for path in paths), self.options["output_dir"]])
+        return os.path.join(self.options["cache_dir"], "journals", f"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]}.jsonl")
+
+    def journal_settings(self) -> str:
+        """Resumen de los ajustes que cambian el paquete generado (los de la caché, salvo el nombre del .deb)"""
+        settings = self.cache_settings("")
+        del settings["file_name"]
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def convert_batch(self, jobs:list, on_result=None, journal:str=None) -> list:
+        """Convierte una lista de (entrada, salida) con un número acotado de procesos (BatchOrchestrator).
+
+        Cada paquete se informa en cuanto termina (con "on_result" si se
+        indica) y un paquete defectuoso, o que agota el tiempo, nunca
+        detiene el resto del lote. Con "journal" el lote se anota en ese
+        diario (BatchJournal) y, con la opción "resume", no se vuelven a
+        convertir los paquetes que el diario da por terminados"""
+        total = len(jobs)
+        results = []
+        skipped = []
+        if journal is not None:
+            journal = BatchJournal(journal, self.journal_settings())
+            if self.options["resume"]:
+                entries = journal.load()
+                pending = []
+                for input_file, output_file in jobs:
+                    entry = entries.get(input_file)
+                    if (journal.completed(entry, input_file, output_file, lambda path: self.calculate_checksums(path)["sha256"])
+                            and (not self.options["repo"] or entry.get("conversion"))): #sin sus datos no se podría añadir al repositorio
+                        skipped.append(entry)
+                    else:
+                        pending.append((input_file, output_file))
+                jobs = pending
+            journal.open(append=self.options["resume"])
+        workers = max(1, min(self.options["jobs"], len(jobs)))
+        worker_options = self.worker_options(workers)
+
+        def report(result):
+            results.append(result)
+            if journal is not None and not result.get("skipped"):
+                journal.record(result)
+            self.report_timings(result)
+            if on_result is not None:
+                on_result(result)
+            elif result["status"] == "ok":
+                origin = "ya convertido" if result.get("skipped") else "caché" if result["cached"] else f"{result["duration"]:.1f}s"
+                print(f"[{len(results)}/{total}] OK    {os.path.basename(result["input"])} ({origin})")
+            else:
+                print(f"[{len(results)}/{total}] ERROR {os.path.basename(result["input"])}: {result["error"]}")
+
+        try:
+            if skipped:
+                self.log(f"\n{len(skipped)} paquetes ya estaban convertidos según el diario {journal.path}")
+            for entry in skipped:
+                report(journal.result(entry))
+            if journal is not None:
+                journal.pending(jobs) #los que sigan "pending" si el lote se corta estaban en marcha o sin empezar
+            self.log(f"\nConvirtiendo {len(jobs)} paquetes con {workers} procesos\n")
+            if self.options["profile"]: #cProfile solo ve este proceso: las conversiones se hacen aquí, una detrás de otra
+                for input_file, output_file in jobs:
+                    report(convert_job(input_file, output_file, worker_options))
+            else:
+                orchestrator = BatchOrchestrator(worker_options, workers, self.options["timeout"])
+                asyncio.run(orchestrator.run(jobs, report)) #Ctrl+C cancela el lote y mata los procesos en marcha
+        finally:
+            if journal is not None:
+                journal.close()
+
+        failed = [result for result in results if result["status"] != "ok"]
+        self.log(f"\nConvertidos {total - len(failed)} de {total} paquetes")
+        self.update_repository([result["conversion"] for result in results if result.get("conversion")]) #una sola escritura para todo el lote
+        return results
+
+    def discover(self, paths:list) -> list:
+        """Busca los .deb de las rutas dadas (recorriendo los directorios con os.scandir)
+        y devuelve la lista de (entrada, salida)"""
+        output_dir = self.options["output_dir"]
+        jobs, seen, outputs = [], set(), {}
+
+        def add(input_file:str, relative_dir:str):
+            real = os.path.realpath(input_file)
+            if real in seen: #la misma entrada por dos caminos se convierte una sola vez
+                return
+            seen.add(real)
+            output_file = self.output_name(input_file)
+            if output_dir and self.options["repo"]: #pacman busca los paquetes junto a la base de datos (%FILENAME% es solo el nombre)
+                output_file = os.path.join(output_dir, os.path.basename(output_file))
+                if output_file in outputs:
+                    print(f"{input_file} se omite: {outputs[output_file]} ya genera {os.path.basename(output_file)} en el repositorio", file=sys.stderr)
+                    return
+            elif output_dir: #se conserva la estructura de subdirectorios para que no choquen nombres iguales
+                output_file = os.path.normpath(os.path.join(output_dir, relative_dir, os.path.basename(output_file)))
+            outputs[output_file] = input_file
+            jobs.append((input_file, output_file))
+
+        for path in paths:
+            path = os.path.abspath(path)
+            if not os.path.isdir(path):
+                add(path, "")
+                continue
+            pending = [path]
+            while pending:
+                directory = pending.pop()
+                with os.scandir(directory) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+                for entry in reversed(entries): #la pila devuelve los subdirectorios en orden alfabético
+                    if entry.is_dir(follow_symlinks=False): #los enlaces a directorios se ignoran para no entrar en bucles
+                        pending.append(entry.path)
+                for entry in entries:
+                    if entry.name.endswith(".deb") and entry.is_file():
+                        add(entry.path, os.path.relpath(directory, path))
+        return jobs
+
+    def batch(self, paths:list) -> int:
+        """Modo no interactivo: convierte todos los .deb de las rutas y escribe
+        un registro JSON por línea en la salida estándar. Devuelve el código de salida"""
+        jobs = self.discover(paths)
+        if not jobs:
+            print("No se ha encontrado ningún archivo .deb", file=sys.stderr)
+            return EXIT_USAGE
+        for _, output_file in jobs:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+        def emit(result):
+            print(json.dumps(batch_record(result), ensure_ascii=False), flush=True)
+
+        results = self.convert_batch(jobs, on_result=emit, journal=self.journal_path(paths))
+        failed = sum(result["status"] != "ok" for result in results)
+        print(f"Convertidos {len(results) - failed} de {len(results)} paquetes", file=sys.stderr)
+        return EXIT_FAILED if failed else EXIT_OK
+
+    def serve(self) -> int:
+        """Modo servidor (--serve): atiende conversiones en un socket Unix hasta recibir SIGTERM"""
+        asyncio.run(ConversionServer(self.options).serve())
+        return EXIT_OK
+
+    def remote_batch(self, paths:list) -> int:
+        """Cliente de --socket: manda los .deb a un servidor arrancado con --serve y
+        escribe sus registros JSON igual que el modo no interactivo"""
+        jobs = self.discover(paths)
+        if not jobs:
+            print("No se ha encontrado ningún archivo .deb", file=sys.stderr)
+            return EXIT_USAGE
+        for _, output_file in jobs:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        request = json.dumps({"jobs": jobs, "options": self.options}).encode("utf-8") + b"\n"
+        summary = None
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(self.options["socket"])
+                client.sendall(request)
+                with client.makefile("r", encoding="utf-8") as responses:
+                    for line in responses:
+                        response = json.loads(line)
+                        if response.get("done"):
+                            summary = response
+                            break
+                        print(json.dumps(response, ensure_ascii=False), flush=True)
+        except OSError as error:
+            raise ArchimedesError(f"No se puede usar el servidor de {self.options["socket"]}: {error}")
+        if summary is None:
+            raise ArchimedesError("El servidor cerró la conexión antes de terminar")
+        print(f"Convertidos {summary["total"] - summary["failed"]} de {summary["total"]} paquetes", file=sys.stderr)
+        if summary["error"]:
+            print(summary["error"], file=sys.stderr)
+        return EXIT_FAILED if summary["failed"] or summary["error"] else EXIT_OK
+
+    def enqueue(self, paths:list) -> int:
+        """--enqueue: añade los .deb de las rutas a una cola compartida para los nodos --worker"""
+        jobs = self.discover(paths)
+        if not jobs:
+            print("No se ha encontrado ningún archivo .deb", file=sys.stderr)
+            return EXIT_USAGE
+        work_queue = WorkQueue(self.options["enqueue"])
+        added = work_queue.enqueue(jobs, {key: self.options[key] for key in QUEUE_OPTIONS})
+        print(f"{added} paquetes añadidos a la cola {self.options["enqueue"]} ({len(jobs) - added} ya estaban en ella)", file=sys.stderr)
+        return EXIT_OK
+
+    def run_worker(self) -> int:
+        """--worker: convierte paquetes de una cola compartida hasta vaciarla, con los
+        ajustes de la cola, y escribe un registro JSON por paquete como el modo no interactivo"""
+        node = re.sub(r"[^\w.-]", "_", f"{socket.gethostname()}-{os.getpid()}")
+        work_queue = WorkQueue(self.options["worker"], node, self.options["lease"])
+        workers = max(1, self.options["jobs"])
+        options = Archimedes({**self.options, **work_queue.options()}).worker_options(workers)
+        orchestrator = BatchOrchestrator(options, workers, self.options["timeout"])
+        records = []
+
+        def report(record):
+            records.append(record)
+            print(json.dumps(record, ensure_ascii=False), flush=True)
+
+        print(f"Nodo {node}: convirtiendo de {self.options["worker"]} con {workers} procesos", file=sys.stderr, flush=True)
+        asyncio.run(work_queue.work(orchestrator, workers, report))
+        failed = sum(record["status"] != "ok" for record in records)
+        print(f"Nodo {node}: convertidos {len(records) - failed} de {len(records)} paquetes", file=sys.stderr)
+        return EXIT_FAILED if failed else EXIT_OK
+
     def simple_gui(self, path):
         """GUI simple"""
-        os.system("clear")
+        clear_screen()
         #se cran las listas para guardar las rutas de entrada y salida, además de los nombres
         input_deb_path = []
         output_deb_path = []
@@ -383,7 +4125,7 @@ class Archimedes():
             #confirmamos que sea .deb
             if not file_extension != ".deb":
                 input_file_path = f"{os.path.abspath(os.path.join(file_path,file))}" #rescatamos la ruta de entrada
-                output_file_path = f"{os.path.abspath(os.path.join(file_path,file_name))}.pkg.tar.gz" #creamos la ruta de salida
+                output_file_path = self.output_name(os.path.abspath(os.path.join(file_path,file))) #creamos la ruta de salida
                 self.convert_iterator({"input_file":input_file_path,"output_file":output_file_path}) #se usa el iterador de convert
                 print(f"\nSu archivo se encuentra en {output_file_path}")
                 print("Adiós! Gracias por usar Archimedes :D")
@@ -398,7 +4140,7 @@ class Archimedes():
                 if i.endswith(".deb"): #busca los que terminan por .deb 
                     _, file_extension = os.path.splitext(i) #separamos la ruta de su extensión
                     input_deb_path.append(os.path.abspath(f"{file_path}/{i}")) #juntamos la ruta de entrada y el nombre del archivo
-                    output_deb_path.append(os.path.abspath(f"{file_path}/{_}.pkg.tar.gz")) #creamos la ruta de salida con la ruta de entrada, el nombre del archivo sin el .deb y el .pkg.tar.gz
+                    output_deb_path.append(self.output_name(os.path.abspath(f"{file_path}/{i}"))) #creamos la ruta de salida con la ruta de entrada, el nombre del archivo sin el .deb y la extensión del paquete
                     input_deb_names.append(f"{i}") #creamos la lista de nombres
             
             while True:
@@ -411,7 +4153,7 @@ class Archimedes():
                     print("\nEscriba \"all\" para convertirlos a todos o el número del archivo que desee convertir. Presione cualquier tecla para cerrar:")
                 
                     select = input("\n") #se le pide al usuario una opción
-                    os.system("clear")
+                    clear_screen()
                     match select:
                         case "all": #se convierten todos los archivos pasandole las listas completas
                             self.convert_iterator({"input_file":input_deb_path,"output_file":""}) #no se le pasan las rutas de salida porque en este caso las genera automáticamente
@@ -423,7 +4165,7 @@ class Archimedes():
                                 print(f"\n### Su archivo se encuentra en {file_path} ###")
                                 continue
                             else:
-                                os.system("clear")
+                                clear_screen()
                                 print("Adiós! Gracias por usar Archimedes :D")
                                 sys.exit(1)
                 else:
@@ -439,25 +4181,260 @@ class Archimedes():
         y retorna el path del archivo"""
         
         #maneja los argumentos: ruta de archivo y comando -help
-        parser.add_argument("input_deb_file", help="Ruta del archivo a convertir (.deb). Es obligatorio ingresar este dato, porque sin él no es posible localizar el archivo. El resultado del Script de Archimedes guardará el archivo convertido en la misma carpeta que el archivo original.", type=str)
+        parser.add_argument("--engine", choices=["stream", "extract", "dedup"], default=DEFAULT_OPTIONS["engine"],
+                            help="Motor de conversión: \"stream\" reempaqueta data.tar directamente en el paquete; \"extract\" lo extrae a un directorio temporal y lo empaqueta con bsdtar; \"dedup\" guarda cada contenido una sola vez en un almacén compartido (para muchas versiones del mismo paquete)")
+        parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_OPTIONS["jobs"],
+                            help="Número de paquetes que se convierten a la vez al convertir un directorio")
+        parser.add_argument("--timeout", type=float, default=None, metavar="SEGUNDOS",
+                            help="En un lote, mata la conversión de un paquete que tarde más de estos segundos y la informa como error")
+        parser.add_argument("--resume", action="store_true",
+                            help="Reanuda un lote interrumpido: no vuelve a convertir los paquetes que su diario da por terminados, solo los fallidos y los que estaban en marcha")
+        parser.add_argument("--journal", default=None, metavar="ARCHIVO",
+                            help="Diario del lote (JSON lines); por defecto uno por combinación de rutas y --output-dir en CACHE_DIR/journals")
+        parser.add_argument("--enqueue", default=None, metavar="COLA",
+                            help="Añade los .deb de las rutas a una cola compartida (un directorio, por ejemplo en NFS) con los ajustes de conversión indicados, para convertirlos con --worker")
+        parser.add_argument("--worker", default=None, metavar="COLA",
+                            help="Modo nodo: convierte paquetes de una cola compartida hasta vaciarla (se pueden lanzar varios, en este y en otros equipos)")
+        parser.add_argument("--lease", type=float, default=DEFAULT_OPTIONS["lease"], metavar="SEGUNDOS",
+                            help="Con --worker: segundos sin señales de vida tras los que los paquetes de un nodo pasan a otro (debe superar la caché de atributos de NFS)")
+        parser.add_argument("--reproducible", action="store_true",
+                            help="Paquetes reproducibles: el mismo .deb con los mismos ajustes da el mismo paquete byte a byte (fecha de SOURCE_DATE_EPOCH o, si no está definida, la de data.tar; propietario root). Implícito si SOURCE_DATE_EPOCH está definida")
+        parser.add_argument("--serve", default=None, metavar="SOCKET",
+                            help="Modo servidor: atiende conversiones en este socket Unix con un pool de procesos y el índice de dependencias siempre cargados (los clientes usan --socket)")
+        parser.add_argument("--socket", default=None, metavar="SOCKET",
+                            help="Manda las conversiones a un servidor arrancado con --serve en lugar de hacerlas en este proceso (implica --batch)")
+        parser.add_argument("--compression", choices=list(PKG_EXTENSIONS), default=DEFAULT_OPTIONS["compression"],
+                            help="Compresión del paquete de salida")
+        parser.add_argument("--level", type=int, default=None,
+                            help="Nivel de compresión (por defecto: zst 3, xz 6, gz 6)")
+        parser.add_argument("--adaptive", action="store_true",
+                            help="Compresión adaptativa (motor stream): estima con una muestra si cada archivo grande se deja comprimir y guarda los que no (PNG, vídeo, .pak...) al nivel más bajo del formato. Las decisiones se añaden al resultado de cada paquete")
+        parser.add_argument("--adaptive-ratio", type=float, default=None, metavar="RATIO",
+                            help=f"Tasa de la muestra (tamaño comprimido/original) a partir de la que un archivo va al nivel bajo (por defecto {DEFAULT_OPTIONS["adaptive_ratio"]}); implica --adaptive")
+        parser.add_argument("--adaptive-budget", type=float, default=None, metavar="SECONDS",
+                            help="Segundos de compresión por paquete: si al ritmo actual no caben, se baja el nivel del resto del paquete; implica --adaptive")
+        parser.add_argument("--threads", type=int, default=DEFAULT_OPTIONS["threads"],
+                            help="Hilos del compresor (zst y xz). 0 reparte los núcleos automáticamente")
+        parser.add_argument("--checksums", default=",".join(DEFAULT_OPTIONS["checksums"]),
+                            help=f"Algoritmos del .CHECKSUMS separados por comas ({", ".join(CHECKSUM_ALGORITHMS)})")
+        parser.add_argument("--cache-dir", default=DEFAULT_OPTIONS["cache_dir"],
+                            help="Directorio de la caché de paquetes convertidos")
+        parser.add_argument("--cache-size", type=int, default=DEFAULT_OPTIONS["cache_size"] // 1024 ** 2,
+                            help="Tamaño máximo de la caché en MiB; se borran primero los paquetes usados hace más tiempo")
+        parser.add_argument("--no-cache", action="store_true",
+                            help="No reutiliza ni guarda paquetes en la caché")
+        parser.add_argument("--sync-dir", default=DEFAULT_OPTIONS["sync_dir"],
+                            help="Directorio con las bases de datos de pacman (*.db, *.files) usadas para resolver dependencias")
+        parser.add_argument("--no-elf-deps", action="store_true",
+                            help="No añade dependencias a partir de las bibliotecas que usan los binarios del paquete (DT_NEEDED)")
+        parser.add_argument("--batch", action="store_true",
+                            help="Modo no interactivo: convierte todo sin preguntar y escribe un registro JSON por paquete (implícito con varias rutas o --output-dir)")
+        parser.add_argument("-o", "--output-dir", default=None,
+                            help="Directorio donde se guardan los paquetes convertidos (por defecto, junto a cada .deb)")
+        parser.add_argument("--timings", action="store_true",
+                            help="Mide el tiempo, los bytes y la velocidad de cada etapa de la conversión y muestra un resumen")
+        parser.add_argument("--timings-file", default=None,
+                            help="Añade las mediciones de cada paquete (JSON, una línea por paquete) a este archivo; implica --timings")
+        parser.add_argument("--profile", default=None, metavar="ARCHIVO",
+                            help="Ejecuta la conversión con cProfile (en un solo proceso) y guarda las estadísticas (pstats) en este archivo")
+        parser.add_argument("--repo", default=None, metavar="NOMBRE",
+                            help="Mantiene en --output-dir un repositorio de pacman (NOMBRE.db.tar.zst y NOMBRE.files.tar.zst) con los paquetes convertidos (todos en --output-dir, sin subdirectorios; de cada paquete, la versión más nueva)")
+        parser.add_argument("--dedup-dir", default=None,
+                            help="Almacén de contenidos del motor dedup (por defecto, CACHE_DIR/payload)")
+        parser.add_argument("--dedup-size", type=int, default=DEFAULT_OPTIONS["dedup_size"] // 1024 ** 2,
+                            help="Tamaño máximo del almacén del motor dedup en MiB; se borran primero los contenidos usados hace más tiempo")
+        parser.add_argument("--workspace-dir", default=DEFAULT_OPTIONS["workspace_dir"],
+                            help="tmpfs donde se extraen los paquetes que caben en memoria (por defecto /dev/shm); los demás van al directorio temporal del sistema")
+        parser.add_argument("--workspace-memory", type=int, default=None,
+                            help="Memoria máxima en MiB que puede usar cada conversión en el tmpfs; 0 extrae siempre a disco (por defecto, una cuarta parte de la memoria disponible repartida entre los procesos)")
+        parser.add_argument("input_deb_file", nargs="*", help="Ruta del archivo a convertir (.deb) o de un directorio. Es obligatorio ingresar este dato, porque sin él no es posible localizar el archivo. El resultado del Script de Archimedes guardará el archivo convertido en la misma carpeta que el archivo original.", type=str)
         args = parser.parse_args()
-        path = args.input_deb_file
+        paths = args.input_deb_file
+        self.options["engine"] = args.engine
+        if args.jobs < 1:
+            parser.error("--jobs debe ser al menos 1")
+        self.options["jobs"] = args.jobs
+        if args.timeout is not None:
+            if args.timeout <= 0:
+                parser.error("--timeout debe ser mayor que 0")
+            if args.serve is not None: #un proceso del pool no se puede matar sin romper el pool entero
+                parser.error("--timeout no se puede usar con --serve")
+            self.options["timeout"] = args.timeout
+        if args.worker is not None or args.enqueue is not None:
+            if args.worker is not None and args.enqueue is not None:
+                parser.error("--worker y --enqueue no se pueden usar a la vez")
+            if args.serve is not None or args.socket is not None or args.repo is not None or args.resume:
+                parser.error("--worker y --enqueue no se pueden usar con --serve, --socket, --repo ni --resume")
+            if args.worker is not None and paths:
+                parser.error("--worker no admite rutas: los paquetes salen de la cola")
+            if args.lease <= 0:
+                parser.error("--lease debe ser mayor que 0")
+            self.options["lease"] = args.lease
+            if args.worker is not None:
+                self.options["worker"] = os.path.abspath(args.worker)
+                self.options["quiet"] = True #la salida estándar queda para los registros JSON
+            else:
+                self.options["enqueue"] = os.path.abspath(args.enqueue)
+        if args.serve is not None:
+            if paths or args.socket is not None:
+                parser.error("--serve no admite rutas ni --socket: las conversiones llegan de los clientes")
+            self.options["serve"] = os.path.abspath(args.serve)
+        elif not paths and args.worker is None:
+            parser.error("Falta la ruta del archivo .deb o del directorio a convertir")
+        if args.socket is not None:
+            if args.resume: #el servidor no lleva diario: cada petición es independiente
+                parser.error("--resume no se puede usar con --socket")
+            self.options["socket"] = os.path.abspath(args.socket)
+        self.options["resume"] = args.resume
+        if args.journal is not None:
+            self.options["journal"] = os.path.abspath(args.journal)
+        if args.level is not None:
+            low, high = LEVEL_RANGES[args.compression]
+            if not low <= args.level <= high:
+                parser.error(f"--level para {args.compression} debe estar entre {low} y {high}")
+        if args.threads < 0:
+            parser.error("--threads no puede ser negativo")
+        self.options.update(compression=args.compression, level=args.level, threads=args.threads)
+        if args.adaptive or args.adaptive_ratio is not None or args.adaptive_budget is not None:
+            if args.engine != "stream": #solo el motor "stream" comprime el paquete él mismo
+                parser.error("--adaptive solo se puede usar con --engine stream")
+            if args.compression == "none":
+                parser.error("--adaptive necesita un formato comprimido")
+            if args.adaptive_ratio is not None:
+                if not 0 < args.adaptive_ratio <= 1:
+                    parser.error("--adaptive-ratio debe estar entre 0 y 1")
+                self.options["adaptive_ratio"] = args.adaptive_ratio
+            if args.adaptive_budget is not None:
+                if args.adaptive_budget <= 0:
+                    parser.error("--adaptive-budget debe ser mayor que 0")
+                if args.reproducible or "SOURCE_DATE_EPOCH" in os.environ: #el paquete dependería de la velocidad de la máquina
+                    parser.error("--adaptive-budget no se puede usar con --reproducible ni con SOURCE_DATE_EPOCH")
+                self.options["adaptive_budget"] = args.adaptive_budget
+            self.options["adaptive"] = True
+        checksums = tuple(dict.fromkeys(algorithm.strip() for algorithm in args.checksums.split(",") if algorithm.strip()))
+        unknown = [algorithm for algorithm in checksums if algorithm not in CHECKSUM_ALGORITHMS]
+        if unknown or not checksums:
+            parser.error(f"Algoritmos de checksum no válidos: {", ".join(unknown) or args.checksums}")
+        self.options["checksums"] = checksums
+        self.options.update(cache=not args.no_cache, cache_dir=os.path.abspath(args.cache_dir), cache_size=args.cache_size * 1024 ** 2)
+        self.options["sync_dir"] = os.path.abspath(args.sync_dir)
+        if args.dedup_dir is not None:
+            self.options["dedup_dir"] = os.path.abspath(args.dedup_dir)
+        self.options["dedup_size"] = args.dedup_size * 1024 ** 2
+        if args.workspace_dir:
+            if not os.path.isdir(args.workspace_dir):
+                parser.error(f"--workspace-dir: no existe el directorio {args.workspace_dir}")
+            self.options["workspace_dir"] = os.path.abspath(args.workspace_dir)
+        if args.workspace_memory is not None:
+            if args.workspace_memory < 0:
+                parser.error("--workspace-memory no puede ser negativo")
+            self.options["workspace_memory"] = args.workspace_memory * 1024 ** 2
+        self.options["elf_deps"] = not args.no_elf_deps
+        source_date_epoch = os.environ.get("SOURCE_DATE_EPOCH")
+        if source_date_epoch is not None: #la convención de reproducible-builds.org: si está definida, se respeta
+            if not source_date_epoch.isdigit():
+                parser.error(f"SOURCE_DATE_EPOCH no es una fecha válida (segundos desde 1970): {source_date_epoch}")
+            self.options["source_date_epoch"] = int(source_date_epoch)
+        self.options["reproducible"] = args.reproducible or source_date_epoch is not None
+        self.options["batch"] = args.batch or len(paths) > 1 or args.output_dir is not None or args.socket is not None
+        if args.output_dir is not None:
+            self.options["output_dir"] = os.path.abspath(args.output_dir)
+        if args.repo is not None:
+            if args.output_dir is None: #la base de datos y los paquetes tienen que estar en el mismo directorio
+                parser.error("--repo necesita --output-dir")
+            if not re.fullmatch(r"[\w.+-]+", args.repo):
+                parser.error("--repo: nombre de repositorio no válido")
+            self.options["repo"] = args.repo
+        self.options["timings"] = args.timings or args.timings_file is not None
+        if args.timings_file is not None:
+            self.options["timings_file"] = os.path.abspath(args.timings_file)
+        if args.profile is not None:
+            self.options["profile"] = os.path.abspath(args.profile)
+            self.options["jobs"] = 1 #cProfile solo ve el proceso principal: las conversiones no van a procesos aparte
+
+        if self.options["serve"] or self.options["worker"]:
+            return paths
+        if self.options["batch"]:
+            self.options["quiet"] = True #la salida estándar queda solo para los registros JSON
+            missing = [path for path in paths if not os.path.exists(path)]
+            if missing:
+                parser.error(f"No existe: {", ".join(missing)}")
+            return paths
 
-        if not os.path.isfile(path) and not os.access(path,os.F_OK): #verifica si es una ruta de archivo válida
+        if not os.path.isfile(paths[0]) and not os.access(paths[0],os.F_OK): #verifica si es una ruta de archivo válida
             print("Por favor, ingrese una ruta correcta...")
             sys.exit(1)
         
-        return path
+        return paths
+
 
+def batch_record(result:dict) -> dict:
+    """Registro JSON de un paquete en el modo no interactivo (y en las respuestas del servidor)"""
+    record = {key: result.get(key) for key in ("input", "output", "size", "duration", "status", "error", "cached")}
+    record["duration"] = round(record["duration"], 3)
+    if result.get("skipped"): #ya estaba convertido en el diario (--resume)
+        record["skipped"] = True
+    if result.get("timings"):
+        record["timings"] = result["timings"]
+    if result.get("compression_policy"):
+        record["compression_policy"] = result["compression_policy"]
+    return record
+
+
+def convert_job(input_file:str, output_file:str, options:dict) -> dict:
+    """Convierte un paquete dentro de un proceso aparte (de un lote o del servidor).
+
+    Nunca lanza excepciones: devuelve un diccionario con el resultado
+    para que el proceso principal lo informe"""
+    start = time.monotonic()
+    result = {"input": input_file, "output": output_file, "status": "ok", "error": None, "cached": False, "size": None}
+    try:
+        conversion = Archimedes.convert_stream(input_file, output_file, options)
+        result.update(cached=conversion.cached, size=conversion.size, timings=conversion.timings,
+                      sha256=conversion.sha256 or conversion.checksums.get("sha256"))
+        if conversion.compression_policy is not None:
+            result["compression_policy"] = conversion.compression_policy
+        if options.get("repo"): #el proceso principal actualiza la base de datos con todo el lote
+            result["conversion"] = asdict(conversion)
+    except ArchimedesError as error:
+        result.update(status="error", error=str(error))
+    except Exception as error:
+        result.update(status="error", error=f"{type(error).__name__}: {error}")
+    result["duration"] = time.monotonic() - start
+    return result
 
 
 if __name__ == "__main__": 
+    if sys.argv[1:] == ["--job"]: #proceso hijo de BatchOrchestrator: un paquete, sin interfaz
+        sys.exit(run_job())
     archimedes = Archimedes() #inicializa la clase
+    profiler = None
     try:
-        PATH = archimedes.command_handler() #inicializa el manejador de argumentos y los guarda en "DATA"
-        archimedes.commands("ar", "bsdtar", "find", "sed") #inicializa la búsqueda de los comandos
-        DATA = archimedes.simple_gui(PATH)
+        PATHS = archimedes.command_handler() #inicializa el manejador de argumentos y los guarda en "DATA"
+        if archimedes.options["socket"]: #el servidor hace la conversión: aquí no hace falta ningún comando
+            sys.exit(archimedes.remote_batch(PATHS))
+        if archimedes.options["enqueue"]: #los nodos hacen la conversión
+            sys.exit(archimedes.enqueue(PATHS))
+        archimedes.commands("bsdtar", "find") #inicializa la búsqueda de los comandos
+        if archimedes.options["serve"]:
+            sys.exit(archimedes.serve())
+        if archimedes.options["worker"]:
+            sys.exit(archimedes.run_worker())
+        if archimedes.options["profile"]:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if archimedes.options["batch"]:
+            sys.exit(archimedes.batch(PATHS))
+        DATA = archimedes.simple_gui(PATHS[0])
+    except ArchimedesError as error:
+        print(error, file=sys.stderr if archimedes.options["batch"] else sys.stdout)
+        sys.exit(EXIT_FAILED)
     except KeyboardInterrupt:
         print("Abortando...")
+    finally:
+        if profiler is not None: #también si simple_gui termina con sys.exit
+            profiler.disable()
+            profiler.dump_stats(archimedes.options["profile"])
+            print(f"Perfil guardado en {archimedes.options["profile"]}", file=sys.stderr)
 
 # vim:ai:et:sw=4:ts=4:sts=4:tw=78:fenc=utf-8
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+#
+#    GitHub: https://github.com/Jhanfer/archimedes-converter
+#    Archimedes: deb to arch converter
+#    Copyright (C) 2024  Jhanfer
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Banco de pruebas de rendimiento de Archimedes.
+
+Genera paquetes .deb sintéticos (siempre los mismos para una semilla y una
+escala), mide la conversión completa y cada etapa por separado, y escribe
+los resultados en JSON para poder comparar entre versiones.
+
+Cada medición se ejecuta en un proceso nuevo para que el pico de memoria
+(RSS) y los bytes leídos y escritos sean solo los de esa medición"""
+
+import sys
+import os
+import io
+import argparse
+import importlib.util
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import tarfile
+import time
+from tempfile import mkdtemp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONVERTER = os.path.join(HERE, "archimedes-converter.py")
+
+
+def load_converter():
+    """Importa archimedes-converter.py (el guion no tiene un nombre importable)"""
+    sys.path.insert(0, HERE) #para que encuentre el paquete DATA
+    spec = importlib.util.spec_from_file_location("archimedes_converter", CONVERTER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+#formas de paquete: cuántos archivos, de qué tamaño y a qué profundidad (con escala 1)
+SHAPES = {
+    "huge": {"files": 3, "size": 128 * 1024 ** 2, "depth": 1, "description": 1}, #pocos archivos enormes
+    "tiny": {"files": 200_000, "size": 100, "depth": 2, "description": 1}, #cientos de miles de archivos diminutos
+    "deep": {"files": 4_000, "size": 4096, "depth": 200, "description": 1}, #árbol de directorios muy profundo
+    "control": {"files": 10, "size": 4096, "depth": 1, "description": 200_000}, #control enorme con una descripción larga
+    "pathological": {"files": 10, "size": 4096, "depth": 1, "description": 50_000}, #control hecho para castigar al analizador
+}
+STAGES = ["control", "decompress", "checksums", "convert", "convert-extract"]
+MEMBER_COMPRESSIONS = ["gz", "xz", "zst"]
+
+
+class SyntheticFile():
+    """Contenido de archivo reproducible: mitad bytes aleatorios, mitad texto repetido (comprime como un binario real)"""
+
+    TEXT = b"Archimedes convierte paquetes .deb en paquetes de Arch Linux.\n" * 64
+
+    def __init__(self, rng:random.Random, size:int):
+        self.rng = rng
+        self.remaining = size
+
+    def read(self, size=-1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        chunks, left = [], size
+        while left:
+            block = min(left, 64 * 1024)
+            half = block // 2
+            chunks.append(self.rng.randbytes(half) + (self.TEXT * (block // len(self.TEXT) + 1))[:block - half])
+            left -= block
+        self.remaining -= size
+        return b"".join(chunks)
+
+
+def scaled(value:int, scale:float) -> int:
+    return max(1, int(value * scale))
+
+
+def pathological_control(scale:float) -> str:
+    """Archivo control que castiga a los analizadores con retroceso: líneas que casi
+    son campos, una línea enorme sin saltos y miles de alternativas en una dependencia"""
+    lines = scaled(SHAPES["pathological"]["description"], scale)
+    description = "".join(f" Casi-Un-Campo-{i}-{"x" * 200}\n" if i % 2 else f" {"palabra" * 150}\n" for i in range(lines))
+    description += f" {"y" * scaled(4 * 1024 ** 2, scale)}\n" #una sola línea de varios MiB
+    alternatives = " | ".join(f"libalt{i} (>= {i}:1.0-1) [amd64 !i386]" for i in range(scaled(20_000, scale)))
+    return ("Package: bench-pathological\n"
+            "Version: 1.0.0-1\n"
+            "Architecture: amd64\n"
+            "Maintainer: Archimedes\n" #sin "<": rompía el análisis de la URL
+            "Installed-Size: 1024\n"
+            f"Depends: libc6 (>= 2.34), {alternatives}\n"
+            f"Description: paquete sintético \"pathological\"\n{description}")
+
+
+def control_text(shape:str, scale:float) -> str:
+    """Archivo control del paquete sintético"""
+    if shape == "pathological":
+        return pathological_control(scale)
+    lines = SHAPES[shape]["description"] if shape == "control" else 1
+    description = "".join(f" Línea {i} de una descripción larga para medir el análisis del archivo control.\n" for i in range(scaled(lines, scale) if lines > 1 else 0))
+    depends = ", ".join(["libc6 (>= 2.34)", "libgtk-3-0 | libgtk-4-1", "zlib1g"] + [f"libdummy{i} (>= {i}.0)" for i in range(scaled(2000, scale) if shape == "control" else 0)])
+    return (f"Package: bench-{shape}\n"
+            "Version: 1.0.0-1\n"
+            "Architecture: amd64\n"
+            "Maintainer: Archimedes <bench@example.org>\n"
+            "Installed-Size: 1024\n"
+            f"Depends: {depends}\n"
+            "Section: misc\n"
+            "Priority: optional\n"
+            "Homepage: https://github.com/Jhanfer/archimedes-converter\n"
+            f"Description: paquete sintético \"{shape}\"\n{description}")
+
+
+def tar_member(name:str, size:int=0, kind=tarfile.REGTYPE, mode:int=0o644) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.type, info.size, info.mode, info.mtime = kind, size, mode, 1700000000 #fecha fija: mismo .deb en cada ejecución
+    info.uname = info.gname = "root"
+    return info
+
+
+def write_member_tar(converter, path:str, compression:str, fill):
+    """Escribe un tar comprimido con el compresor del propio conversor"""
+    with open(path, "wb") as raw, converter.CompressedWriter(raw, compression, converter.DEFAULT_LEVELS[compression], 1) as compressed, \
+         tarfile.open(fileobj=compressed, mode="w", format=tarfile.GNU_FORMAT) as tar:
+        fill(tar)
+
+
+def fill_data(shape:str, scale:float, seed:int):
+    """Devuelve la función que llena data.tar para una forma de paquete"""
+    spec = SHAPES[shape]
+
+    def fill(tar:tarfile.TarFile):
+        rng = random.Random(seed)
+        tar.addfile(tar_member("./", kind=tarfile.DIRTYPE, mode=0o755))
+        files, depth = scaled(spec["files"], scale), spec["depth"]
+        size = spec["size"] if shape != "huge" else scaled(spec["size"], scale)
+        directories = ["."]
+        for level in range(1, depth + 1): #una cadena de directorios anidados
+            directories.append(f"{directories[-1]}/d{level}")
+            tar.addfile(tar_member(f"{directories[-1]}/", kind=tarfile.DIRTYPE, mode=0o755))
+        for i in range(files):
+            directory = directories[1 + i % depth]
+            tar.addfile(tar_member(f"{directory}/f{i:07d}", size), SyntheticFile(rng, size))
+    return fill
+
+
+def write_ar(path:str, members:list):
+    """Escribe un archivo ar (formato de los .deb) con [(nombre, ruta)]"""
+    with open(path, "wb") as output:
+        output.write(b"!<arch>\n")
+        for name, source in members:
+            size = os.path.getsize(source)
+            output.write(f"{name:<16}{1700000000:<12}{0:<6}{0:<6}{100644:<8}{size:<10}`\n".encode("ascii"))
+            with open(source, "rb") as file:
+                while chunk := file.read(1024 * 1024):
+                    output.write(chunk)
+            if size % 2:
+                output.write(b"\n")
+
+
+def generate_deb(converter, workdir:str, shape:str, compression:str, scale:float, seed:int) -> str:
+    """Crea (o reutiliza) el .deb sintético de una forma y compresión"""
+    path = os.path.join(workdir, f"{shape}-{compression}-s{scale:g}-r{seed}.deb")
+    if os.path.exists(path):
+        return path
+    extension = {"gz": ".gz", "xz": ".xz", "zst": ".zst"}[compression]
+    control_tar = os.path.join(workdir, f"control.tar{extension}")
+    data_tar = os.path.join(workdir, f"data.tar{extension}")
+    debian_binary = os.path.join(workdir, "debian-binary")
+    with open(debian_binary, "w") as file:
+        file.write("2.0\n")
+
+    def fill_control(tar:tarfile.TarFile):
+        content = control_text(shape, scale).encode("utf-8")
+        tar.addfile(tar_member("./", kind=tarfile.DIRTYPE, mode=0o755))
+        tar.addfile(tar_member("./control", len(content)), io.BytesIO(content))
+
+    write_member_tar(converter, control_tar, compression, fill_control)
+    write_member_tar(converter, data_tar, compression, fill_data(shape, scale, seed))
+    write_ar(f"{path}.tmp", [("debian-binary", debian_binary), (f"control.tar{extension}", control_tar), (f"data.tar{extension}", data_tar)])
+    os.replace(f"{path}.tmp", path) #un .deb a medio generar nunca se reutiliza
+    for temporary in (control_tar, data_tar, debian_binary):
+        os.remove(temporary)
+    return path
+
+
+def run_stage(converter, stage:str, deb:str, output_dir:str, options:dict) -> int:
+    """Ejecuta una etapa sobre un .deb. Devuelve los bytes producidos"""
+    archimedes = converter.Archimedes({"quiet": True, "cache": False, **options})
+    if stage == "control":
+        with converter.ArReader(deb) as archive:
+            control = archimedes.check_tar_gz(archive, deb, prefix="control.tar")
+            archimedes.parse_control(archimedes.read_control_member(control))
+        return 0
+    if stage == "decompress":
+        total = 0
+        with converter.ArReader(deb) as archive, archimedes.open_tar_member(archimedes.check_tar_gz(archive, deb)) as data_tar: #la misma descompresión que la conversión
+            for member in data_tar:
+                if member.isreg():
+                    content = data_tar.extractfile(member)
+                    while chunk := content.read(1024 * 1024):
+                        total += len(chunk)
+        return total
+    if stage == "checksums":
+        archimedes.calculate_checksums(deb, archimedes.options["checksums"])
+        return 0
+    engine = "extract" if stage == "convert-extract" else "stream"
+    output = os.path.join(output_dir, f"bench{converter.PKG_EXTENSIONS[archimedes.options["compression"]]}")
+    try:
+        return converter.Archimedes.convert_stream(deb, output, {**archimedes.options, "engine": engine}).size
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+
+
+def process_io() -> dict:
+    """Bytes leídos y escritos por este proceso (Linux: /proc/self/io)"""
+    try:
+        with open("/proc/self/io") as file:
+            fields = dict(line.split(": ") for line in file.read().splitlines())
+        return {key: int(fields[key]) for key in ("rchar", "wchar", "read_bytes", "write_bytes")}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def measure(stage:str, deb:str, output_dir:str, options:dict) -> dict:
+    """Medición de una etapa (se ejecuta en el proceso hijo)"""
+    converter = load_converter()
+    io_before = process_io()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    produced = run_stage(converter, stage, deb, output_dir, options)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    io_after = process_io()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN) #bsdtar y demás comandos del motor "extract"
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "wall": wall,
+        "cpu": cpu + children.ru_utime + children.ru_stime,
+        "peak_rss": max(own.ru_maxrss, children.ru_maxrss) * 1024, #ru_maxrss va en KiB en Linux
+        **{key: io_after[key] - io_before[key] for key in io_after},
+        "bytes_out": produced,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "-C", HERE, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    converter = load_converter()
+    workdir = args.workdir or mkdtemp(prefix="archimedes-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    options = {"compression": args.compression, "jobs": 1}
+    report = {
+        "version": converter.__version__,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "options": options,
+        "results": [],
+    }
+    for shape in args.shapes:
+        for compression in args.member_compressions:
+            print(f"Generando {shape} ({compression})...", file=sys.stderr)
+            deb = generate_deb(converter, workdir, shape, compression, args.scale, args.seed)
+            for stage in args.stages:
+                runs = []
+                for _ in range(args.repeat):
+                    process = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", stage, deb, workdir, json.dumps(options)],
+                                             capture_output=True, text=True)
+                    if process.returncode != 0:
+                        runs.append({"error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"código {process.returncode}"})
+                        break
+                    runs.append(json.loads(process.stdout))
+                result = {"shape": shape, "member_compression": compression, "stage": stage, "input_size": os.path.getsize(deb), "runs": runs}
+                walls = [measurement["wall"] for measurement in runs if "wall" in measurement]
+                if walls:
+                    result.update(wall_min=min(walls), wall_median=statistics.median(walls),
+                                  throughput=result["input_size"] / statistics.median(walls)) #bytes del .deb por segundo
+                report["results"].append(result)
+                state = f"{result["wall_median"]:.3f}s" if walls else f"ERROR {runs[-1]["error"]}"
+                print(f"  {stage:<16} {state}", file=sys.stderr)
+    if not args.keep and not args.workdir:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banco de pruebas de rendimiento de Archimedes",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES), default=list(SHAPES), help="Formas de paquete a generar")
+    parser.add_argument("--member-compressions", nargs="+", choices=MEMBER_COMPRESSIONS, default=MEMBER_COMPRESSIONS,
+                        help="Compresión de control.tar y data.tar dentro del .deb")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Etapas a medir (\"convert\" es la conversión completa)")
+    parser.add_argument("--compression", default="zst", help="Compresión del paquete de salida")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplica el número y tamaño de los archivos (0.01 para una prueba rápida)")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla del contenido sintético")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de cada medición")
+    parser.add_argument("--workdir", default=None, help="Directorio donde se generan (y reutilizan) los .deb sintéticos")
+    parser.add_argument("--keep", action="store_true", help="No borra el directorio temporal al terminar")
+    parser.add_argument("-o", "--output", default=None, help="Archivo JSON de resultados (por defecto, la salida estándar)")
+    parser.add_argument("--measure", nargs=4, metavar=("ETAPA", "DEB", "DIRECTORIO", "OPCIONES"), help=argparse.SUPPRESS) #uso interno: proceso hijo
+    args = parser.parse_args()
+
+    if args.measure:
+        stage, deb, output_dir, options = args.measure
+        print(json.dumps(measure(stage, deb, output_dir, json.loads(options))))
+        return
+    if args.repeat < 1:
+        parser.error("--repeat debe ser al menos 1")
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:ai:et:sw=4:ts=4:sts=4:tw=78:fenc=utf-8
@@ -0,0 +1,50 @@
+"""Pruebas de Archimedes.
+
+El script no es un módulo importable (tiene un guion en el nombre y sus
+datos van junto a él), así que se carga desde su ruta una sola vez"""
+import importlib.util
+import io
+import os
+import sys
+import tarfile
+
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "archimedes")
+
+
+def load_converter():
+    if "archimedes_converter" in sys.modules:
+        return sys.modules["archimedes_converter"]
+    if SCRIPT_DIR not in sys.path: #DATA/deb_arch_equivalent_dependencies.py se importa desde ahí
+        sys.path.insert(0, SCRIPT_DIR)
+    spec = importlib.util.spec_from_file_location("archimedes_converter", os.path.join(SCRIPT_DIR, "archimedes-converter.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["archimedes_converter"] = module #dataclass necesita encontrar el módulo
+    spec.loader.exec_module(module)
+    return module
+
+
+converter = load_converter()
+
+
+def tar_gz(files:dict) -> bytes:
+    """tar.gz en memoria con {ruta: contenido}"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size, info.mode, info.mtime = len(content), 0o644, 1700000000
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def make_deb(path:str, package:str="demo", version:str="1.0-1", files:dict=None):
+    """Crea un .deb mínimo en "path" con los archivos {ruta: contenido} en data.tar.gz"""
+    control = (f"Package: {package}\nVersion: {version}\nArchitecture: amd64\n"
+               f"Installed-Size: 1\nMaintainer: Pruebas\nDescription: paquete de prueba\n").encode("utf-8")
+    members = [("debian-binary", b"2.0\n"), ("control.tar.gz", tar_gz({"./control": control})),
+               ("data.tar.gz", tar_gz(files or {"./usr/share/demo/README": b"hola\n"}))]
+    with open(path, "wb") as file:
+        file.write(b"!<arch>\n")
+        for name, content in members:
+            file.write(f"{name:<16}{1700000000:<12}0     0     100644  {len(content):<10}`\n".encode("ascii"))
+            file.write(content + (b"\n" if len(content) % 2 else b""))
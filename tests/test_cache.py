@@ -0,0 +1,65 @@
+"""Caché de conversiones: los aciertos enlazan el paquete guardado en la salida"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import converter, make_deb
+
+
+class ConversionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.deb = os.path.join(self.directory.name, "demo.deb")
+        make_deb(self.deb)
+        self.options = {"cache_dir": os.path.join(self.directory.name, "cache"), "sync_dir": "/nonexistent", "elf_deps": False}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def leftovers(self) -> list:
+        return [os.path.join(root, name) for root, _, files in os.walk(self.directory.name) for name in files if name.endswith(".tmp")]
+
+    def test_repeated_hits_leave_no_temporaries(self):
+        output = os.path.join(self.directory.name, "out", "demo.pkg.tar.zst")
+        os.makedirs(os.path.dirname(output))
+        results = [converter.Archimedes.convert_stream(self.deb, output, self.options) for _ in range(3)]
+        self.assertEqual([result.cached for result in results], [False, True, True])
+        self.assertEqual(self.leftovers(), [])
+        self.assertEqual(len({result.package_sha256 for result in results}), 1)
+
+    def test_new_deb_is_read_once(self):
+        output = os.path.join(self.directory.name, "demo.pkg.tar.zst")
+        calculate = converter.Archimedes.calculate_checksums
+        with mock.patch.object(converter.Archimedes, "calculate_checksums", autospec=True, side_effect=calculate) as checksums:
+            first = converter.Archimedes.convert_stream(self.deb, output, self.options)
+            self.assertEqual(checksums.call_count, 0) #sin acierto posible: la clave sale de la lectura de la conversión
+            second = converter.Archimedes.convert_stream(self.deb, output, self.options)
+            self.assertEqual(checksums.call_count, 1)
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(first.sha256, second.sha256)
+
+    def test_changed_deb_is_not_a_hit(self):
+        output = os.path.join(self.directory.name, "demo.pkg.tar.zst")
+        converter.Archimedes.convert_stream(self.deb, output, self.options)
+        make_deb(self.deb, version="2.0-1")
+        result = converter.Archimedes.convert_stream(self.deb, output, self.options)
+        self.assertFalse(result.cached)
+        self.assertEqual(result.version, "2.0_1") #el "-" de Debian no es válido en pkgver
+
+    def test_place_onto_the_same_file(self):
+        cache = converter.ConversionCache(self.options["cache_dir"], 1024 ** 3)
+        source = os.path.join(self.directory.name, "a")
+        with open(source, "wb") as file:
+            file.write(b"x")
+        destination = os.path.join(self.directory.name, "b")
+        os.link(source, destination)
+        cache._place(source, destination)
+        self.assertTrue(os.path.samefile(source, destination))
+        self.assertEqual(self.leftovers(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Compresión adaptativa del motor stream: el nivel solo cambia con rachas largas"""
+import os
+import random
+import tempfile
+import unittest
+
+from tests import converter, make_deb
+
+zstandard = converter.zstandard
+
+KIB = 1024
+
+
+def text(size:int, seed:int) -> bytes:
+    """Texto que se deja comprimir, distinto en cada miembro"""
+    words = random.Random(seed).choices([b"paquete", b"dependencia", b"version", b"archivo", b"arch", b"debian"], k=size // 6)
+    return b" ".join(words)[:size]
+
+
+def noise(size:int, seed:int) -> bytes:
+    """Bytes que no se dejan comprimir (como un PNG o un vídeo)"""
+    return random.Random(seed).randbytes(size)
+
+
+@unittest.skipIf(zstandard is None, "hace falta el módulo zstandard para contar las tramas")
+class AdaptiveCompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.options = {"cache": False, "sync_dir": "/nonexistent", "elf_deps": False, "compression": "zst", "level": 6}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def convert(self, files:dict, adaptive:bool):
+        deb = os.path.join(self.directory.name, "demo.deb")
+        make_deb(deb, files=files)
+        output = os.path.join(self.directory.name, f"demo-{adaptive}.pkg.tar.zst")
+        result = converter.Archimedes.convert_stream(deb, output, {**self.options, "adaptive": adaptive})
+        with open(output, "rb") as file:
+            return result, file.read()
+
+    def frames(self, data:bytes) -> int:
+        count = 0
+        while data:
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            decompressor.decompress(data)
+            data = decompressor.unused_data
+            count += 1
+        return count
+
+    def test_alternating_members_share_one_frame(self):
+        files = {}
+        for index in range(8): #miembros muestreados (>= ADAPTIVE_MIN_MEMBER) pero rachas de menos de ADAPTIVE_MIN_RUN
+            files[f"usr/share/demo/texto{index}.txt"] = text(300 * KIB, index)
+            files[f"usr/share/demo/imagen{index}.png"] = noise(300 * KIB, index)
+        result, package = self.convert(files, adaptive=True)
+        _, plain = self.convert(files, adaptive=False)
+        self.assertEqual(len(result.compression_policy["stored"]), 8)
+        self.assertEqual(result.compression_policy["switches"], 0)
+        self.assertEqual(self.frames(package), 1)
+        self.assertLessEqual(len(package), len(plain) * 1.01) #sin tramas de más, la tasa no empeora
+
+    def test_long_runs_change_the_level(self):
+        files = {"usr/share/demo/a.txt": text(2048 * KIB, 1),
+                 "usr/share/demo/b.png": noise(2048 * KIB, 2),
+                 "usr/share/demo/c.txt": text(2048 * KIB, 3)}
+        result, package = self.convert(files, adaptive=True)
+        self.assertEqual(result.compression_policy["switches"], 2)
+        self.assertEqual(self.frames(package), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Lectura del archivo control: parse_deb822, parse_relations y la traducción de versiones"""
+import unittest
+
+from tests import converter
+
+
+class ParseDeb822Test(unittest.TestCase):
+
+    def parse(self, text:str) -> list:
+        return list(converter.parse_deb822(text.splitlines(keepends=True)))
+
+    def test_fields_are_lowercase(self):
+        self.assertEqual(self.parse("Package: foo\nVersion: 1.0-1\n"), [{"package": "foo", "version": "1.0-1"}])
+
+    def test_continuation_lines(self):
+        paragraph, = self.parse("Description: resumen\n primera línea\n .\n\tsegunda línea\n")
+        self.assertEqual(paragraph["description"], "resumen\nprimera línea\n\nsegunda línea")
+
+    def test_comments_are_skipped(self):
+        self.assertEqual(self.parse("# comentario\nPackage: foo\n#otro\nDepends: a\n"), [{"package": "foo", "depends": "a"}])
+
+    def test_blank_lines_separate_paragraphs(self):
+        self.assertEqual(self.parse("Package: a\n\n\n\nPackage: b\r\n"), [{"package": "a"}, {"package": "b"}])
+
+    def test_line_without_colon_is_ignored(self):
+        self.assertEqual(self.parse("Package: foo\nbasura\nArchitecture: amd64\n"), [{"package": "foo", "architecture": "amd64"}])
+
+    def test_value_may_contain_colons(self):
+        self.assertEqual(self.parse("Homepage: https://example.org:8080/\n"), [{"homepage": "https://example.org:8080/"}])
+
+
+class ParseRelationsTest(unittest.TestCase):
+
+    def test_groups_and_alternatives(self):
+        self.assertEqual(converter.parse_relations("a (>= 1.0) | b, c"),
+                         [[("a", ">=", "1.0"), ("b", None, None)], [("c", None, None)]])
+
+    def test_continuation_lines_inside_field(self):
+        self.assertEqual(converter.parse_relations("a,\nb"), [[("a", None, None)], [("b", None, None)]])
+
+    def test_operators(self):
+        groups = converter.parse_relations("a (<< 1), b (<= 1), c (= 1), d (>= 1), e (>> 1), f (< 1), g (> 1)")
+        self.assertEqual([group[0][1] for group in groups], ["<", "<=", "=", ">=", ">", "<=", ">="])
+
+    def test_spacing_inside_parentheses(self):
+        self.assertEqual(converter.parse_relations("a(>=1.0)"), [[("a", ">=", "1.0")]])
+        self.assertEqual(converter.parse_relations("a ( >=  1.0 )"), [[("a", ">=", "1.0")]])
+
+    def test_architecture_qualifier_is_dropped(self):
+        self.assertEqual(converter.parse_relations("python3:any (>= 3.8~), Foo:amd64"),
+                         [[("python3", ">=", "3.8~")], [("foo", None, None)]])
+
+    def test_architecture_restrictions(self):
+        self.assertEqual(converter.parse_relations("a [amd64] | b, c [i386], d [!amd64] | e, f [!i386]", "amd64"),
+                         [[("a", None, None), ("b", None, None)], [], [("e", None, None)], [("f", None, None)]])
+
+    def test_restrictions_without_architecture_keep_everything(self):
+        self.assertEqual(converter.parse_relations("a [i386]"), [[("a", None, None)]])
+
+    def test_build_profiles_are_ignored(self):
+        self.assertEqual(converter.parse_relations("a [amd64] <!nocheck>, b (>= 2) <cross>", "amd64"),
+                         [[("a", None, None)], [("b", ">=", "2")]])
+
+    def test_empty_groups_are_skipped(self):
+        self.assertEqual(converter.parse_relations("a, , b,"), [[("a", None, None)], [("b", None, None)]])
+
+
+class VersionTranslationTest(unittest.TestCase):
+
+    def test_revision_joins_with_underscore(self):
+        self.assertEqual(converter.arch_version("1.0-2"), "1.0_2")
+        self.assertEqual(converter.arch_version("1:2.3-4ubuntu1"), "1:2.3_4ubuntu1")
+
+    def test_native_version_is_unchanged(self):
+        self.assertEqual(converter.arch_version("2.0~rc1"), "2.0~rc1")
+
+    def test_hyphens_in_upstream_version(self):
+        self.assertEqual(converter.arch_version("2.0-1-2"), "2.0_1_2")
+
+    def test_constraint_matches_converted_pkgver(self):
+        self.assertEqual(converter.arch_constraint("=", "1.0-2"), f"={converter.arch_version("1.0-2")}")
+        self.assertEqual(converter.arch_constraint("<", "2.0-1"), "<2.0_1")
+        self.assertEqual(converter.arch_constraint(">=", "1:2.3-4"), ">=1:2.3_4")
+
+    def test_no_constraint(self):
+        self.assertEqual(converter.arch_constraint(None, None), "")
+
+
+class ParseControlTest(unittest.TestCase):
+
+    CONTROL = ("Package: foo-plugin\n"
+               "Version: 1.0-2\n"
+               "Architecture: amd64\n"
+               "Installed-Size: 10\n"
+               "Depends: foo (= 1.0-2), bar (>= 3) | baz\n"
+               "Description: plugin\n"
+               " descripción larga\n")
+
+    def setUp(self):
+        #sin bases de datos de pacman: solo se aplica el mapeo de debian_to_arch
+        self.archimedes = converter.Archimedes({"sync_dir": "/nonexistent", "quiet": True})
+
+    def test_sibling_pin_matches_converted_version(self):
+        info = self.archimedes.parse_control(self.CONTROL)
+        self.assertEqual(info["version"], "1.0_2")
+        self.assertIn(f"foo={info["version"]}", info["depends"])
+
+    def test_first_alternative_without_databases(self):
+        self.assertIn("bar>=3", self.archimedes.parse_control(self.CONTROL)["depends"])
+
+    def test_description_is_the_summary(self):
+        self.assertEqual(self.archimedes.parse_control(self.CONTROL)["description"], "plugin")
+
+
+if __name__ == "__main__":
+    unittest.main()
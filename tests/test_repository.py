@@ -0,0 +1,126 @@
+"""Repositorio de pacman: vercmp y PackageRepository.update"""
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+from tests import converter
+
+
+class VercmpTest(unittest.TestCase):
+
+    def assertOrder(self, older:str, newer:str):
+        self.assertEqual(converter.vercmp(older, newer), -1, f"{older} < {newer}")
+        self.assertEqual(converter.vercmp(newer, older), 1, f"{newer} > {older}")
+
+    def test_equal(self):
+        self.assertEqual(converter.vercmp("1.0-1", "1.0-1"), 0)
+        self.assertEqual(converter.vercmp("1.001", "1.1"), 0)
+
+    def test_numeric_segments(self):
+        self.assertOrder("1.9", "1.10")
+        self.assertOrder("1.0", "1.0.1")
+
+    def test_letters(self):
+        self.assertOrder("1.0a", "1.0")
+        self.assertOrder("1.0alpha", "1.0beta")
+        self.assertOrder("1.0a", "1.0.1")
+
+    def test_epoch(self):
+        self.assertOrder("2.0", "1:1.0")
+        self.assertEqual(converter.vercmp("0:1.0", "1.0"), 0)
+
+    def test_pkgrel_only_when_both_have_it(self):
+        self.assertOrder("1.0-1", "1.0-2")
+        self.assertEqual(converter.vercmp("1.0-2", "1.0"), 0)
+
+    def test_converted_revisions(self):
+        self.assertOrder("1.0_2-1", "1.0_10-1")
+        self.assertOrder("1.9_1-1", "1.10_1-1")
+
+
+class PackageRepositoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repository = converter.PackageRepository(self.directory.name, "local")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def result(self, package:str, version:str) -> dict:
+        pkginfo = {"package": package, "version": version, "description": package, "url": "", "architecture": "x86_64",
+                   "builddate": "1700000000", "installed-size": "1", "depends": [], "optdepends": [], "conflicts": [],
+                   "provides": [], "replaces": []}
+        return {"output": os.path.join(self.directory.name, f"{package}-{version}.pkg.tar.zst"), "size": 1,
+                "package_sha256": "0" * 64, "pkginfo": pkginfo, "files": [f"usr/share/{package}/"]}
+
+    def entries(self) -> list:
+        return sorted(self.repository.read_entries())
+
+    def test_newest_wins_within_a_run(self):
+        skipped = self.repository.update([self.result("foo", "1.10"), self.result("foo", "1.9")])
+        self.assertEqual(self.entries(), [f"foo-1.10-{converter.pkgrel}"])
+        self.assertEqual([entry[1] for entry in skipped], [f"1.9-{converter.pkgrel}"])
+
+    def test_existing_newer_version_is_kept(self):
+        self.repository.update([self.result("foo", "2.0")])
+        skipped = self.repository.update([self.result("foo", "1.0")])
+        self.assertEqual(self.entries(), [f"foo-2.0-{converter.pkgrel}"])
+        self.assertEqual(len(skipped), 1)
+
+    def test_older_version_is_replaced(self):
+        self.repository.update([self.result("foo", "1.0"), self.result("bar", "1.0")])
+        self.repository.update([self.result("foo", "1.1")])
+        self.assertEqual(self.entries(), [f"bar-1.0-{converter.pkgrel}", f"foo-1.1-{converter.pkgrel}"])
+
+    def test_filename_is_the_package_name(self):
+        self.repository.update([self.result("foo", "1.0")])
+        _, desc, _ = self.repository.read_entries()[f"foo-1.0-{converter.pkgrel}"]
+        self.assertEqual(self.repository.desc_field(desc, "FILENAME"), "foo-1.0.pkg.tar.zst")
+
+    def test_no_lockfile_is_left_for_repo_add(self):
+        self.repository.update([self.result("foo", "1.0")])
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "local.db.lck")))
+
+    def test_waits_for_repo_add_lockfile(self):
+        lock = os.path.join(self.directory.name, "local.db.lck")
+        open(lock, "w").close() #repo-add en marcha
+        with mock.patch.object(converter.PackageRepository, "LOCK_TIMEOUT", 0):
+            with self.assertRaises(converter.ArchimedesError):
+                self.repository.update([self.result("foo", "1.0")])
+        self.assertTrue(os.path.exists(lock)) #el de repo-add no se toca
+        self.assertFalse(os.path.exists(self.repository.db_path))
+
+    def test_entry_dates_are_the_builddate(self):
+        self.repository.update([self.result("foo", "1.0")])
+        with open(self.repository.db_path, "rb") as raw, converter.open_zstd_reader(raw) as plain, \
+             tarfile.open(fileobj=plain, mode="r|") as database:
+            self.assertEqual({member.mtime for member in database}, {1700000000})
+
+    def test_source_date_epoch_and_reproducible_database(self):
+        databases = []
+        for _ in range(2):
+            with tempfile.TemporaryDirectory() as directory:
+                repository = converter.PackageRepository(directory, "local", source_date_epoch=1600000000)
+                with mock.patch.object(converter.time, "time", return_value=len(databases)):
+                    repository.update([self.result("foo", "1.0"), self.result("bar", "2.0")])
+                with open(repository.db_path, "rb") as file:
+                    databases.append(file.read())
+        self.assertEqual(databases[0], databases[1])
+
+    def test_truncated_database_is_an_error(self):
+        self.repository.update([self.result("foo", "1.0")])
+        with open(self.repository.files_path, "rb") as file:
+            data = file.read()
+        with open(self.repository.files_path, "wb") as file:
+            file.write(data[:len(data) // 2])
+        for zstandard in (converter.zstandard, None): #con el módulo y con el comando "zstd"
+            with self.subTest(zstandard=zstandard), mock.patch.object(converter, "zstandard", zstandard):
+                with self.assertRaises((converter.ArchimedesError, tarfile.TarError)):
+                    self.repository.read_entries()
+
+
+if __name__ == "__main__":
+    unittest.main()